@@ -0,0 +1,87 @@
+''' Compares utils.extract with the two BeautifulSoup passes it replaced
+over a directory of saved pages, and times both.
+
+    python benchmarks/parse_parity.py PAGES_DIR
+
+Every file in PAGES_DIR is one page, named after its url percent-encoded
+with urllib.parse.quote(url, safe=""). Needs bs4 and nltk installed. '''
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from urllib.parse import unquote, urlparse, urljoin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from utils import extract
+from utils.tokenizer import nltk_tokenize
+
+
+def legacy_text(content):
+    return BeautifulSoup(content, "html.parser").get_text()
+
+
+def legacy_links(url, content):
+    soup = BeautifulSoup(content, "html.parser")
+    links = set()
+    ori = urlparse(url)
+    for link in soup.find_all(lambda tag: tag.name=='a' and tag.get("href")):
+        mod_link = link.get("href")
+        if mod_link[0] == "#":
+            continue
+        if urlparse(mod_link).scheme == "":
+            if ori.path == "":
+                mod_link = url + mod_link
+            else:
+                mod_link = urljoin(url, mod_link)
+        mod_parsed = urlparse(mod_link)
+        links.add(mod_parsed.scheme + "://" + mod_parsed.netloc + mod_parsed.path)
+    return links
+
+
+def tokens(text):
+    return list(nltk_tokenize(text))
+
+
+def main(pages_dir, backend):
+    extract.set_backend(backend)
+    pages = []
+    for name in sorted(os.listdir(pages_dir)):
+        with open(os.path.join(pages_dir, name), "rb") as page_file:
+            pages.append((unquote(name), page_file.read()))
+
+    mismatches = 0
+    legacy_time = new_time = 0
+    for url, content in pages:
+        start = time.perf_counter()
+        old_text = legacy_text(content)
+        old_links = legacy_links(url, content)
+        legacy_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        page = extract.extract_page(content)
+        new_links = set(extract.resolve_links(url, page.hrefs))
+        new_time += time.perf_counter() - start
+
+        if new_links != old_links:
+            mismatches += 1
+            print(f"Links differ for {url}: "
+                  f"missing {sorted(old_links - new_links)[:5]}, "
+                  f"extra {sorted(new_links - old_links)[:5]}")
+        elif tokens(page.text) != tokens(old_text):
+            mismatches += 1
+            print(f"Tokens differ for {url}")
+
+    print(f"{len(pages)} pages, {mismatches} mismatches.")
+    print(f"BeautifulSoup x2: {legacy_time:.3f}s, "
+          f"extract ({extract.backend}): {new_time:.3f}s")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("pages_dir")
+    parser.add_argument("--backend", default="auto")
+    args = parser.parse_args()
+    sys.exit(1 if main(args.pages_dir, args.backend) else 0)
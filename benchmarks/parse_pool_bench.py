@@ -0,0 +1,164 @@
+''' Measures how many pages per second the pipeline engine crawls with a
+pool of 1, 2, 4 and 8 parsing processes, against the threads engine that
+parses in the workers.
+
+    python benchmarks/parse_pool_bench.py [PAGES_DIR] [--pages N]
+        [--threads T]
+
+PAGES_DIR holds saved pages named after their percent-encoded url, as
+for parse_parity.py. Without it, N synthetic pages are generated. The
+pages are served from memory instead of the cache server, spread over
+HOSTS hosts with no politeness delay, and their links are not followed,
+so the engine, the frontier and the scraper are all that is timed. '''
+import os
+import sys
+import time
+import pickle
+import random
+import logging
+import tempfile
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from urllib.parse import unquote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests
+
+import scraper
+from crawler import Crawler
+from crawler.frontier import Frontier
+from crawler.pipeline import PipelineCrawler
+from crawler.worker import Worker
+from utils.config import Config
+from utils.response import Response
+
+# Hosts the pages are spread over, so the frontier hands out many at once
+HOSTS = 64
+
+
+def synthetic_pages(count):
+    random.seed(0)
+    words = [f"word{i}" for i in range(5000)] + list(scraper.stop_words_set)
+    pages = []
+    for i in range(count):
+        paragraphs = "".join(
+            f"<p>{' '.join(random.choices(words, k=80))}, don't stop.</p>"
+            for _ in range(20))
+        links = "".join(
+            f'<a href="/page/{random.randrange(10000)}.html">link</a>'
+            for _ in range(100))
+        pages.append((
+            f"https://www.ics.uci.edu/page/{i}.html",
+            f"<html><head><title>Page {i}</title>"
+            f"<script>var x = 1;</script></head>"
+            f"<body>{paragraphs}{links}</body></html>".encode()))
+    return pages
+
+
+class ServedPages(object):
+    ''' Answers downloads with the pages, as the cache server would. '''
+    def __init__(self, pages):
+        self.urls = list()
+        self.blobs = dict()
+        for i, (page_url, content) in enumerate(pages):
+            url = f"https://h{i % HOSTS}.ics.uci.edu/bench/{i}"
+            raw = requests.models.Response()
+            raw._content = content
+            raw.status_code = 200
+            raw.url = page_url
+            raw.headers["Content-Type"] = "text/html"
+            self.urls.append(url)
+            self.blobs[url] = pickle.dumps(raw)
+
+    def download(self, url):
+        resp = Response(
+            {"url": url, "status": 200, "response": self.blobs[url]})
+        resp.latency = 0.0
+        return resp
+
+
+class SeedFrontier(Frontier):
+    ''' Crawls the seed urls only. '''
+    def add_urls(self, urls, parent=None):
+        if parent is None:
+            super().add_urls(urls, parent)
+
+
+class ServedPipelineCrawler(PipelineCrawler):
+    def __init__(self, config, restart, served):
+        self.served = served
+        super().__init__(config, restart, SeedFrontier)
+
+    def _make_worker(self, worker_id, config, frontier):
+        worker = super()._make_worker(worker_id, config, frontier)
+        worker.downloader.download = self.served.download
+        return worker
+
+
+def bench_config(directory, served, threads, processes):
+    cparser = ConfigParser()
+    cparser.read(os.path.join(ROOT, "config.ini"))
+    settings = {
+        "SAVE": os.path.join(directory, f"bench{processes}.db"),
+        "SEEDURL": ",".join(served.urls), "POLITENESS": "0",
+        "ROBOTS": "false", "RATECONTROL": "false", "STATEINTERVAL": "0",
+        "SEGMENTBYTES": "0", "REVISITINTERVAL": "0",
+        "THREADCOUNT": str(threads), "PARSEPROCESSES": str(processes)}
+    for key, value in settings.items():
+        sections = [
+            section for section in cparser.sections()
+            if key in cparser[section]] or ["LOCAL PROPERTIES"]
+        cparser[sections[0]][key] = value
+    return Config(cparser)
+
+
+def timed_crawl(crawler, pages):
+    start = time.perf_counter()
+    crawler.start()
+    return pages / (time.perf_counter() - start)
+
+
+def main(pages_dir, count, threads, process_counts):
+    if pages_dir:
+        pages = []
+        for name in sorted(os.listdir(pages_dir)):
+            with open(os.path.join(pages_dir, name), "rb") as page_file:
+                pages.append((unquote(name), page_file.read()))
+    else:
+        pages = synthetic_pages(count)
+    served = ServedPages(pages)
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+
+        def served_worker(worker_id, config, frontier):
+            worker = Worker(worker_id, config, frontier)
+            worker.downloader.download = served.download
+            return worker
+
+        config = bench_config(directory, served, threads, 1)
+        rate = timed_crawl(
+            Crawler(config, True, SeedFrontier, served_worker), len(pages))
+        print(f"threads engine, {threads} threads: {rate:.1f} pages/sec")
+
+        for processes in process_counts:
+            config = bench_config(directory, served, threads, processes)
+            rate = timed_crawl(
+                ServedPipelineCrawler(config, True, served), len(pages))
+            print(f"pipeline engine, {threads} threads, {processes} "
+                  f"processes: {rate:.1f} pages/sec")
+        os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("pages_dir", nargs="?")
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument(
+        "--processes", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    main(args.pages_dir, args.pages, args.threads, args.processes)
@@ -0,0 +1,546 @@
+''' Replays a crawl offline against a local stand-in for the cache server,
+so crawler throughput can be measured and compared between changes.
+
+    python benchmarks/replay.py synth CORPUS [--pages N] [--hosts N]
+    python benchmarks/replay.py record CORPUS [--pages N]
+    python benchmarks/replay.py serve CORPUS [--port P]
+    python benchmarks/replay.py run CORPUS [--set KEY=VALUE ...]
+        [--compare "KEY=VALUE ..." ...] [--latency MS] [--budget PAGES]
+        [--recrawl] [--nodes N] [--json FILE]
+
+A corpus holds the cache server's cbor answer for every url of a crawl.
+synth generates one for a made up site under the seed urls, record saves
+the answers of the real cache server during a crawl. serve answers the
+q/u requests of utils.download from a corpus like the cache server does;
+urls missing from it get a 404.
+
+run crawls the corpus with the full Crawler of each configuration, in a
+process of its own and without registering with the cache server. The
+settings come from --config_file with the --set overrides, and every
+--compare adds one configuration with further overrides. For each it
+reports pages/sec, p50 and p99 of the download, scrape and frontier
+stages (the scrape stage is not measured for ENGINE=pipeline, which parses
+in other processes), and the peak RSS. It also counts the useful pages:
+those that were neither near duplicates nor too thin to count. With
+--budget the crawl stops after that many pages, which shows how well the
+frontier's priority spends a crawl budget. With --recrawl every crawl is
+followed by a refresh crawl (launch.py --recrawl) of the same corpus, with
+every page due, which shows what a refresh of unchanged pages costs. With
+--nodes every crawl runs as a cluster of that many processes (see
+crawler/cluster.py), and the pages and pages/sec are those of the whole
+cluster. '''
+import os
+import sys
+import json
+import time
+import struct
+import pickle
+import random
+import socket
+import string
+import resource
+import tempfile
+import threading
+import subprocess
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import cbor
+import requests
+
+MAGIC = b"CORPUS1\n"
+RECORD = struct.Struct("<II")
+
+# Stages timed by run, in the order they are reported
+STAGES = ("download", "scrape", "frontier")
+
+
+# ------------------------------ CORPUS ------------------------------
+
+class CorpusWriter(object):
+    def __init__(self, path):
+        self.corpus_file = open(path, "wb")
+        self.corpus_file.write(MAGIC)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, url, answer):
+        url = url.encode("utf-8")
+        with self.lock:
+            self.corpus_file.write(RECORD.pack(len(url), len(answer)))
+            self.corpus_file.write(url)
+            self.corpus_file.write(answer)
+            self.corpus_file.flush()
+            self.count += 1
+
+    def close(self):
+        self.corpus_file.close()
+
+
+def load_corpus(path):
+    ''' Returns the url -> cbor answer mapping of a corpus file. '''
+    answers = dict()
+    with open(path, "rb") as corpus_file:
+        data = corpus_file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a corpus file.")
+    offset = len(MAGIC)
+    while offset < len(data):
+        url_length, answer_length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        url = data[offset:offset + url_length].decode("utf-8")
+        offset += url_length
+        answers[url] = data[offset:offset + answer_length]
+        offset += answer_length
+    return answers
+
+
+# This function will build the cbor answer of the cache server for a page
+def cache_answer(url, status, content=b"", content_type="text/html"):
+    raw = requests.models.Response()
+    raw.status_code = status
+    raw.url = url
+    raw._content = content
+    raw.headers["Content-Type"] = content_type
+    raw.encoding = "utf-8"
+    return cbor.dumps(
+        {"url": url, "status": status, "response": pickle.dumps(raw)})
+
+
+def synth_corpus(path, config, pages, extra_hosts=0):
+    ''' Writes a corpus for a made up site of about pages pages, spread
+    over the seed hosts and some subdomains, plus extra_hosts more. It
+    mixes in what a real crawl meets: near duplicate pages, pdfs, missing
+    pages, thin pages and archives that page on and on without saying
+    anything new. '''
+    random.seed(0)
+    # Words of letters only: the tokenizer drops digits, so term1 and
+    # term2 would both be "term"
+    vocabulary = set()
+    while len(vocabulary) < 20000:
+        vocabulary.add("".join(random.choices(
+            string.ascii_lowercase, k=random.randint(3, 10))))
+    vocabulary = sorted(vocabulary)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    seeds = [seed.rstrip("/") for seed in config.seed_urls]
+    hosts = [urlparse(seed).netloc for seed in seeds] + [
+        f"{name}.ics.uci.edu" for name in
+        ("vision", "wics", "hpi", "ngs", "cml", "sli", "mlphysics", "cert")
+        ] + [f"lab{i}.ics.uci.edu" for i in range(extra_hosts)]
+    sections = ["people", "research", "pub", "courses", "news"]
+    urls = seeds + [
+        f"https://{random.choice(hosts)}/{random.choice(sections)}/{i}"
+        for i in range(pages - len(seeds))]
+    texts = []
+
+    def links_for(url):
+        host = urlparse(url).netloc
+        links = random.sample(urls, min(len(urls), random.randint(5, 30)))
+        links += [f"https://{host}/files/{random.randrange(pages)}.pdf",
+                  f"https://www.google.com/search?q={random.randrange(pages)}",
+                  f"https://{host}/archive/page/{random.randrange(pages)}"]
+        return "".join(f'<a href="{link}">link</a>' for link in links)
+
+    writer = CorpusWriter(path)
+    for url in urls:
+        kind = random.random()
+        if kind < 0.03:
+            writer.add(url, cache_answer(url, 404, b"Not Found"))
+            continue
+        if kind < 0.08 and texts:
+            # a near duplicate of an earlier page
+            text = random.choice(texts)
+        elif kind < 0.12:
+            text = " ".join(random.choices(vocabulary, weights, k=20))
+        else:
+            text = " ".join(random.choices(
+                vocabulary, weights, k=random.randint(200, 1500)))
+            texts.append(text)
+        body = (f"<html><head><title>{url}</title></head><body>"
+                f"<p>{text}</p>{links_for(url)}</body></html>")
+        writer.add(url, cache_answer(url, 200, body.encode("utf-8")))
+    for host in hosts:
+        for i in range(pages // 50):
+            url = f"https://{host}/files/{i}.pdf"
+            writer.add(url, cache_answer(
+                url, 200, b"%PDF-1.4" + b"0" * 50000, "application/pdf"))
+    # Archives of the same few posts, where every page links to the next
+    posts = " ".join(random.choices(vocabulary, weights, k=300))
+    for host in hosts:
+        for page in range(pages):
+            url = f"https://{host}/archive/page/{page}"
+            body = (f"<html><body><p>Page {page}. {posts}</p>"
+                    f'<a href="https://{host}/archive/page/{page + 1}">next</a>'
+                    f"</body></html>")
+            writer.add(url, cache_answer(url, 200, body.encode("utf-8")))
+    writer.close()
+    return writer.count
+
+
+# --------------------------- STAND-IN SERVER ---------------------------
+
+class StandInHandler(BaseHTTPRequestHandler):
+    ''' Answers GET /?q=url&u=user_agent like the cache server. '''
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, which Nagle's algorithm
+    # would hold back for the client's delayed ack
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        url = query.get("q", [""])[0]
+        answer = self.server.answer(url)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, answers, port=0, latency=0, upstream=None):
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.answers = answers
+        self.latency = latency
+        self.missing = cbor.dumps(
+            {"url": "", "status": 404, "error": "Not in the corpus."})
+        # (cache server, user agent, corpus writer) to pass the requests
+        # on to and record the answers of, instead of answering them
+        self.upstream = upstream
+        # A session is not thread safe, each handler thread gets its own
+        self.sessions = threading.local()
+
+    def answer(self, url):
+        if self.upstream is not None:
+            return self._record(url)
+        return self.answers.get(url, self.missing)
+
+    def _record(self, url):
+        (host, port), user_agent, writer = self.upstream
+        session = getattr(self.sessions, "session", None)
+        if session is None:
+            session = self.sessions.session = requests.Session()
+        resp = session.get(
+            f"http://{host}:{port}/", params=[("q", url), ("u", user_agent)])
+        if resp.status_code < 400 and resp.content:
+            writer.add(url, resp.content)
+        return resp.content
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self.server_address
+
+
+# ------------------------------- CRAWLS -------------------------------
+
+def load_config(config_file, overrides):
+    from utils.config import Config
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    for override in overrides:
+        key, value = override.split("=", 1)
+        key = key.strip().upper()
+        sections = [
+            section for section in cparser.sections()
+            if key in cparser[section]] or ["LOCAL PROPERTIES"]
+        cparser[sections[0]][key] = value.strip()
+    return Config(cparser)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def timed(function, samples):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    return wrapper
+
+
+def crawl(cache_server, config_file, overrides, budget=0, recrawl=False):
+    ''' Crawls once in this process from the stand-in at cache_server and
+    returns the results. Stops after budget pages if budget is set. With
+    recrawl, refreshes the crawl saved in the working directory instead of
+    starting from the seeds. '''
+    import scraper
+    from utils.traps import TrapDetector
+    from utils.metrics import metrics
+    from utils.download import Downloader
+    from utils.async_download import AsyncDownloader
+    from crawler.frontier import Frontier
+    from crawler.engines import get_crawler_class
+
+    from crawler.cluster import configure_node
+
+    config = load_config(config_file, overrides)
+    config.save_file = os.path.join(os.getcwd(), "replay.db")
+    configure_node(config)
+    config.recrawl = recrawl
+    # No registration: the stand-in is the cache server
+    config.cache_server = cache_server
+
+    # Stage timings, appended to from every worker. Every url marked
+    # complete is a crawled page.
+    stages = {"download": [], "scrape": [], "frontier": []}
+    pages = []
+    # Pages counted by the scraper, see record_page
+    useful = []
+
+    def downloaded(resp):
+        stages["download"].append(resp.latency)
+        return resp
+
+    sync_download = Downloader.download
+    Downloader.download = lambda self, url: downloaded(
+        sync_download(self, url))
+    async_download = AsyncDownloader.download
+
+    async def download_async(self, url):
+        return downloaded(await async_download(self, url))
+    AsyncDownloader.download = download_async
+
+    mark_url_complete = Frontier.mark_url_complete
+
+    def completed(self, url, resp=None):
+        pages.append(url)
+        return mark_url_complete(self, url, resp)
+    Frontier.mark_url_complete = timed(completed, stages["frontier"])
+    if budget:
+        poll_tbd_url = Frontier.poll_tbd_url
+        Frontier.poll_tbd_url = lambda self: (
+            (None, None) if len(pages) >= budget else poll_tbd_url(self))
+    record = TrapDetector.record
+
+    def recorded(self, url, is_useful, new_words=0):
+        if is_useful:
+            useful.append(url)
+        return record(self, url, is_useful, new_words)
+    TrapDetector.record = recorded
+    Frontier.add_urls = timed(Frontier.add_urls, stages["frontier"])
+    if config.engine == "pipeline":
+        # The pages are parsed in the pool's processes, where the samples
+        # would not reach this one, so the stage is not measured
+        del stages["scrape"]
+    else:
+        scraper.scraper = timed(scraper.scraper, stages["scrape"])
+
+    start = time.perf_counter()
+    get_crawler_class(config.engine)(config, not recrawl).start()
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "pages": len(pages),
+        "unique": len(scraper.unique_url),
+        "useful": len(useful),
+        "words": len(scraper.word_freq),
+        # Pages a refresh crawl found unchanged and did not scrape
+        "unchanged": metrics.snapshot()["counters"].get(
+            "recrawl.unchanged", 0),
+        "seconds": elapsed,
+        "pages_per_sec": len(pages) / elapsed,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children_peak_rss_mb": resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+    for stage in STAGES:
+        samples = stages.get(stage)
+        for name, fraction in (("p50", 0.50), ("p99", 0.99)):
+            result[f"{stage}_{name}_ms"] = (
+                percentile(samples, fraction) * 1000
+                if samples is not None else None)
+    return result
+
+
+def report(result):
+    print(f"{result['label']}: {result['pages']} pages in "
+          f"{result['seconds']:.1f}s, "
+          f"{result['pages_per_sec']:.1f} pages/sec, "
+          f"{result['useful']} useful, {result['words']} words, "
+          + (f"{result['unchanged']} unchanged, " if result["unchanged"]
+             else "")
+          + f"peak RSS {result['peak_rss_mb']:.0f} MB"
+          + (f" (+{result['children_peak_rss_mb']:.0f} MB in children)"
+             if result["children_peak_rss_mb"] else ""))
+    for stage in STAGES:
+        if result[f"{stage}_p50_ms"] is None:
+            print(f"  {stage:>8}: not measured")
+            continue
+        print(f"  {stage:>8}: p50 {result[f'{stage}_p50_ms']:7.2f}ms  "
+              f"p99 {result[f'{stage}_p99_ms']:7.2f}ms")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def merge_results(results):
+    ''' Returns the result of a cluster from those of its nodes. '''
+    merged = dict(results[0])
+    for key in ("pages", "unique", "useful", "unchanged", "peak_rss_mb",
+                "children_peak_rss_mb"):
+        merged[key] = sum(result[key] for result in results)
+    merged["words"] = max(result["words"] for result in results)
+    merged["seconds"] = max(result["seconds"] for result in results)
+    merged["pages_per_sec"] = merged["pages"] / merged["seconds"]
+    for key in merged:
+        if key.endswith("_ms") and merged[key] is not None:
+            merged[key] = sum(result[key] for result in results) / len(results)
+    return merged
+
+
+def run(corpus, config_file, common, configurations, latency, verbose,
+        budget=0, recrawl=False, nodes=1):
+    # The stand-in runs in this process, so it takes neither CPU time nor
+    # memory from the crawls it is measuring.
+    server = StandInServer(load_corpus(corpus), latency=latency)
+    host, port = server.start()
+    if recrawl:
+        # Every page is due by the time the refresh crawl starts
+        common = common + ["REVISITINTERVAL=0.001"]
+    results = []
+    for overrides in configurations:
+        label = " ".join(overrides) or "config"
+        passes = [(label, [])]
+        if recrawl:
+            passes.append((f"{label} (recrawl)", ["--recrawl"]))
+        with tempfile.TemporaryDirectory() as directory:
+            for pass_label, flags in passes:
+                # A fresh process per crawl, or per node of a cluster, so
+                # the scraper state and the peak RSS are its own. Logs go
+                # to the temporary directory.
+                node_overrides = [[]]
+                if nodes > 1:
+                    addresses = ",".join(
+                        f"127.0.0.1:{free_port()}" for _ in range(nodes))
+                    node_overrides = [
+                        [f"NODES={addresses}", f"NODEID={node}"]
+                        for node in range(nodes)]
+                children = [subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), "crawl",
+                     f"{host}:{port}",
+                     "--config_file", os.path.abspath(config_file),
+                     f"--budget={budget}"] + flags
+                    + [f"--set={override}"
+                       for override in common + overrides + node],
+                    cwd=directory, stdout=subprocess.PIPE,
+                    stderr=None if verbose else subprocess.DEVNULL)
+                    for node in node_overrides]
+                outputs = [child.communicate()[0] for child in children]
+                failed = [child.returncode for child in children
+                          if child.returncode != 0]
+                if failed:
+                    print(f"{pass_label}: crawl failed with exit code "
+                          f"{failed[0]}")
+                    break
+                result = merge_results([
+                    json.loads(output.decode().strip().splitlines()[-1])
+                    for output in outputs])
+                result["label"] = pass_label
+                results.append(result)
+                report(result)
+    server.shutdown()
+    return results
+
+
+def record(corpus, config_file, overrides, pages):
+    ''' Crawls through the real cache server and saves its answers. '''
+    from utils.server_registration import get_cache_server
+    from crawler import Crawler
+
+    config = load_config(config_file, overrides)
+    writer = CorpusWriter(corpus)
+    with tempfile.TemporaryDirectory() as directory:
+        config.save_file = os.path.join(directory, "record.db")
+        upstream = get_cache_server(config, True)
+        server = StandInServer(
+            {}, upstream=(upstream, config.user_agent, writer))
+        config.cache_server = server.start()
+        crawler = Crawler(config, True)
+        crawler.start_async()
+        while (writer.count < pages
+               and any(worker.is_alive() for worker in crawler.workers)):
+            time.sleep(1)
+        server.shutdown()
+        writer.close()
+    print(f"Recorded {writer.count} answers to {corpus}.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "command", choices=["synth", "record", "serve", "run", "crawl"])
+    parser.add_argument("corpus")
+    parser.add_argument("--config_file", default=os.path.join(REPO, "config.ini"))
+    parser.add_argument("--set", action="append", default=[],
+                        help="KEY=VALUE override of config.ini")
+    parser.add_argument("--compare", action="append", default=[],
+                        help="one configuration, as space separated KEY=VALUE")
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--hosts", type=int, default=0,
+                        help="subdomains synth adds to the made up site")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="milliseconds the stand-in waits per answer")
+    parser.add_argument("--budget", type=int, default=0,
+                        help="pages after which each crawl stops")
+    parser.add_argument("--recrawl", action="store_true",
+                        help="follow each crawl with a refresh crawl")
+    parser.add_argument("--nodes", type=int, default=1,
+                        help="crawler processes of a cluster per crawl")
+    parser.add_argument("--json", help="file to write the results to")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "synth":
+        config = load_config(args.config_file, args.set)
+        count = synth_corpus(args.corpus, config, args.pages, args.hosts)
+        print(f"Wrote {count} answers to {args.corpus}.")
+    elif args.command == "record":
+        record(args.corpus, args.config_file, args.set, args.pages)
+    elif args.command == "serve":
+        server = StandInServer(
+            load_corpus(args.corpus), args.port, args.latency / 1000)
+        print(f"Serving {len(server.answers)} answers on "
+              f"{server.server_address[0]}:{server.server_address[1]}.")
+        server.serve_forever()
+    elif args.command == "crawl":
+        # One configuration in this process, see run. The corpus argument
+        # is the host:port of the stand-in here.
+        host, port = args.corpus.rsplit(":", 1)
+        print(json.dumps(crawl(
+            (host, int(port)), args.config_file, args.set, args.budget,
+            args.recrawl)))
+    else:
+        configurations = [
+            compare.split() for compare in args.compare] or [[]]
+        results = run(args.corpus, args.config_file, args.set, configurations,
+                      args.latency / 1000, args.verbose, args.budget,
+                      args.recrawl, args.nodes)
+        if args.json:
+            with open(args.json, "w") as json_file:
+                json.dump(results, json_file, indent=2)
+        expected = len(configurations) * (2 if args.recrawl else 1)
+        sys.exit(0 if len(results) == expected else 1)
@@ -0,0 +1,83 @@
+''' Times utils.tokenizer against the tokenizing code the scraper used
+before it, and checks that both give the same tokens.
+
+    python benchmarks/tokenizer_bench.py [TEXT_FILE ...]
+
+Without arguments a synthetic page is generated. Needs nltk and its
+punkt data installed. '''
+import os
+import re
+import sys
+import time
+import random
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nltk.tokenize import word_tokenize
+from utils.tokenizer import tokenize
+
+SAMPLE_WORDS = [
+    "the", "crawler", "don't", "it's", "e-mail", "U.S.", "cannot", "ics.uci.edu",
+    "(section)", "a,b", "12,000", "wait...", "--", "naïve", "we'll", "'quoted'",
+    "\"double\"", "Prof.", "end.", "semi;colon", "http://www.ics.uci.edu/a?b=c",
+    "#anchor", "$5", "100%", "O'Neil", "can't", "yes!", "why?", "[1]", "x*y",
+    "CS121", "information", "retrieval", "Computer", "Science", "it’s",
+    "don’t", "hello—world", "1990–2000", "`quote`", "``tick''", "“double”",
+    "‘single’", "«guill»", "O’Neil"]
+
+
+# The tokenizing code of scraper.extract_content before utils.tokenizer
+def legacy_tokenize(text):
+    text = word_tokenize(text)
+    for i in range(len(text)):
+        text[i] = re.sub(r'[^a-zA-Z]', '', text[i])
+        text[i] = text[i].lower()
+        if len(text[i]) == 1:
+            text[i] = ""
+    while "" in text:
+        text.remove("")
+    return text
+
+
+def timed(function, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = list(function(text))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main(paths, words, repeat):
+    if paths:
+        texts = []
+        for path in paths:
+            with open(path, encoding="utf-8", errors="replace") as text_file:
+                texts.append((path, text_file.read()))
+    else:
+        random.seed(0)
+        texts = [(f"synthetic {words} words",
+                  " ".join(random.choice(SAMPLE_WORDS) for _ in range(words)))]
+
+    mismatches = 0
+    for name, text in texts:
+        old, old_time = timed(legacy_tokenize, text, repeat)
+        new, new_time = timed(tokenize, text, repeat)
+        same = old == new
+        mismatches += not same
+        print(f"{name}: {len(new)} tokens, legacy {old_time * 1000:.1f}ms, "
+              f"tokenizer {new_time * 1000:.1f}ms "
+              f"({old_time / max(new_time, 1e-9):.1f}x), "
+              f"{'same output' if same else 'OUTPUT DIFFERS'}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument("--words", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(1 if main(args.paths, args.words, args.repeat) else 0)
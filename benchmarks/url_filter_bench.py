@@ -0,0 +1,123 @@
+''' Times utils.url_filter against the regex checks scraper.is_valid and
+scraper.safty_check used before it, checks that both agree, and counts
+the rejection reasons.
+
+    python benchmarks/url_filter_bench.py [URLS_FILE] [--count N]
+
+URLS_FILE holds one recorded url per line. Without it, --count urls are
+generated from a mix of typical ics.uci.edu links. '''
+import os
+import re
+import sys
+import time
+import random
+from argparse import ArgumentParser
+from collections import Counter
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.url_filter import UrlClassifier
+
+HOSTS = ["www.ics.uci.edu", "www.cs.uci.edu", "www.informatics.uci.edu",
+         "www.stat.uci.edu", "vision.ics.uci.edu", "wiki.ics.uci.edu",
+         "www.google.com", "github.com", "grape.ics.uci.edu"]
+SEGMENTS = ["people", "faculty", "research", "events", "calendar", "doku.php",
+            "Family", "courses", "cs121", "pub", "papers", "2019", "index",
+            "about", "news", "a", "b", "c"]
+ENDINGS = ["", "/", ".html", ".pdf", ".jpg", ".php", ".zip", ".txt", ".htm",
+           ".tar.gz", ".JPEG", ".ppsx"]
+
+
+# The checks of scraper.is_valid and scraper.safty_check before utils.url_filter
+def legacy_is_valid(url):
+    parsed = urlparse(url)
+    if parsed.scheme not in set(["http", "https"]):
+        return False
+    if parsed.netloc is None:
+        return False
+    if parsed.fragment != "":
+        return False
+    if not re.match(r".*\.(ics.uci.edu|cs.uci.edu|informatics.uci.edu|stat.uci.edu|today.uci.edu/department/information_computer_sciences)", parsed.netloc):
+        return False
+    if re.match(
+        r".*\.(css|js|bmp|gif|jpe?g|ico"
+        + r"|png|tiff?|mid|mp2|mp3|mp4"
+        + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+        + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+        + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
+        + r"|epub|dll|cnf|tgz|sha1"
+        + r"|thmx|mso|arff|rtf|jar|csv"
+        + r"|rm|smil|wmv|swf|wma|zip|rar|gz|bw|gtf"
+        + r"|ppsx|txt|pdf|php|odp|h|cc|py|ova|apk|m|tst|bat|nna|maf|xml|json|cpp|java)$", parsed.path.lower()):
+        return False
+    return True
+
+
+def legacy_safty_check(url):
+    parsed = urlparse(url)
+    if len(parsed.path) > 150:
+        return False
+    path_element = parsed.path.split("/")
+    path_element.remove("")
+    if len(path_element) != len(set(path_element)):
+        return False
+    if re.search(r"/events/|/events|/event/|/event", parsed.path):
+        return False
+    if re.search(r"/calendars/|/calendars|/calendar/|/calendar", parsed.path):
+        return False
+    if re.search(r"/Family/|/Family|/Families/|/Families", parsed.path):
+        return False
+    return True
+
+
+def synthetic_urls(count):
+    random.seed(0)
+    # Crawls see the same pages linked over and over, so draw from a pool
+    pool = []
+    for _ in range(max(1, count // 20)):
+        path = "/".join(random.choice(SEGMENTS)
+                        for _ in range(random.randint(0, 4)))
+        url = (f"{random.choice(['http', 'https', 'mailto'])}://"
+               f"{random.choice(HOSTS)}/{path}{random.choice(ENDINGS)}")
+        if random.random() < 0.05:
+            url += "#section"
+        pool.append(url)
+    return [random.choice(pool) for _ in range(count)]
+
+
+def main(urls_file, count):
+    if urls_file:
+        with open(urls_file) as urls:
+            urls = [line.strip() for line in urls if line.strip()]
+    else:
+        urls = synthetic_urls(count)
+
+    start = time.perf_counter()
+    legacy = [legacy_is_valid(url) and legacy_safty_check(url) for url in urls]
+    legacy_time = time.perf_counter() - start
+
+    classifier = UrlClassifier()
+    start = time.perf_counter()
+    reasons = [classifier.classify(url) or classifier.trap_reason(url)
+               for url in urls]
+    new_time = time.perf_counter() - start
+
+    mismatches = sum(
+        (reason is None) != accepted for reason, accepted in zip(reasons, legacy))
+    print(f"{len(urls)} urls, {mismatches} verdicts differ.")
+    print(f"legacy regexes: {legacy_time:.2f}s, "
+          f"UrlClassifier: {new_time:.2f}s "
+          f"({legacy_time / max(new_time, 1e-9):.1f}x)")
+    for reason, total in Counter(reasons).most_common():
+        print(f"  {reason or 'accepted'}: {total}")
+    print(classifier.cache_info())
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("urls_file", nargs="?")
+    parser.add_argument("--count", type=int, default=2000000)
+    args = parser.parse_args()
+    sys.exit(1 if main(args.urls_file, args.count) else 0)
@@ -0,0 +1,73 @@
+''' Compares the memory and lookup time of a set of url strings with
+utils.urlset.FingerprintSet, with and without its Bloom filter, and
+checks a saved set maps back in with the same urls.
+
+    python benchmarks/urlset_bench.py [--count N] [--bloom-bits B]
+
+Lookups are half for urls in the set and half for new ones, like the
+links a crawler checks. '''
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.urlset import FingerprintSet
+
+
+def make_urls(count, prefix):
+    return [f"https://www.ics.uci.edu/~{prefix}{i % 997}/pub/{i}/index.html"
+            for i in range(count)]
+
+
+def measure(name, factory, urls, lookups, keeps_urls=False):
+    tracemalloc.start()
+    url_set = factory()
+    for url in urls:
+        url_set.add(url)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    if keeps_urls:
+        # In a crawl the set is what keeps the url strings alive
+        size += sum(sys.getsizeof(url) for url in urls)
+
+    start = time.perf_counter()
+    found = sum(url in url_set for url in lookups)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>24}: {size / len(urls):6.1f} bytes/url, "
+          f"{len(lookups) / elapsed / 1e6:.2f}M lookups/sec, {found} found")
+    return url_set
+
+
+def main(count, bloom_bits):
+    urls = make_urls(count, "seen")
+    lookups = urls[::2] + make_urls(count // 2, "new")
+    measure("set of strings", set, urls, lookups, keeps_urls=True)
+    measure("FingerprintSet", FingerprintSet, urls, lookups)
+    url_set = measure(
+        f"FingerprintSet + bloom {bloom_bits}",
+        lambda: FingerprintSet(bloom_bits=bloom_bits), urls, lookups)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "urls.seen")
+        url_set.save(path)
+        start = time.perf_counter()
+        loaded = FingerprintSet(bloom_bits=bloom_bits)
+        loaded.load(path)
+        elapsed = time.perf_counter() - start
+        missing = sum(url not in loaded for url in urls)
+        loaded.close()
+    print(f"load of {os.path.basename(path)}: {elapsed * 1000:.1f}ms, "
+          f"{missing} urls missing")
+    return missing
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument("--bloom-bits", type=int, default=10)
+    args = parser.parse_args()
+    sys.exit(1 if main(args.count, args.bloom_bits) else 0)
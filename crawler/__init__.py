@@ -1,4 +1,6 @@
+import scraper
 from utils import get_logger
+from utils.metrics import start_reporting, stop_reporting
 from crawler.frontier import Frontier
 from crawler.worker import Worker
 
@@ -6,6 +8,8 @@ class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
         self.logger = get_logger("CRAWLER")
+        scraper.configure(config)
+        start_reporting(config)
         self.frontier = frontier_factory(config, restart)
         self.workers = list()
         self.worker_factory = worker_factory
@@ -24,3 +28,6 @@ class Crawler(object):
     def join(self):
         for worker in self.workers:
             worker.join()
+        self.frontier.close()
+        stop_reporting(self.config)
+
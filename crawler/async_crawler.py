@@ -0,0 +1,111 @@
+import time
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+import scraper
+from utils import get_logger
+from utils.async_download import AsyncDownloader
+from utils.metrics import metrics, start_reporting, stop_reporting
+from crawler.frontier import Frontier
+
+# Threads that make the frontier calls. The frontier serializes them on
+# its lock; more than one lets the work done outside it, like hashing a
+# page for the fetch history, overlap.
+FRONTIER_THREADS = 4
+
+# Threads that check urls against robots.txt, which may download it
+ROBOTS_THREADS = 16
+
+
+class AsyncCrawler(object):
+    ''' Crawls with one asyncio event loop instead of a thread per worker.
+    config.async_fetches fetchers run as tasks on the loop, so that many
+    downloads can be in flight at once. Parsing a page is CPU work and runs
+    in a pool of config.threads_count threads to keep the loop free.
+    Frontier calls take its lock and may wait for a commit to the save
+    file, and robots.txt checks may wait for a download, so both run on
+    executors of their own and never stall the loop or the parsing.
+    Politeness is left to the frontier: a fetcher that gets no url from
+    poll_tbd_url() sleeps on the loop until a host is ready. '''
+    def __init__(self, config, restart, frontier_factory=Frontier):
+        self.config = config
+        self.logger = get_logger("CRAWLER")
+        scraper.configure(config)
+        start_reporting(config)
+        self.frontier = frontier_factory(config, restart)
+
+    def start(self):
+        asyncio.run(self._crawl())
+        self.frontier.close()
+        stop_reporting(self.config)
+
+    async def _crawl(self):
+        downloader = AsyncDownloader(
+            self.config, self.config.async_fetches,
+            get_logger("AsyncDownloader", "Worker"))
+        self.frontier_executor = ThreadPoolExecutor(FRONTIER_THREADS)
+        self.robots_executor = ThreadPoolExecutor(
+            min(ROBOTS_THREADS, self.config.async_fetches))
+        with self.frontier_executor, self.robots_executor, \
+                ThreadPoolExecutor(self.config.threads_count) as executor:
+            await asyncio.gather(*[
+                self._fetcher(fetcher_id, downloader, executor)
+                for fetcher_id in range(self.config.async_fetches)])
+        await downloader.close()
+        self.logger.info("Frontier is empty. Stopping Crawler.")
+
+    async def _fetcher(self, fetcher_id, downloader, executor):
+        logger = get_logger(f"Fetcher-{fetcher_id}", "Worker")
+        loop = asyncio.get_running_loop()
+        while True:
+            start = time.perf_counter()
+            tbd_url, wait = await self._call_frontier(
+                self.frontier.poll_tbd_url)
+            metrics.record("frontier.get", time.perf_counter() - start)
+            if tbd_url is None:
+                if wait is None:
+                    break
+                await asyncio.sleep(wait)
+                continue
+            resp = None
+            try:
+                # robots.txt may have to be downloaded first, off the loop.
+                if not await loop.run_in_executor(
+                        self.robots_executor, self.frontier.can_fetch,
+                        tbd_url):
+                    logger.info(f"Skipped {tbd_url}, disallowed by robots.txt.")
+                    continue
+                resp = await downloader.download(tbd_url)
+                logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server} "
+                    f"in {resp.latency:.3f}s.")
+                if await self._call_frontier(
+                        self.frontier.fetch_unchanged, tbd_url, resp):
+                    logger.info(
+                        f"Skipped {tbd_url}, unchanged since the last visit.")
+                    continue
+                # Scraping is CPU work, keep it off the loop.
+                scraped_urls = await loop.run_in_executor(
+                    executor, self._scrape, tbd_url, resp)
+                await self._call_frontier(
+                    self.frontier.add_urls, scraped_urls, tbd_url)
+            except Exception:
+                logger.exception(f"Failed to crawl {tbd_url}.")
+                metrics.count("worker.errors")
+                # Not recorded in the fetch history, see Worker.run
+                resp = None
+            finally:
+                await self._call_frontier(
+                    self.frontier.mark_url_complete, tbd_url, resp)
+
+    def _call_frontier(self, method, *args):
+        return asyncio.get_running_loop().run_in_executor(
+            self.frontier_executor, method, *args)
+
+    def _scrape(self, tbd_url, resp):
+        start = time.perf_counter()
+        scraped_urls = scraper.scraper(tbd_url, resp)
+        metrics.record("scrape", time.perf_counter() - start)
+        return scraped_urls
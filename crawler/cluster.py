@@ -0,0 +1,505 @@
+import os
+import json
+import time
+import socket
+import struct
+import socketserver
+from bisect import bisect
+from hashlib import sha256
+from collections import Counter
+from threading import Thread, Lock, Condition, Event
+from urllib.parse import urlparse
+
+import scraper
+from utils import get_logger, get_urlfingerprint
+from utils.urlset import FingerprintSet
+from utils.metrics import metrics
+
+# Points each node takes on the hash ring, so hosts spread evenly
+RING_REPLICAS = 100
+
+# Messages are a 4 byte big endian length and that many bytes of json:
+#   {"op": "urls", "urls": [...]}  adds urls to the node's frontier
+#   {"op": "status"}               returns its idle flag and batch counters
+#   {"op": "stop"}                 ends its crawl and returns its statistics
+# Every message is answered, {"ok": true} unless it returns something.
+LENGTH = struct.Struct("!I")
+
+# Seconds between two termination checks of the coordinator
+CHECK_INTERVAL = 0.5
+
+# Seconds to wait before connecting to a node that was not reachable again
+RECONNECT_DELAY = 0.5
+
+# An outbox is emptied once all of it is acknowledged and it holds this
+# many bytes
+OUTBOX_COMPACT_BYTES = 1 << 20
+
+# Most common words of each node sent for the report. The whole vocabulary
+# can be millions of words; a word only misses counts from the nodes where
+# it is not among their REPORT_WORDS most common, which the top 100 words
+# of a crawl do not come close to.
+REPORT_WORDS = 1000
+
+
+def ring_hash(key):
+    # sha256 like get_urlhash, as a 64 bit position on the ring
+    return int.from_bytes(sha256(key.encode("utf-8")).digest()[:8], "big")
+
+
+# This function will give every node a save file and metrics port of its
+# own, so several nodes can run on one box from one config
+def configure_node(config):
+    if not config.nodes:
+        return
+    config.save_file = f"{config.save_file}.node{config.node_id}"
+    if config.metrics_port:
+        config.metrics_port += config.node_id
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(LENGTH.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    ''' Returns the next message, or None once the other side closed. '''
+    header = _recv_exactly(sock, LENGTH.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, LENGTH.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+def _recv_exactly(sock, size):
+    chunks = list()
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def request(address, message, timeout=10):
+    ''' Sends one message on a connection of its own and returns the
+    answer. Raises OSError if the node cannot be reached. '''
+    with socket.create_connection(address, timeout=timeout) as sock:
+        send_message(sock, message)
+        answer = recv_message(sock)
+    if answer is None:
+        raise ConnectionError(f"{address} closed the connection")
+    return answer
+
+
+class HashRing(object):
+    ''' Consistent hashing of hosts onto nodes. Each node takes
+    RING_REPLICAS points on a ring of 64 bit hashes and a host belongs to
+    the node of the first point after the hash of the host, so adding a
+    node only moves the hosts it takes over. '''
+    def __init__(self, node_count, replicas=RING_REPLICAS):
+        points = sorted(
+            (ring_hash(f"node-{node}-{replica}"), node)
+            for node in range(node_count) for replica in range(replicas))
+        self.points = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+        # Node of each host seen so far
+        self.owners = dict()
+
+    def owner(self, host):
+        node = self.owners.get(host)
+        if node is None:
+            position = bisect(self.points, ring_hash(host)) % len(self.points)
+            node = self.owners[host] = self.nodes[position]
+        return node
+
+
+class Peer(object):
+    ''' The urls waiting to be forwarded to another node, sent by a thread
+    of their own in batches of batch_size urls, or fewer once the oldest
+    has waited interval seconds. A batch leaves the buffer only once the
+    node has added it to its frontier and committed it, and is sent again
+    after a connection error.
+
+    Until then the urls are also kept in an outbox file, one per line,
+    with the bytes of it the node acknowledged in outbox_path.acked. The
+    outbox is fsynced before every frontier commit, so a page is never
+    saved as complete while the links it forwarded could still be lost,
+    and a resumed crawl sends the urls past the acknowledged ones again.
+    The node drops those it has already. '''
+    def __init__(self, cluster, node, address, outbox_path):
+        self.cluster = cluster
+        self.node = node
+        self.address = address
+        self.outbox_path = outbox_path
+        self.outbox = None
+        # Bytes at the start of the outbox the node acknowledged
+        self.acked = 0
+        self.buffer = list()
+        # Urls taken from the buffer and not yet acknowledged
+        self.in_flight = 0
+        self.oldest = None
+        self.closed = False
+        self.has_urls = Condition(Lock())
+        self.sock = None
+        self.thread = Thread(target=self._send_batches, daemon=True)
+
+    def open_outbox(self, resume):
+        ''' Opens the outbox, and on resume queues the urls in it that were
+        not acknowledged. '''
+        urls = list()
+        if resume and os.path.exists(self.outbox_path):
+            acked = 0
+            try:
+                with open(self.outbox_path + ".acked") as acked_file:
+                    acked = int(acked_file.read())
+            except (OSError, ValueError):
+                # Missing or cut short, so everything is sent again
+                pass
+            with open(self.outbox_path, "rb") as outbox:
+                outbox.seek(acked)
+                # The last line is empty, or was cut short by a crash
+                urls = outbox.read().decode("utf-8").split("\n")[:-1]
+        # Start the outbox over with only the urls left to send
+        temp_path = self.outbox_path + ".tmp"
+        with open(temp_path, "wb") as outbox:
+            outbox.write("".join(url + "\n" for url in urls).encode("utf-8"))
+            outbox.flush()
+            os.fsync(outbox.fileno())
+        os.replace(temp_path, self.outbox_path)
+        self._save_acked()
+        self.outbox = open(self.outbox_path, "ab")
+        if urls:
+            self.cluster.logger.info(
+                f"Forwarding {len(urls)} urls left from the last run to node "
+                f"{self.node} again.")
+            with self.has_urls:
+                self.buffer.extend(urls)
+                self.oldest = time.monotonic()
+
+    def add(self, url):
+        with self.has_urls:
+            if not self.buffer:
+                # The sender waits for the first url, then for a batch
+                self.oldest = time.monotonic()
+                self.has_urls.notify()
+            self.buffer.append(url)
+            self.outbox.write((url + "\n").encode("utf-8"))
+            if len(self.buffer) >= self.cluster.batch_size:
+                self.has_urls.notify()
+
+    def pending(self):
+        with self.has_urls:
+            return len(self.buffer) + self.in_flight
+
+    def flush(self):
+        ''' Makes the urls added so far durable. '''
+        with self.has_urls:
+            if self.outbox is not None:
+                self.outbox.flush()
+                os.fsync(self.outbox.fileno())
+
+    def close(self):
+        with self.has_urls:
+            self.closed = True
+            self.has_urls.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.sock is not None:
+            self.sock.close()
+        self.flush()
+        with self.has_urls:
+            if self.outbox is not None:
+                self.outbox.close()
+                self.outbox = None
+
+    def _next_batch(self):
+        with self.has_urls:
+            while True:
+                if self.closed:
+                    return None
+                if self.buffer:
+                    wait = self.oldest + self.cluster.interval - time.monotonic()
+                    if len(self.buffer) >= self.cluster.batch_size or wait <= 0:
+                        batch = self.buffer[:self.cluster.batch_size]
+                        del self.buffer[:len(batch)]
+                        self.in_flight = len(batch)
+                        self.oldest = time.monotonic()
+                        return batch
+                    self.has_urls.wait(wait)
+                else:
+                    self.has_urls.wait()
+
+    def _send_batches(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            while not self._send(batch):
+                time.sleep(RECONNECT_DELAY)
+                if self.closed:
+                    return
+            with self.has_urls:
+                self.in_flight = 0
+                self.acked += sum(
+                    len(url.encode("utf-8")) + 1 for url in batch)
+                if not self.buffer and self.acked >= OUTBOX_COMPACT_BYTES:
+                    self.outbox.truncate(0)
+                    self.acked = 0
+                self._save_acked()
+            self.cluster.batch_sent()
+
+    def _save_acked(self):
+        # Not fsynced: an offset lost in a crash only sends urls again
+        with open(self.outbox_path + ".acked", "w") as acked_file:
+            acked_file.write(str(self.acked))
+
+    def _send(self, batch):
+        start = time.perf_counter()
+        try:
+            if self.sock is None:
+                self.sock = socket.create_connection(self.address, timeout=30)
+            send_message(self.sock, {"op": "urls", "urls": batch})
+            if recv_message(self.sock) is None:
+                raise ConnectionError("connection closed")
+        except OSError as err:
+            self.cluster.logger.info(
+                f"Could not forward {len(batch)} urls to node {self.node} "
+                f"at {self.address[0]}:{self.address[1]}: {err}.")
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            return False
+        metrics.record("cluster.send", time.perf_counter() - start)
+        return True
+
+
+class ClusterHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        cluster = self.server.cluster
+        while True:
+            message = recv_message(self.request)
+            if message is None:
+                return
+            send_message(self.request, cluster.handle(message))
+
+
+class ClusterServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, cluster):
+        self.cluster = cluster
+        super().__init__(address, ClusterHandler)
+
+
+class Cluster(object):
+    ''' One node of a crawl split over the nodes listed in NODES, each
+    with a crawler process, save file and cache server connection of its
+    own. Every host belongs to one node (see HashRing), so each host's
+    politeness, robots.txt and statistics stay on one node. Links to
+    hosts of other nodes are forwarded to them in batches instead of
+    being queued.
+
+    Node 0 coordinates: it asks every node whether it is idle (nothing
+    queued, downloading or waiting to be forwarded) and how many url
+    batches it sent and received. When all nodes are idle in two checks
+    in a row, with as many batches received as sent and no batch moved in
+    between, no url can be in transit and the crawl is over. It then
+    stops the other nodes, merges their statistics with its own and logs
+    the report of the whole crawl. '''
+    def __init__(self, config):
+        self.config = config
+        self.logger = get_logger("CLUSTER")
+        self.node_id = config.node_id
+        self.addresses = config.nodes
+        if not 0 <= self.node_id < len(self.addresses):
+            raise ValueError(
+                f"Node {self.node_id} is not in NODES, expected 0 to "
+                f"{len(self.addresses) - 1}.")
+        self.ring = HashRing(len(self.addresses))
+        self.batch_size = config.forward_batch
+        self.interval = config.forward_interval
+        self.lock = Lock()
+        self.sent = 0
+        self.received = 0
+        self.frontier = None
+        self.finished = Event()
+        # Urls forwarded already, so links seen again are not sent again
+        self.forwarded = FingerprintSet(key=get_urlfingerprint)
+        self.peers = {
+            node: Peer(
+                self, node, address, f"{config.save_file}.outbox{node}")
+            for node, address in enumerate(self.addresses)
+            if node != self.node_id}
+        self.server = None
+        self.coordinator = None
+
+    def open(self, resume):
+        ''' Opens the outboxes of the other nodes. On resume, the urls they
+        did not acknowledge are forwarded again once started. '''
+        for peer in self.peers.values():
+            peer.open_outbox(resume)
+
+    def start(self, frontier):
+        ''' Starts taking urls for frontier from the other nodes. '''
+        self.frontier = frontier
+        self.server = ClusterServer(self.addresses[self.node_id], self)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        for peer in self.peers.values():
+            peer.thread.start()
+        if self.node_id == 0:
+            self.coordinator = Thread(target=self._coordinate, daemon=True)
+            self.coordinator.start()
+        self.logger.info(
+            f"Node {self.node_id} of {len(self.addresses)} listening on "
+            f"{self.addresses[self.node_id][0]}:"
+            f"{self.addresses[self.node_id][1]}.")
+
+    def owns(self, url):
+        return self.ring.owner(urlparse(url).netloc) == self.node_id
+
+    def forward(self, url):
+        ''' Queues url for the node that owns its host. '''
+        if self.forwarded.add(url):
+            self.peers[self.ring.owner(urlparse(url).netloc)].add(url)
+            metrics.count("cluster.forwarded")
+
+    def flush(self):
+        ''' Called before each frontier commit, see Peer. '''
+        for peer in self.peers.values():
+            peer.flush()
+
+    def batch_sent(self):
+        with self.lock:
+            self.sent += 1
+
+    def idle(self):
+        return self.frontier.idle() and not any(
+            peer.pending() for peer in self.peers.values())
+
+    def handle(self, message):
+        op = message.get("op")
+        if op == "urls":
+            self.frontier.add_urls(message["urls"])
+            # The sender forgets them once they are acknowledged
+            self.frontier.commit()
+            metrics.count("cluster.received", len(message["urls"]))
+            with self.lock:
+                self.received += 1
+            return {"ok": True}
+        if op == "status":
+            return self.status()
+        if op == "stop":
+            stats = node_stats()
+            self.finish()
+            return stats
+        return {"ok": False, "error": f"unknown op {op!r}"}
+
+    def status(self):
+        # The counters are read before the idle check, so a batch that
+        # arrives in between shows up in the next check.
+        with self.lock:
+            sent, received = self.sent, self.received
+        return {"idle": self.idle(), "sent": sent, "received": received}
+
+    def finish(self):
+        ''' Ends the crawl of this node: its workers stop once the frontier
+        has nothing left. '''
+        self.finished.set()
+        with self.frontier.lock:
+            self.frontier.has_work.notify_all()
+
+    def close(self):
+        for peer in self.peers.values():
+            peer.close()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _coordinate(self):
+        previous = None
+        while not self.finished.is_set():
+            time.sleep(CHECK_INTERVAL)
+            statuses = list()
+            for node, address in enumerate(self.addresses):
+                try:
+                    statuses.append(
+                        self.status() if node == self.node_id else
+                        request(address, {"op": "status"}))
+                except OSError:
+                    # Not started yet or gone, so not idle
+                    statuses.append(None)
+            if None in statuses or not all(
+                    status["idle"] for status in statuses):
+                previous = None
+                continue
+            counters = [
+                (status["sent"], status["received"]) for status in statuses]
+            balanced = (
+                sum(sent for sent, _ in counters)
+                == sum(received for _, received in counters))
+            if balanced and counters == previous:
+                self._stop_all()
+                return
+            previous = counters if balanced else None
+
+    def _stop_all(self):
+        stats = [node_stats()]
+        for node, address in enumerate(self.addresses):
+            if node == self.node_id:
+                continue
+            try:
+                stats.append(request(address, {"op": "stop"}))
+            except OSError as err:
+                self.logger.error(
+                    f"Could not stop node {node}, its statistics are "
+                    f"missing from the report: {err}.")
+        log_cluster_report(self.logger, merge_stats(stats))
+        self.finish()
+
+
+# This function will return the crawl statistics of this node for the
+# coordinator's report
+def node_stats():
+    words = dict(scraper.word_freq.most_common(REPORT_WORDS))
+    with scraper.stats_lock:
+        return {
+            "unique": len(scraper.unique_url),
+            "words": words,
+            "sub_domain": dict(scraper.sub_domain),
+            "longest": [scraper.long_url_words_count, scraper.longest_url],
+        }
+
+
+# This function will merge the statistics of the nodes. Each host belongs
+# to one node, so their unique urls and subdomains do not overlap.
+def merge_stats(stats):
+    words = Counter()
+    sub_domain = Counter()
+    unique = 0
+    longest = [0, None]
+    for node in stats:
+        unique += node["unique"]
+        words.update(node["words"])
+        sub_domain.update(node["sub_domain"])
+        if node["longest"][0] > longest[0]:
+            longest = node["longest"]
+    return {
+        "unique": unique, "words": words,
+        "sub_domain": dict(sorted(sub_domain.items())), "longest": longest,
+        "nodes": len(stats)}
+
+
+def log_cluster_report(logger, merged):
+    top_100 = dict(merged["words"].most_common(100))
+    logger.info(
+        f"Crawl of {merged['nodes']} nodes finished.\n"
+        f"Unique pages: {merged['unique']}.\nTop 100 words are {top_100}.\n"
+        f"Longest page is {merged['longest'][1]} with "
+        f"{merged['longest'][0]} words.\n"
+        f"Number of ics.uci.edu subdomain: {len(merged['sub_domain'])}. "
+        f"List below: {merged['sub_domain']}\n\n")
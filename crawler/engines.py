@@ -0,0 +1,18 @@
+from crawler import Crawler
+from crawler.async_crawler import AsyncCrawler
+from crawler.pipeline import PipelineCrawler
+
+ENGINES = {
+    "threads": Crawler,
+    "asyncio": AsyncCrawler,
+    "pipeline": PipelineCrawler,
+}
+
+
+def get_crawler_class(engine):
+    try:
+        return ENGINES[engine]
+    except KeyError:
+        raise ValueError(
+            f"Unknown crawler engine {engine!r}, "
+            f"expected one of {sorted(ENGINES)}.")
@@ -1,72 +1,489 @@
 import os
-import shelve
+import time
+import itertools
 
-from threading import Thread, RLock
-from queue import Queue, Empty
+from heapq import heappush, heappop
+from collections import Counter
+from threading import RLock, Condition
+from urllib.parse import urlparse
 
-from utils import get_logger, get_urlhash, normalize
-from scraper import is_valid
+from utils import get_logger, get_urlhash, get_urlfingerprint, normalize
+from utils.urlset import FingerprintSet
+from utils.metrics import metrics
+from scraper import (
+    is_valid, restore_state, set_page_store, page_words, revisits,
+    load_traps, save_traps)
+from crawler.storage import get_storage_class, PENDING_BATCH
+from utils.traps import TrapJournal
+from crawler.robots import RobotsCache
+from crawler.priority import Link, get_priority_function
+from crawler.recrawl import FetchHistory
+from crawler.ratecontrol import RateController
+from crawler.cluster import Cluster
+from utils.state import StateStore
+from utils.segments import SegmentWriter
+
+# Pending urls from the save file are read in whenever fewer than this
+# many urls are queued in memory (or the memory budget, if it is lower).
+BACKLOG_LOW = 1000
+
+# Seconds to wait before asking again when only urls that are still being
+# downloaded can add more work. Blocked workers are woken up earlier.
+IDLE_WAIT = 1.0
 
 class Frontier(object):
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
-        
-        if not os.path.exists(self.config.save_file) and not restart:
+
+        # Urls waiting to be downloaded, one heap of (-score, sequence,
+        # url, depth) per host, so each host's best url comes first.
+        self.host_queues = dict()
+        self.queued = 0
+        self.sequence = itertools.count()
+        # Scores urls as they are discovered, see crawler/priority.py.
+        self.priority = get_priority_function(self.config.priority)
+        # Urls discovered per host, for the priority function.
+        self.host_urls = Counter()
+        # Past QUEUEBUDGET queued urls, new urls are only written to the
+        # save file and read back in, best first, as the queues drain.
+        # spilled counts the pending urls in the save file that are not
+        # queued.
+        self.spilled = 0
+        self.refill_level = BACKLOG_LOW
+        if self.config.queue_budget:
+            self.refill_level = min(BACKLOG_LOW, self.config.queue_budget)
+        # Heap of (ready time, host) for hosts that have queued urls and
+        # must wait for their politeness delay.
+        self.delay_heap = list()
+        # Heap of (-score of its best url, ready time, host) for hosts that
+        # may be fetched from now. Entries of hosts that left ready_hosts
+        # or found a better url since are stale and skipped.
+        self.ready_heap = list()
+        self.ready_hosts = set()
+        # Earliest time each host may be fetched from again.
+        self.next_fetch = dict()
+        # Crawl-delay of the hosts whose robots.txt sets one.
+        self.host_delay = dict()
+        # Slows down hosts that fail or respond slower and speeds them up
+        # again, never past POLITENESS; see crawler/ratecontrol.py.
+        self.rate_control = None
+        if self.config.rate_control:
+            self.rate_control = RateController(
+                self.config.time_delay, self.config.rate_max_delay,
+                self.config.rate_increase, self.config.rate_backoff,
+                self.config.rate_latency_factor)
+        # Urls handed to a worker but not yet marked complete, mapped to
+        # their host and depth. A busy host is never on a heap.
+        self.in_progress = dict()
+        self.busy_hosts = set()
+        self.lock = RLock()
+        self.has_work = Condition(self.lock)
+        # Urls known to be in the save file, so links seen before are
+        # dropped without a lookup in it. Saved on close.
+        self.seen = FingerprintSet(
+            key=get_urlfingerprint, bloom_bits=self.config.url_bloom_bits)
+        self.seen_file = self.config.save_file + ".seen"
+        # With NODES set, the hosts of other nodes are forwarded to them.
+        self.cluster = Cluster(self.config) if self.config.nodes else None
+
+        storage_class = get_storage_class(self.config.storage)
+        resume = not restart and storage_class.exists(self.config.save_file)
+        if not storage_class.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
                 f"Did not find save file {self.config.save_file}, "
                 f"starting from seed.")
-        elif os.path.exists(self.config.save_file) and restart:
+        elif storage_class.exists(self.config.save_file) and restart:
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            storage_class.remove(self.config.save_file)
+        rebuild_seen = False
+        if os.path.exists(self.seen_file):
+            if not resume:
+                os.remove(self.seen_file)
+            else:
+                # Only ever saved after a commit, so every url in it is in
+                # the save file. Urls missing from it are still found there.
+                try:
+                    self.seen.load(self.seen_file)
+                except (ValueError, OSError) as err:
+                    # Left damaged by a crash, so it is built again from
+                    # the save file once that is open
+                    self.logger.warning(
+                        f"Could not load {self.seen_file} ({err}), "
+                        f"rebuilding it from the save file.")
+                    os.remove(self.seen_file)
+                    rebuild_seen = True
+        # Url templates the trap detector throttled or blocked, so a
+        # resumed crawl does not follow its traps again.
+        traps_file = self.config.save_file + ".traps"
+        if not resume:
+            TrapJournal.remove(traps_file)
+        self.trap_journal = TrapJournal(traps_file)
+        if os.path.exists(traps_file):
+            try:
+                load_traps(self.trap_journal)
+            except (ValueError, KeyError, TypeError, OSError) as err:
+                self.logger.warning(
+                    f"Could not load {traps_file} ({err}), "
+                    f"starting with no url templates.")
+                TrapJournal.remove(traps_file)
+        self.robots = None
+        if self.config.robots:
+            robots_file = self.config.save_file + ".robots"
+            if restart:
+                RobotsCache.remove(robots_file)
+            self.robots = RobotsCache(
+                self.config, robots_file, self.config.robots_ttl,
+                self.set_host_delay)
+        # Crawl statistics, checkpointed after frontier commits. A scraped
+        # page is only saved as complete once its statistics are.
+        self.state = None
+        if self.config.state_interval:
+            state_path = self.config.save_file + ".state"
+            if not resume:
+                StateStore.remove(state_path)
+            self.state = StateStore(state_path, self.config.state_interval)
+            restore_state(self.state, resume)
+        # Tokens and links of every recorded page, for report.py.
+        self.pages = None
+        if self.config.segment_bytes:
+            pages_path = self.config.save_file + ".pages"
+            if not resume:
+                SegmentWriter.remove(pages_path)
+            self.pages = SegmentWriter(pages_path, self.config.segment_bytes)
+            set_page_store(self.pages)
+        # Validators and revisit schedule of every completed page.
+        self.history = None
+        if self.config.revisit_interval:
+            history_file = self.config.save_file + ".history"
+            if not resume:
+                FetchHistory.remove(history_file)
+            self.history = FetchHistory(
+                history_file, self.config.revisit_interval)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        self.save = storage_class(
+            self.config.save_file, self.config.commit_records,
+            self.config.commit_interval)
+        self.spills = self.save.spills and self.config.queue_budget > 0
+        if rebuild_seen:
+            for url, _ in self.save.values():
+                self.seen.add(url)
+        if self.history is not None:
+            self.save.commit_listeners.append(self.history.commit)
+        self.save.commit_listeners.append(self._save_traps)
+        if self.state is not None:
+            self.save.commit_listeners.append(self._checkpoint_state)
+        if self.pages is not None:
+            # A page is only saved as complete once its record is on disk
+            self.save.precommit_listeners.append(self.pages.flush)
+        if self.cluster is not None:
+            # and once the links it forwarded are, see crawler/cluster.py
+            self.cluster.open(resume)
+            self.save.precommit_listeners.append(self.cluster.flush)
         if restart:
-            for url in self.config.seed_urls:
-                self.add_url(url)
+            self.add_urls(self.config.seed_urls)
         else:
+            if self.config.recrawl:
+                self._requeue_due()
             # Set the frontier state with contents of save file.
             self._parse_save_file()
-            if not self.save:
-                for url in self.config.seed_urls:
-                    self.add_url(url)
+            if not len(self.save):
+                self.add_urls(self.config.seed_urls)
+        self.save.commit()
+        if self.cluster is not None:
+            self.cluster.start(self)
 
     def _parse_save_file(self):
         ''' This function can be overridden for alternate saving techniques. '''
         total_count = len(self.save)
-        tbd_count = 0
-        for url, completed in self.save.values():
-            if not completed and is_valid(url):
-                self.to_be_downloaded.append(url)
-                tbd_count += 1
+        if self.save.needs_index:
+            # Save files written before the pending index existed are
+            # scanned once to build it.
+            for url, completed in self.save.values():
+                if not completed and is_valid(url):
+                    self.save.add_pending(get_urlhash(url), url)
+            self.save.commit()
+        # The index only holds validated urls that are not complete, so
+        # they can be streamed in as the queues drain, best first.
+        self.save.requeue_pending()
+        tbd_count = self.save.pending_count()
+        self.spilled = tbd_count
         self.logger.info(
             f"Found {tbd_count} urls to be downloaded from {total_count} "
             f"total urls discovered.")
 
+    def _requeue_due(self):
+        # A refresh crawl downloads again the completed pages that are due
+        # for a revisit.
+        if self.history is None:
+            self.logger.info("No fetch history, nothing to revisit.")
+            return
+        due = self.history.due(time.time())
+        for url in due:
+            self.save.add_pending(get_urlhash(url), url)
+        self.save.commit()
+        self.logger.info(f"Revisiting {len(due)} urls that are due.")
+
+    def _enqueue(self, url, score=0.0, depth=0, host=None):
+        if host is None:
+            host = urlparse(url).netloc
+        with self.lock:
+            queue = self.host_queues.get(host)
+            if queue is None:
+                queue = self.host_queues[host] = list()
+            entry = (-score, next(self.sequence), url, depth)
+            heappush(queue, entry)
+            self.queued += 1
+            if host in self.busy_hosts:
+                return
+            if len(queue) == 1:
+                # An empty host that is not being downloaded from is not on
+                # a heap yet, so schedule it.
+                self._schedule(host)
+            elif host in self.ready_hosts and queue[0] is entry:
+                # A better url for a ready host moves it up the heap.
+                heappush(self.ready_heap, (
+                    entry[0], self.next_fetch.get(host, 0), host))
+
+    def _refill(self):
+        while self.spilled and self.queued < self.refill_level:
+            batch = self.save.next_pending(PENDING_BATCH)
+            if not batch:
+                self.spilled = 0
+                break
+            self.spilled = max(0, self.spilled - len(batch))
+            for url, score, depth in batch:
+                self._enqueue(url, score, depth)
+
+    def _schedule(self, host):
+        ready_time = self.next_fetch.get(host, 0)
+        heappush(self.delay_heap, (ready_time, host))
+        self.has_work.notify()
+
+    def _release_ready_hosts(self, now):
+        # Moves the hosts whose delay has passed to the ready heap.
+        delay_heap = self.delay_heap
+        while delay_heap and delay_heap[0][0] <= now:
+            ready_time, host = heappop(delay_heap)
+            self.ready_hosts.add(host)
+            heappush(self.ready_heap, (
+                self.host_queues[host][0][0], ready_time, host))
+
     def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
+        ''' Blocks until some host is allowed to be fetched from again and
+        returns its next url. Returns None once nothing is queued and no
+        other worker can add more urls. '''
+        with self.lock:
+            while True:
+                url, wait = self.poll_tbd_url()
+                if url is not None or wait is None:
+                    return url
+                self.has_work.wait(wait)
 
-    def add_url(self, url):
-        url = normalize(url)
+    def poll_tbd_url(self):
+        ''' Non-blocking get_tbd_url for callers that cannot block, like an
+        event loop. Returns (url, 0) when a url is ready, (None, seconds)
+        when it is worth asking again after about that long, and
+        (None, None) once the crawl is over. '''
+        with self.lock:
+            self._refill()
+            # Use idle time to commit writes that have waited too long.
+            self.save.maybe_commit()
+            now = time.monotonic()
+            self._release_ready_hosts(now)
+            while self.ready_heap:
+                best, ready_time, host = heappop(self.ready_heap)
+                queue = self.host_queues[host]
+                if host not in self.ready_hosts or queue[0][0] != best:
+                    continue
+                self.ready_hosts.discard(host)
+                _, _, url, depth = heappop(queue)
+                self.queued -= 1
+                self.in_progress[url] = (host, depth)
+                self.busy_hosts.add(host)
+                return url, 0
+            if self.delay_heap:
+                return None, self._wait_time(self.delay_heap[0][0] - now)
+            if self.in_progress:
+                # Workers still downloading may discover more urls.
+                return None, self._wait_time(IDLE_WAIT)
+            self.save.commit()
+            if self.cluster is not None and not self.cluster.finished.is_set():
+                # Other nodes may still forward urls.
+                return None, IDLE_WAIT
+            return None, None
+
+    def idle(self):
+        ''' Returns True if nothing is queued or being downloaded. '''
+        with self.lock:
+            return not self.queued and not self.spilled and not self.in_progress
+
+    def _wait_time(self, wait):
+        # Wake up in time for the next group commit if writes are pending.
+        if self.save.pending_records:
+            commit_wait = max(
+                0, self.save.last_commit + self.save.commit_interval
+                - time.monotonic())
+            return min(wait, commit_wait)
+        return wait
+
+    def can_fetch(self, url):
+        ''' Returns False if robots.txt disallows the url. May download the
+        robots.txt of its host first, so call it before downloading the
+        url, not while holding the frontier lock. '''
+        return self.robots is None or self.robots.allowed(url)
+
+    def fetch_unchanged(self, url, resp):
+        ''' Returns True if url was fetched before and its page has not
+        changed since, so it need not be scraped again. A page that did
+        change is scraped as a revisit: its links are followed, but it is
+        not counted in the statistics again. '''
+        if self.history is None or resp.status != 200 or not resp.has_response:
+            return False
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
-    
-    def mark_url_complete(self, url):
+        # Pages fetched for the first time are left for the scraper to
+        # decode, it may reject them without.
+        with self.lock:
+            fetched_before = self.history.fetched(urlhash)
+        if not fetched_before or resp.raw_response is None:
+            return False
+        validators = FetchHistory.validators(resp)
+        with self.lock:
+            unchanged = self.history.unchanged(urlhash, validators)
+        if unchanged:
+            metrics.count("recrawl.unchanged")
+            return True
+        metrics.count("recrawl.changed")
+        revisits.add(url)
+        return False
+
+    def set_host_delay(self, host, delay):
+        ''' Waits at least delay seconds between downloads from host,
+        or POLITENESS seconds if that is longer. '''
+        with self.lock:
+            self.host_delay[host] = delay
+
+    def add_url(self, url):
+        self.add_urls([url])
+
+    def add_urls(self, urls, parent=None):
+        ''' Adds a batch of urls, such as all the links scraped from the
+        page parent. Each is scored by the priority function. The writes
+        are committed together by the storage backend. '''
+        start = time.perf_counter()
+        # Any iterable; it is counted for the priority function below
+        urls = list(urls)
+        with self.lock:
+            new_urls = list()
+            for url in urls:
+                url = normalize(url)
+                if self.cluster is not None and not self.cluster.owns(url):
+                    self.cluster.forward(url)
+                elif self.seen.add(url):
+                    new_urls.append(url)
+            parent_depth = -1
+            if parent in self.in_progress:
+                parent_depth = self.in_progress[parent][1]
+            parent_words = page_words.get(parent, 0)
+            for url in new_urls:
+                host = urlparse(url).netloc
+                depth = parent_depth + 1
+                score = self.priority(url, Link(
+                    depth, parent_words, len(urls), len(new_urls),
+                    self.host_urls[host]))
+                queued = not self.spills or (
+                    self.queued < self.config.queue_budget)
+                if self.save.add(get_urlhash(url), url, score, depth, queued):
+                    self.host_urls[host] += 1
+                    if queued:
+                        self._enqueue(url, score, depth, host)
+                    else:
+                        self.spilled += 1
+            self.save.maybe_commit()
+        metrics.record("frontier.add", time.perf_counter() - start)
+
+    def mark_url_complete(self, url, resp=None):
+        ''' Marks url complete. With the response it was downloaded with,
+        the fetch is also recorded in the history, if the page was read. '''
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
+        validators = None
+        if (self.history is not None and resp is not None
+                and resp.status == 200 and resp.decoded
+                and resp.raw_response is not None):
+            validators = FetchHistory.validators(resp)
+        start = time.perf_counter()
+        with self.lock:
+            if validators is not None:
+                self.history.record(urlhash, url, validators)
+            revisits.discard(url)
+            self.seen.add(url)
+            # A page with statistics is saved as complete after them, see
+            # _checkpoint_state
+            if self.state is None or not self.state.complete(urlhash, url):
+                self._save_complete(urlhash, url)
+            self.save.maybe_commit()
+
+            page_words.pop(url, None)
+            # Release the host; it may be fetched from again once the
+            # politeness delay has passed.
+            host, _ = self.in_progress.pop(url, (None, 0))
+            if host is not None:
+                self.busy_hosts.discard(host)
+                delay = self.config.time_delay
+                if self.rate_control is not None:
+                    delay = (
+                        self.rate_control.observe(
+                            host, resp.latency, resp.status)
+                        if resp is not None else
+                        self.rate_control.delay(host))
+                delay = max(delay, self.host_delay.get(host, 0))
+                self.next_fetch[host] = time.monotonic() + delay
+                if self.host_queues[host]:
+                    self._schedule(host)
+            # Waiting workers may need to stop if this was the last url.
+            self.has_work.notify_all()
+        metrics.record("frontier.complete", time.perf_counter() - start)
+
+    def _save_complete(self, urlhash, url):
+        if not self.save.mark_complete(urlhash, url):
             # This should not happen.
             self.logger.error(
                 f"Completed url {url}, but have not seen it before.")
 
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+    def _checkpoint_state(self):
+        # Called after each commit: checkpoints the statistics, and saves
+        # the completions of the pages whose statistics are on disk now.
+        # They are committed with the next commit.
+        for urlhash, url in self.state.checkpoint():
+            self._save_complete(urlhash, url)
+
+    def _save_traps(self):
+        # Called after each commit, queues the templates that changed
+        save_traps(self.trap_journal)
+
+    def commit(self):
+        ''' Commits the outstanding writes now. '''
+        with self.lock:
+            self.save.commit()
+
+    def close(self):
+        ''' Commits outstanding writes and closes the save file. '''
+        if self.cluster is not None:
+            self.cluster.close()
+        with self.lock:
+            if self.state is not None:
+                for urlhash, url in self.state.close():
+                    self._save_complete(urlhash, url)
+            self.save.close()
+            self.seen.save(self.seen_file)
+            save_traps(self.trap_journal)
+            self.trap_journal.close()
+            if self.robots is not None:
+                self.robots.close()
+            if self.history is not None:
+                self.history.close()
+            if self.pages is not None:
+                self.pages.close()
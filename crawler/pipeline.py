@@ -0,0 +1,87 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from threading import BoundedSemaphore
+from urllib.parse import urlparse
+
+import scraper
+from crawler import Crawler
+from crawler.frontier import Frontier
+from crawler.worker import Worker
+from utils.metrics import metrics
+
+# Pages handed to the pool per process at most, parsing or waiting, so a
+# process always has its next page while the downloads are not held up
+PAGES_PER_PROCESS = 2
+
+
+class PipelineWorker(Worker):
+    ''' A worker that only downloads. Pages that pass scraper.accept_page
+    are handed to a pool of processes that parse them with
+    scraper.analyze_page, so parsing is not limited to one core by the
+    GIL, and the worker goes on to its next url. When a page is parsed,
+    the pool's result thread puts it through scraper.record_page, adds
+    its links and marks the url complete.
+
+    slots is shared by the workers and bounds the pages in the pool; a
+    worker waits for a free slot before handing over a page. '''
+    def __init__(self, worker_id, config, frontier, pool, slots):
+        super().__init__(worker_id, config, frontier)
+        self.pool = pool
+        self.slots = slots
+
+    def process(self, tbd_url, resp):
+        if not scraper.accept_page(tbd_url, resp):
+            scraper.trap_detector.record(tbd_url, False)
+            return True
+        page_url = resp.raw_response.url
+        self.slots.acquire()
+        try:
+            future = self.pool.submit(
+                scraper.analyze_page, page_url, resp.raw_response.content)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(partial(
+            self.parsed, tbd_url, page_url, resp, time.perf_counter()))
+        return False
+
+    def parsed(self, tbd_url, page_url, resp, start, future):
+        ''' Records the parsed page, adds its links and releases the url.
+        Runs on the pool's result thread. '''
+        self.slots.release()
+        try:
+            scraped_urls = scraper.record_page(
+                tbd_url, page_url, future.result())
+            metrics.record(
+                "scrape", time.perf_counter() - start,
+                urlparse(tbd_url).netloc)
+            self.frontier.add_urls(scraped_urls, tbd_url)
+        except Exception:
+            self.logger.exception(f"Failed to crawl {tbd_url}.")
+            metrics.count("worker.errors")
+            resp = None
+        finally:
+            self.frontier.mark_url_complete(tbd_url, resp)
+
+
+class PipelineCrawler(Crawler):
+    ''' Runs THREADCOUNT downloading workers that share a pool of
+    PARSEPROCESSES parsing processes. '''
+    def __init__(self, config, restart, frontier_factory=Frontier):
+        super().__init__(
+            config, restart, frontier_factory, self._make_worker)
+        # The processes need the same scraper settings as this one.
+        self.pool = ProcessPoolExecutor(
+            config.parse_processes, initializer=scraper.configure,
+            initargs=(config,))
+        self.slots = BoundedSemaphore(
+            PAGES_PER_PROCESS * config.parse_processes)
+
+    def _make_worker(self, worker_id, config, frontier):
+        return PipelineWorker(
+            worker_id, config, frontier, self.pool, self.slots)
+
+    def join(self):
+        super().join()
+        self.pool.shutdown()
@@ -0,0 +1,64 @@
+from math import log
+from collections import namedtuple
+from importlib import import_module
+from urllib.parse import urlparse
+
+# What the frontier knows about a link when it is discovered:
+#   depth        links followed from a seed url to reach it
+#   parent_words words on the page it was found on, 0 if not counted
+#   parent_links links on that page that passed the scraper
+#   new_links    how many of those the frontier had not seen before
+#   host_urls    urls of its host discovered so far
+Link = namedtuple(
+    "Link",
+    ["depth", "parent_words", "parent_links", "new_links", "host_urls"])
+
+
+# Every url scores the same, so each host is crawled in the order its urls
+# were found and hosts take turns in the order they become ready.
+def fifo(url, link):
+    return 0.0
+
+
+# Breadth first: the fewer links away from a seed, the sooner.
+def breadth_first(url, link):
+    return -link.depth
+
+
+# Favours links that are likely to lead to new content:
+#   - hosts with few urls found so far, so new subdomains are reached early
+#   - pages found on long pages, which tend to link to more long pages
+#   - pages whose links were mostly new, rather than the site navigation
+#     seen on every page
+# and holds back urls deep in the link graph or in the path, which is where
+# calendars, archives and other generated pages sprawl.
+def value(url, link):
+    novelty = 2 / (1 + link.host_urls / 50)
+    richness = min(1.0, log(1 + link.parent_words) / log(2000))
+    link_yield = (
+        link.new_links / link.parent_links if link.parent_links else 1.0)
+    path_depth = urlparse(url).path.count("/")
+    return (
+        novelty + richness + link_yield
+        - 0.1 * link.depth - 0.2 * max(0, path_depth - 2))
+
+
+PRIORITIES = {
+    "fifo": fifo,
+    "bfs": breadth_first,
+    "value": value,
+}
+
+
+# This function will return the priority function named in config.ini:
+# one of PRIORITIES, or module:function for one of your own that takes
+# (url, link) and returns a number, higher first
+def get_priority_function(name):
+    if name in PRIORITIES:
+        return PRIORITIES[name]
+    module, _, function = name.partition(":")
+    if not function:
+        raise ValueError(
+            f"Unknown frontier priority {name!r}, expected one of "
+            f"{sorted(PRIORITIES)} or module:function.")
+    return getattr(import_module(module), function)
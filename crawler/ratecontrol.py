@@ -0,0 +1,106 @@
+from utils import get_logger
+from utils.download import is_transient
+from utils.metrics import metrics
+
+# Weight of a new latency in the short and the long average of a host. A
+# host is slowing down when the short one rises above the long one.
+FAST_WEIGHT = 0.3
+SLOW_WEIGHT = 0.05
+
+
+class HostRate(object):
+    ''' The rate state of one host. '''
+    __slots__ = ("delay", "latency", "baseline")
+
+    def __init__(self, delay):
+        # Seconds between the end of a download and the start of the next
+        self.delay = delay
+        # Short and long averages of the download latency, None until the
+        # first successful download
+        self.latency = None
+        self.baseline = None
+
+
+class RateController(object):
+    ''' Adapts the download rate of each host to how it responds, additive
+    increase and multiplicative decrease like TCP.
+
+    Each host has a bucket of one token that refills at its rate, and a
+    download takes the token; since the frontier downloads from a host one
+    url at a time, that is a delay of 1 / rate seconds after each download.
+    Hosts start at the fastest rate POLITENESS allows. A download that
+    fails (5xx, transient cache errors, no answer) or that finds the host's latency
+    rising to latency_factor times its usual latency multiplies the rate
+    by backoff, down to one download per max_delay seconds. Any other
+    download adds increase downloads per second to the rate, up to the
+    POLITENESS ceiling again.
+
+    With POLITENESS 0 a host has no ceiling; its first backoff waits as
+    long as its downloads take.
+
+    Not thread safe, the frontier calls it under its lock. '''
+    def __init__(
+            self, min_delay, max_delay, increase, backoff, latency_factor):
+        self.logger = get_logger("RATE")
+        self.min_delay = min_delay
+        self.max_delay = max(min_delay, max_delay)
+        self.increase = increase
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.hosts = dict()
+
+    def delay(self, host):
+        ''' Returns the seconds to wait after a download from host. '''
+        rate = self.hosts.get(host)
+        return rate.delay if rate is not None else self.min_delay
+
+    def observe(self, host, latency, status):
+        ''' Adapts the rate of host to a download that took latency
+        seconds and returned status. Returns the new delay. '''
+        rate = self.hosts.get(host)
+        if rate is None:
+            rate = self.hosts[host] = HostRate(self.min_delay)
+        reason = None
+        # Only failures count against the host: 5xx, the transient cache
+        # errors and failed downloads. A page too big or denied by
+        # robots.txt says nothing about its health.
+        if is_transient(status):
+            reason = f"status {status}"
+        elif latency is not None:
+            if rate.latency is None:
+                rate.latency = rate.baseline = latency
+            else:
+                rate.latency += FAST_WEIGHT * (latency - rate.latency)
+                rate.baseline += SLOW_WEIGHT * (latency - rate.baseline)
+                if rate.latency > self.latency_factor * rate.baseline:
+                    reason = (
+                        f"latency {rate.latency:.3f}s against "
+                        f"{rate.baseline:.3f}s")
+                    # The next downloads have to show the rise again
+                    rate.latency = rate.baseline
+        if reason is not None:
+            self._decrease(host, rate, reason)
+        else:
+            self._increase(host, rate)
+        metrics.record("rate.delay", rate.delay, host)
+        return rate.delay
+
+    def _decrease(self, host, rate, reason):
+        delay = rate.delay / self.backoff
+        if not delay:
+            delay = rate.baseline or self.max_delay
+        rate.delay = min(self.max_delay, delay)
+        metrics.count("rate.backoff")
+        self.logger.info(
+            f"Backing off {host} to {rate.delay:.3f}s between downloads, "
+            f"{reason}.")
+
+    def _increase(self, host, rate):
+        if rate.delay <= self.min_delay:
+            return
+        delay = 1 / (1 / rate.delay + self.increase)
+        if delay <= self.min_delay:
+            delay = self.min_delay
+            self.logger.info(f"{host} is back at full rate.")
+        rate.delay = delay
+        metrics.count("rate.increase")
@@ -0,0 +1,128 @@
+import os
+import time
+import sqlite3
+from collections import namedtuple
+
+# What tells two fetches of a url apart: the ETag and Last-Modified headers
+# and a digest of the body (see utils/response.py)
+Validators = namedtuple("Validators", ["etag", "last_modified", "digest"])
+
+# A page that changes is revisited up to this many times more often than
+# REVISITINTERVAL, one that does not up to this many times less often.
+INTERVAL_RANGE = 16
+
+# Bits of change history kept per url, one per visit, newest lowest
+HISTORY_BITS = 32
+
+
+class FetchHistory(object):
+    ''' Remembers every completed page's validators, when it was fetched
+    and when it last changed, so a refresh crawl (launch.py --recrawl)
+    only fetches the pages that are due and skips parsing those that did
+    not change.
+
+    A page is first revisited interval seconds after it was fetched. Each
+    visit that finds it changed halves its interval, each that finds it
+    unchanged doubles it, within INTERVAL_RANGE times interval either
+    way. The last HISTORY_BITS visits are kept as a bit mask, 1 for a
+    change.
+
+    The history is an SQLite database next to the save file. Writes are
+    committed after each frontier commit; all access goes through the
+    frontier lock. '''
+    def __init__(self, path, interval):
+        self.interval = interval
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # A history lost to a power cut only costs pages parsed again
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS fetches ("
+            "urlhash TEXT PRIMARY KEY, url TEXT NOT NULL, etag TEXT, "
+            "last_modified TEXT, digest INTEGER NOT NULL, "
+            "fetched REAL NOT NULL, changed REAL NOT NULL, "
+            "visits INTEGER NOT NULL, changes INTEGER NOT NULL, "
+            "history INTEGER NOT NULL, interval REAL NOT NULL, "
+            "next_visit REAL NOT NULL)")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS fetches_due ON fetches (next_visit)")
+        self.db.commit()
+
+    @staticmethod
+    def remove(path):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    @staticmethod
+    def validators(resp):
+        ''' Returns the Validators of a decoded response. Call it outside
+        the frontier lock, since the digest reads the whole body. '''
+        headers = resp.headers
+        return Validators(
+            headers.get("ETag"), headers.get("Last-Modified"), resp.digest)
+
+    def fetched(self, urlhash):
+        return self.db.execute(
+            "SELECT 1 FROM fetches WHERE urlhash = ?", (urlhash,)
+            ).fetchone() is not None
+
+    def unchanged(self, urlhash, validators):
+        ''' Returns None for a url never fetched before, otherwise whether
+        the page is the same as on the last fetch. '''
+        row = self.db.execute(
+            "SELECT etag, last_modified, digest FROM fetches "
+            "WHERE urlhash = ?", (urlhash,)).fetchone()
+        if row is None:
+            return None
+        return self._same(Validators(*row), validators)
+
+    def _same(self, previous, current):
+        # The cache server passes no conditional requests on, so the
+        # validators are compared here. Equal ETags or Last-Modified dates
+        # are taken at their word, otherwise the bodies are compared.
+        if previous.etag and current.etag:
+            return previous.etag == current.etag
+        if previous.last_modified and current.last_modified:
+            return previous.last_modified == current.last_modified
+        return previous.digest == current.digest
+
+    def record(self, urlhash, url, validators):
+        ''' Records a fetch of url and schedules its next visit. '''
+        now = time.time()
+        row = self.db.execute(
+            "SELECT etag, last_modified, digest, changed, visits, changes, "
+            "history, interval FROM fetches WHERE urlhash = ?", (urlhash,)
+            ).fetchone()
+        if row is None:
+            changed_time, visits, changes, history = now, 1, 0, 0
+            interval = self.interval
+        else:
+            changed = not self._same(Validators(*row[:3]), validators)
+            changed_time, visits, changes, history, interval = row[3:]
+            visits += 1
+            history = ((history << 1) | changed) & ((1 << HISTORY_BITS) - 1)
+            if changed:
+                changed_time = now
+                changes += 1
+                interval = max(self.interval / INTERVAL_RANGE, interval / 2)
+            else:
+                interval = min(self.interval * INTERVAL_RANGE, interval * 2)
+        self.db.execute(
+            "INSERT OR REPLACE INTO fetches VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (urlhash, url, validators.etag, validators.last_modified,
+             validators.digest, now, changed_time, visits, changes, history,
+             interval, now + interval))
+
+    def due(self, now):
+        ''' Returns the urls whose next visit is at or before now. '''
+        return [url for url, in self.db.execute(
+            "SELECT url FROM fetches WHERE next_visit <= ?", (now,))]
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
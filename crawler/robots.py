@@ -0,0 +1,120 @@
+import os
+import time
+import shelve
+from threading import Lock
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+from crawler.storage import DBM_SUFFIXES
+from utils import get_logger
+from utils.download import download
+
+# Seconds to wait before asking again for a robots.txt that could not be
+# downloaded. Until then the host is crawled as if it had none.
+ERROR_TTL = 600
+
+# Longest Crawl-delay that is obeyed, in seconds
+MAX_CRAWL_DELAY = 60
+
+# Verdicts remembered per host before they are forgotten all at once
+VERDICTS_PER_HOST = 4096
+
+
+class HostRules(object):
+    ''' The parsed robots.txt of one host and the verdicts given so far. '''
+    def __init__(self, text, fetched, ttl, user_agent):
+        self.fetched = fetched
+        self.expires = fetched + ttl
+        self.parser = None
+        self.crawl_delay = None
+        if text is not None:
+            self.parser = RobotFileParser()
+            self.parser.parse(text.splitlines())
+            self.crawl_delay = self.parser.crawl_delay(user_agent)
+        self.verdicts = dict()
+
+
+class RobotsCache(object):
+    ''' Downloads the robots.txt of each host once through the cache server
+    and keeps the rules for ttl seconds. Verdicts are remembered per path,
+    so checking a url seen before is a dict lookup.
+
+    The robots.txt files are kept in a shelve next to the save file, so a
+    resumed crawl only downloads the ones that have expired. A Crawl-delay
+    is passed to set_delay(host, seconds) when the rules are read. '''
+    def __init__(self, config, path, ttl, set_delay=None):
+        self.config = config
+        self.ttl = ttl
+        self.set_delay = set_delay
+        self.hosts = dict()
+        self.lock = Lock()
+        self.logger = get_logger("ROBOTS")
+        self.save = shelve.open(path)
+
+    @staticmethod
+    def remove(path):
+        for suffix in DBM_SUFFIXES:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def allowed(self, url):
+        ''' Returns False if the robots.txt of the url's host disallows
+        it. May download the robots.txt, so it is called without holding
+        the frontier lock. '''
+        parsed = urlparse(url)
+        rules = self._rules(parsed.scheme, parsed.netloc)
+        if rules.parser is None:
+            return True
+        key = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        verdict = rules.verdicts.get(key)
+        if verdict is None:
+            verdict = rules.parser.can_fetch(self.config.user_agent, url)
+            if len(rules.verdicts) >= VERDICTS_PER_HOST:
+                rules.verdicts.clear()
+            rules.verdicts[key] = verdict
+        return verdict
+
+    def _rules(self, scheme, host):
+        now = time.time()
+        rules = self.hosts.get(host)
+        if rules is not None and rules.expires > now:
+            return rules
+        with self.lock:
+            saved = self.save.get(host)
+        if saved is not None and saved[0] + self.ttl > now:
+            text, fetched = saved[1], saved[0]
+            ttl = self.ttl
+        else:
+            text, ttl = self._download(scheme, host)
+            fetched = now
+            if ttl == self.ttl:
+                with self.lock:
+                    self.save[host] = (fetched, text)
+                    self.save.sync()
+        rules = HostRules(text, fetched, ttl, self.config.user_agent)
+        self.hosts[host] = rules
+        if rules.crawl_delay is not None and self.set_delay is not None:
+            self.set_delay(
+                host, min(float(rules.crawl_delay), MAX_CRAWL_DELAY))
+        return rules
+
+    def _download(self, scheme, host):
+        # Returns the robots.txt text, or None for none, and how long to
+        # keep it.
+        robots_url = f"{scheme}://{host}/robots.txt"
+        resp = download(robots_url, self.config, self.logger)
+        if resp.status == 200 and resp.raw_response is not None:
+            self.logger.info(f"Read {robots_url}.")
+            return resp.raw_response.content.decode(
+                "utf-8", errors="replace"), self.ttl
+        if 400 <= resp.status < 500:
+            # No robots.txt, everything may be crawled.
+            return None, self.ttl
+        self.logger.info(
+            f"Could not download {robots_url}, status <{resp.status}>, "
+            f"asking again in {ERROR_TTL}s.")
+        return None, ERROR_TTL
+
+    def close(self):
+        with self.lock:
+            self.save.close()
@@ -0,0 +1,306 @@
+import os
+import dbm
+import itertools
+import shelve
+import sqlite3
+import time
+
+from utils.metrics import metrics
+
+
+class GroupCommit(object):
+    ''' Counts writes and commits them in groups, every commit_records
+    records or every commit_interval milliseconds, whichever comes first.
+
+    Writes are committed in the order they were made, so once a url is
+    durably marked complete, every url discovered on it before that is
+    durable as well. A crash can only lose the tail of the log, and the
+    pages that produced that tail are downloaded again on resume. '''
+    def __init__(self, commit_records, commit_interval):
+        self.commit_records = max(1, commit_records)
+        self.commit_interval = commit_interval / 1000
+        self.pending_records = 0
+        self.last_commit = time.monotonic()
+        # Called before every commit, e.g. to make durable what the records
+        # being committed point to
+        self.precommit_listeners = list()
+        # Called after every commit, e.g. to checkpoint state that must not
+        # get ahead of the save file
+        self.commit_listeners = list()
+
+    def _record(self):
+        self.pending_records += 1
+
+    def commit_due(self):
+        if not self.pending_records:
+            return False
+        return (
+            self.pending_records >= self.commit_records
+            or time.monotonic() - self.last_commit >= self.commit_interval)
+
+    def maybe_commit(self):
+        if self.commit_due():
+            self.commit()
+
+    def commit(self):
+        for listener in self.precommit_listeners:
+            listener()
+        start = time.perf_counter()
+        self._flush()
+        metrics.record("storage.commit", time.perf_counter() - start)
+        metrics.count("storage.records", self.pending_records)
+        self.pending_records = 0
+        self.last_commit = time.monotonic()
+        for listener in self.commit_listeners:
+            listener()
+
+    def _flush(self):
+        raise NotImplementedError
+
+
+# Number of pending urls read from the save file at a time, on resume or
+# when spilled urls are read back in.
+PENDING_BATCH = 1000
+
+# File name suffixes the dbm modules behind shelve may use.
+DBM_SUFFIXES = ("", ".db", ".dat", ".dir", ".bak")
+
+
+class ShelveStorage(GroupCommit):
+    ''' The original save format: a shelve of urlhash -> (url, completed),
+    plus a second shelve indexing the urls still to be downloaded.
+
+    A shelve cannot be read back in order of score, so urls are never
+    spilled to it: they all stay queued in memory, and on resume the
+    pending urls are read back in with no score or depth. '''
+    spills = False
+
+    def __init__(self, save_file, commit_records, commit_interval):
+        super().__init__(commit_records, commit_interval)
+        pending_file = save_file + ".pending"
+        # A save file from before the index existed is scanned once.
+        self.needs_index = dbm.whichdb(pending_file) is None
+        self.save = shelve.open(save_file)
+        self.pending = shelve.open(pending_file)
+        # Pending urls being read back in on resume
+        self.backlog = None
+
+    @staticmethod
+    def exists(save_file):
+        # Some dbm modules add their own suffixes to the file name.
+        return dbm.whichdb(save_file) is not None
+
+    @staticmethod
+    def remove(save_file):
+        for name in (save_file, save_file + ".pending"):
+            for suffix in DBM_SUFFIXES:
+                if os.path.exists(name + suffix):
+                    os.remove(name + suffix)
+
+    def __len__(self):
+        return len(self.save)
+
+    def __contains__(self, urlhash):
+        return urlhash in self.save
+
+    def add(self, urlhash, url, score=0.0, depth=0, queued=True):
+        # Returns True if the url was not seen before.
+        if urlhash in self.save:
+            return False
+        self.save[urlhash] = (url, False)
+        self.pending[urlhash] = url
+        self._record()
+        return True
+
+    def add_pending(self, urlhash, url):
+        self.pending[urlhash] = url
+        self._record()
+
+    def mark_complete(self, urlhash, url):
+        # Returns False if the url was not seen before.
+        seen = urlhash in self.save
+        self.save[urlhash] = (url, True)
+        if urlhash in self.pending:
+            # A crash between the two syncs can leave it only here
+            seen = True
+            del self.pending[urlhash]
+        self._record()
+        return seen
+
+    def values(self):
+        return self.save.values()
+
+    def pending_count(self):
+        return len(self.pending)
+
+    def pending_urls(self):
+        # dbm cannot be iterated while it is written to, so take the keys
+        # up front and read each url only when it is needed. Urls added
+        # after this call are not yielded.
+        for urlhash in list(self.pending.keys()):
+            url = self.pending.get(urlhash)
+            if url is not None:
+                yield url
+
+    def requeue_pending(self):
+        self.backlog = self.pending_urls()
+
+    def next_pending(self, count):
+        # Returns up to count (url, score, depth) of the urls left to read
+        # back in by requeue_pending.
+        if self.backlog is None:
+            return list()
+        return [
+            (url, 0.0, 0) for url in itertools.islice(self.backlog, count)]
+
+    def _flush(self):
+        # The index first: a crash between the two syncs must not leave
+        # a url that is in the save file but not in the index, which
+        # would never be downloaded.
+        self.pending.sync()
+        self.save.sync()
+
+    def close(self):
+        self.commit()
+        self.save.close()
+        self.pending.close()
+
+
+class SQLiteStorage(GroupCommit):
+    ''' Keeps the frontier in an SQLite database in WAL mode, so a group
+    commit is one sequential append to the write-ahead log.
+
+    Pending urls keep the score and depth the frontier gave them. Those
+    not queued in memory, because they were spilled past the frontier's
+    memory budget or the crawl was resumed, are read back in best score
+    first through a partial index that only holds them. '''
+    spills = True
+
+    def __init__(self, save_file, commit_records, commit_interval):
+        super().__init__(commit_records, commit_interval)
+        # All access goes through the frontier lock.
+        self.db = sqlite3.connect(save_file, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        # A save file from before the pending table existed is scanned once.
+        self.needs_index = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'pending'"
+            ).fetchone() is None
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            "urlhash TEXT PRIMARY KEY, url TEXT NOT NULL, "
+            "completed INTEGER NOT NULL)")
+        # Urls still to be downloaded, in the order they were discovered.
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            "seq INTEGER PRIMARY KEY, urlhash TEXT UNIQUE NOT NULL, "
+            "url TEXT NOT NULL, score REAL NOT NULL DEFAULT 0, "
+            "depth INTEGER NOT NULL DEFAULT 0, "
+            "queued INTEGER NOT NULL DEFAULT 0)")
+        # Save files from before scores were kept get the new columns.
+        columns = set(
+            row[1] for row in self.db.execute("PRAGMA table_info(pending)"))
+        for column, definition in (
+                ("score", "REAL NOT NULL DEFAULT 0"),
+                ("depth", "INTEGER NOT NULL DEFAULT 0"),
+                ("queued", "INTEGER NOT NULL DEFAULT 0")):
+            if column not in columns:
+                self.db.execute(
+                    f"ALTER TABLE pending ADD COLUMN {column} {definition}")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS pending_spilled "
+            "ON pending (score DESC, seq) WHERE queued = 0")
+        self.db.commit()
+
+    @staticmethod
+    def exists(save_file):
+        return os.path.exists(save_file)
+
+    @staticmethod
+    def remove(save_file):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(save_file + suffix):
+                os.remove(save_file + suffix)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def __contains__(self, urlhash):
+        return self.db.execute(
+            "SELECT 1 FROM urls WHERE urlhash = ?", (urlhash,)
+            ).fetchone() is not None
+
+    def add(self, urlhash, url, score=0.0, depth=0, queued=True):
+        # Returns True if the url was not seen before. queued is False for
+        # a url the frontier does not keep in memory.
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO urls VALUES (?, ?, 0)", (urlhash, url))
+        if cursor.rowcount != 1:
+            return False
+        self.add_pending(urlhash, url, score, depth, queued)
+        return True
+
+    def add_pending(self, urlhash, url, score=0.0, depth=0, queued=False):
+        self.db.execute(
+            "INSERT OR IGNORE INTO pending (urlhash, url, score, depth, "
+            "queued) VALUES (?, ?, ?, ?, ?)",
+            (urlhash, url, score, depth, int(queued)))
+        self._record()
+
+    def mark_complete(self, urlhash, url):
+        # Returns False if the url was not seen before.
+        cursor = self.db.execute(
+            "UPDATE urls SET completed = 1 WHERE urlhash = ?", (urlhash,))
+        seen = cursor.rowcount == 1
+        if not seen:
+            self.db.execute(
+                "INSERT INTO urls VALUES (?, ?, 1)", (urlhash, url))
+        self.db.execute("DELETE FROM pending WHERE urlhash = ?", (urlhash,))
+        self._record()
+        return seen
+
+    def values(self):
+        for url, completed in self.db.execute(
+                "SELECT url, completed FROM urls"):
+            yield url, bool(completed)
+
+    def pending_count(self):
+        return self.db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def requeue_pending(self):
+        # On resume nothing is queued in memory yet.
+        self.db.execute("UPDATE pending SET queued = 0 WHERE queued = 1")
+
+    def next_pending(self, count):
+        # Returns up to count (url, score, depth) of the pending urls that
+        # are not queued, best first, and marks them queued. The marks
+        # need not survive a crash, so they are not counted as records.
+        rows = self.db.execute(
+            "SELECT seq, url, score, depth FROM pending WHERE queued = 0 "
+            "ORDER BY score DESC, seq LIMIT ?", (count,)).fetchall()
+        self.db.executemany(
+            "UPDATE pending SET queued = 1 WHERE seq = ?",
+            [(row[0],) for row in rows])
+        return [row[1:] for row in rows]
+
+    def _flush(self):
+        self.db.commit()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+STORAGE_BACKENDS = {
+    "shelve": ShelveStorage,
+    "sqlite": SQLiteStorage,
+}
+
+
+def get_storage_class(name):
+    try:
+        return STORAGE_BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown frontier storage {name!r}, "
+            f"expected one of {sorted(STORAGE_BACKENDS)}.")
@@ -1,10 +1,13 @@
+import time
+
 from threading import Thread
+from urllib.parse import urlparse
 
 from inspect import getsource
-from utils.download import download
+from utils.download import Downloader
 from utils import get_logger
+from utils.metrics import metrics
 import scraper
-import time
 
 
 class Worker(Thread):
@@ -12,22 +15,58 @@ class Worker(Thread):
         self.logger = get_logger(f"Worker-{worker_id}", "Worker")
         self.config = config
         self.frontier = frontier
+        self.downloader = Downloader(config, self.logger)
         # basic check for requests in scraper
         assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests from scraper.py"
         super().__init__(daemon=True)
         
     def run(self):
         while True:
+            start = time.perf_counter()
             tbd_url = self.frontier.get_tbd_url()
+            metrics.record("frontier.get", time.perf_counter() - start)
             if not tbd_url:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
+                self.downloader.close()
                 break
-            resp = download(tbd_url, self.config, self.logger)
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper.scraper(tbd_url, resp)
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
-            self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
+            resp = None
+            done = True
+            try:
+                if not self.frontier.can_fetch(tbd_url):
+                    self.logger.info(f"Skipped {tbd_url}, disallowed by robots.txt.")
+                    continue
+                resp = self.downloader.download(tbd_url)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server} "
+                    f"in {resp.latency:.3f}s.")
+                if self.frontier.fetch_unchanged(tbd_url, resp):
+                    self.logger.info(f"Skipped {tbd_url}, unchanged since the last visit.")
+                    continue
+                done = self.process(tbd_url, resp)
+            except Exception:
+                self.logger.exception(f"Failed to crawl {tbd_url}.")
+                metrics.count("worker.errors")
+                # Not recorded in the fetch history, so a refresh crawl
+                # scrapes it again
+                resp = None
+            finally:
+                # Always release the url and its host. Politeness is
+                # enforced per host by the frontier, which will not hand
+                # out this host again until time_delay has passed.
+                if done:
+                    self.frontier.mark_url_complete(tbd_url, resp)
+
+    # This function will scrape the downloaded page and add its links to
+    # the frontier. It returns False if the url is left to be marked
+    # complete later, by another thread
+    def process(self, tbd_url, resp):
+        start = time.perf_counter()
+        scraped_urls = self.scrape(tbd_url, resp)
+        metrics.record(
+            "scrape", time.perf_counter() - start, urlparse(tbd_url).netloc)
+        self.frontier.add_urls(scraped_urls, tbd_url)
+        return True
+
+    def scrape(self, tbd_url, resp):
+        return scraper.scraper(tbd_url, resp)
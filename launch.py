@@ -1,23 +1,56 @@
+import os
 from configparser import ConfigParser
 from argparse import ArgumentParser
 
 from utils.server_registration import get_cache_server
 from utils.config import Config
-from crawler import Crawler
+from crawler.engines import get_crawler_class
+from crawler.cluster import configure_node
+from utils.traps import TrapDetector, TrapJournal
 
 
-def main(config_file, restart):
+# This function will print the url templates the trap detector of the
+# saved crawl throttled, blocked or was told to allow
+def show_traps(config):
+    traps_file = config.save_file + ".traps"
+    if not os.path.exists(traps_file):
+        print(f"No url templates saved in {traps_file}.")
+        return
+    detector = TrapDetector(
+        config.trap_window, config.trap_throttle_yield,
+        config.trap_cutoff_yield, config.trap_allowed,
+        config.trap_max_templates)
+    detector.load(TrapJournal(traps_file))
+    for template, state in sorted(detector.decisions().items()):
+        print(f"{state}\t{template}")
+
+
+def main(config_file, restart, recrawl=False, node=None, traps=False):
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
+    if traps:
+        show_traps(config)
+        return
+    config.recrawl = recrawl
+    if node is not None:
+        config.node_id = node
+    configure_node(config)
     config.cache_server = get_cache_server(config, restart)
-    crawler = Crawler(config, restart)
+    crawler = get_crawler_class(config.engine)(config, restart)
     crawler.start()
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
+    parser.add_argument("--recrawl", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--node", type=int, default=None)
+    parser.add_argument(
+        "--traps", action="store_true", default=False,
+        help="list the url templates the saved crawl throttled and exit")
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    if args.restart and args.recrawl:
+        parser.error("--recrawl revisits a saved crawl, it cannot --restart")
+    main(args.config_file, args.restart, args.recrawl, args.node, args.traps)
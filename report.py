@@ -0,0 +1,120 @@
+import os
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from configparser import ConfigParser
+from multiprocessing import Pool
+from urllib.parse import urlparse, urldefrag
+
+from utils.config import Config
+from utils.urlset import fingerprint
+from utils.segments import SegmentReader, segment_files, read_index, INDEX_FIELDS
+
+# Records per task, so one large segment is still spread over every core
+CHUNK_RECORDS = 2000
+
+
+# This function will return the tasks of the report: (segment path, first
+# record, end record, positions to skip). Pages stored twice, which a
+# resumed crawl can do for the pages after its last commit, only count
+# the first time.
+def plan_tasks(directory):
+    seen = set()
+    tasks = list()
+    for _, path in segment_files(directory):
+        index = read_index(path)
+        fingerprints = index[INDEX_FIELDS - 1::INDEX_FIELDS]
+        skip = set()
+        for position, url_fingerprint in enumerate(fingerprints):
+            if url_fingerprint in seen:
+                skip.add(position)
+            seen.add(url_fingerprint)
+        for start in range(0, len(fingerprints), CHUNK_RECORDS):
+            end = min(start + CHUNK_RECORDS, len(fingerprints))
+            tasks.append((path, start, end, frozenset(
+                position for position in skip if start <= position < end)))
+    return tasks
+
+
+# This function will count one task's pages the way scraper.record_page
+# does, and return the partial report
+def map_pages(task):
+    from scraper import stop_words_set
+    path, start, end, skip = task
+    words = Counter()
+    hosts = Counter()
+    unique = set()
+    longest_count, longest_url = 0, None
+    reader = SegmentReader(path)
+    try:
+        for position in range(start, end):
+            if position in skip:
+                continue
+            page = reader[position]
+            unique.add(fingerprint(urldefrag(page.url)[0]))
+            netloc = urlparse(page.url).netloc
+            if netloc.find(".ics.uci.edu") > 0:
+                hosts[netloc] += 1
+            if len(page.tokens) > longest_count:
+                longest_count, longest_url = len(page.tokens), page.page_url
+            if not page.duplicate and len(page.tokens) > 50:
+                words.update(
+                    word for word in page.tokens
+                    if word not in stop_words_set)
+    finally:
+        reader.close()
+    return words, hosts, unique, longest_count, longest_url
+
+
+# This function will merge the partial reports of the tasks
+def reduce_reports(partials):
+    words = Counter()
+    hosts = Counter()
+    unique = set()
+    longest_count, longest_url = 0, None
+    for (part_words, part_hosts, part_unique, part_count,
+         part_url) in partials:
+        words.update(part_words)
+        hosts.update(part_hosts)
+        unique |= part_unique
+        if part_count > longest_count:
+            longest_count, longest_url = part_count, part_url
+    return words, hosts, unique, longest_count, longest_url
+
+
+def main(config_file, directory, processes):
+    if directory is None:
+        cparser = ConfigParser()
+        cparser.read(config_file)
+        directory = Config(cparser).save_file + ".pages"
+    start = time.perf_counter()
+    tasks = plan_tasks(directory)
+    if not tasks:
+        print(f"No pages stored in {directory}, set SEGMENTBYTES and crawl.")
+        return
+    with Pool(processes or os.cpu_count()) as pool:
+        partials = pool.imap_unordered(map_pages, tasks)
+        words, hosts, unique, longest_count, longest_url = reduce_reports(
+            partials)
+    top_100 = dict(words.most_common(100))
+    sub_domain = dict(sorted(hosts.items()))
+    print(f"Unique pages: {len(unique)}.\nTop 100 words are {top_100}.\n"
+          f"Longest page is {longest_url} with {longest_count} words.\n"
+          f"Number of ics.uci.edu subdomain: {len(sub_domain)}. "
+          f"List below: {sub_domain}\n")
+    print(f"Counted {sum(end - first - len(skip) for _, first, end, skip in tasks)} "
+          f"pages in {len(tasks)} tasks in {time.perf_counter() - start:.2f}s.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Recomputes the crawl report from the stored pages.")
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument(
+        "--pages", type=str, default=None,
+        help="directory of page segments, SAVE.pages by default")
+    parser.add_argument(
+        "--processes", type=int, default=0,
+        help="worker processes, 0 for one per core")
+    args = parser.parse_args()
+    main(args.config_file, args.pages, args.processes)
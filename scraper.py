@@ -1,14 +1,19 @@
-from importlib.resources import path
-import re
-import itertools
-import urllib.robotparser
-from urllib.parse import urlparse, urljoin, urldefrag
-from bs4 import BeautifulSoup
+import time
+from collections import Counter, namedtuple
+from threading import RLock
+from urllib.parse import urlparse, urldefrag
 from http.client import responses
 from utils import get_logger
-from nltk.tokenize import word_tokenize
-
-stop_words_set = (["a", "about", "above", "after", "again", "against", "all", "am", "an", "and", "any", "are", "aren't", "as", "at", 
+from utils import extract
+from utils import tokenizer
+from utils.word_stats import WordFrequency
+from utils.simhash import SimHashIndex, simhash
+from utils.url_filter import UrlClassifier
+from utils.urlset import FingerprintSet
+from utils.traps import TrapDetector
+from utils.metrics import metrics
+
+stop_words_set = frozenset(["a", "about", "above", "after", "again", "against", "all", "am", "an", "and", "any", "are", "aren't", "as", "at", 
                     "be", "because", "been", "before", "being", "below", "between", "both", "but", "by", "can't", "cannot", "could", 
                     "couldn't", "did", "didn't", "do", "does", "doesn't", "doing", "don't", "down", "during", "each", "few", "for", "from", 
                     "further", "had", "hadn't", "has", "hasn't", "have", "haven't", "having", "he", "he'd", "he'll", "he's", "her", "here", 
@@ -22,13 +27,13 @@ stop_words_set = (["a", "about", "above", "after", "again", "against", "all", "a
                     "won't", "would", "wouldn't", "you", "you'd", "you'll", "you're", "you've", "your", "yours", "yourself"])
 
 # Store the visited url to prevent revisiting
-visited_url = set()
+visited_url = FingerprintSet()
 
 # Set of unique url in terms of scheme://domain/path
-unique_url = set()
+unique_url = FingerprintSet()
 
-# Dictionary of word. E.g, {word : frequency}
-word_dict = {}
+# Frequency of each word, with the top 100 kept up to date as pages are counted
+word_freq = WordFrequency(100)
 
 # Longest url and the number of word in the url
 longest_url = None
@@ -37,12 +42,99 @@ long_url_words_count = 0
 # Dictionary of subdomain of "ics.uci.edu". E.g, {domain : frequency}
 sub_domain = {}
 
-# Set of the hash value per page to advoid crawling same page with distinct url
-dup_dec = set()
+# SimHash fingerprint per page to advoid crawling same or nearly same page with distinct url
+dup_dec = SimHashIndex(3)
+
+# Guards the statistics above when several workers scrape at once
+stats_lock = RLock()
+
+# Compiled url rules with cached verdicts, used by is_valid and safty_check
+url_classifier = UrlClassifier()
+
+# Throttles url templates whose pages stop yielding, see utils/traps.py
+trap_detector = TrapDetector()
+
+# Saves what each page adds to the statistics above, see utils/state.py.
+# Set by the frontier with restore_state
+state_store = None
+
+# Word count of each page recorded but not yet marked complete, which the
+# frontier uses to score the page's links
+page_words = {}
+
+# Urls fetched again by a refresh crawl whose page changed, set by the
+# frontier. Their links are followed again, but the statistics keep
+# counting each url once, as of its first visit
+revisits = set()
+
+# Appends each recorded page's tokens and links to segment files, see
+# utils/segments.py. Set by the frontier with set_page_store
+page_store = None
+
+# Whether analyze_page keeps the token stream of the page for page_store
+keep_tokens = False
+
+# Pages bigger than this many bytes are skipped without being decoded, 0 for no limit
+max_body_size = 0
+
+# Turns the text of a page into words, see utils/tokenizer.py
+tokenize = tokenizer.tokenize
 
 # ------------------------ HELPER FUNCTIONS ------------------------
 
+# This function will apply the scraper settings from the config
+def configure(config):
+    global tokenize, dup_dec, visited_url, unique_url, trap_detector
+    global max_body_size, keep_tokens
+    extract.set_backend(config.parser)
+    tokenize = tokenizer.get_tokenizer(config.tokenizer)
+    dup_dec = SimHashIndex(config.simhash_distance)
+    visited_url = FingerprintSet(bloom_bits=config.url_bloom_bits)
+    unique_url = FingerprintSet(bloom_bits=config.url_bloom_bits)
+    trap_detector = TrapDetector(
+        config.trap_window, config.trap_throttle_yield,
+        config.trap_cutoff_yield, config.trap_allowed,
+        config.trap_max_templates)
+    max_body_size = config.max_body_size
+    keep_tokens = config.segment_bytes > 0
+
+# This function will load the saved statistics on resume, and have every
+# page note what it adds to them in store from now on
+def restore_state(store, resume):
+    global state_store, longest_url, long_url_words_count
+    state_store = store
+    if not resume:
+        return
+    saved = store.load()
+    with stats_lock:
+        visited_url.update_fingerprints(saved.visited)
+        unique_url.update_fingerprints(saved.unique)
+        dup_dec.extend(saved.simhash)
+        for host, count in saved.hosts.items():
+            sub_domain[host] = sub_domain.get(host, 0) + count
+        if saved.longest_count > long_url_words_count:
+            long_url_words_count = saved.longest_count
+            longest_url = saved.longest_url
+    word_freq.merge(saved.words)
+
+# This function will load the trap detector's templates saved in journal
+# by the crawl being resumed
+def load_traps(journal):
+    trap_detector.load(journal)
+
+# This function will hand the trap detector's templates that changed since
+# the last save to journal
+def save_traps(journal):
+    if trap_detector.window:
+        trap_detector.save(journal)
+
+# This function will have every recorded page written to store
+def set_page_store(store):
+    global page_store
+    page_store = store
+
 # This funcation will check the given url is a subdomain of ics.uci.edu
+# and return the subdomain if it was counted
 def sub_domain_check(url):
     global sub_domain
     parsed = urlparse(url)
@@ -52,12 +144,13 @@ def sub_domain_check(url):
             sub_domain[parsed.netloc] = 1
         else:
             sub_domain[parsed.netloc] += 1
+        return parsed.netloc
+    return None
         
 # This function will keep updating for the cralwer
 def log_update(url):
-    global unique_url, word_dict, longest_url, long_url_words_count, sub_domain
-    word_dict = dict(sorted(word_dict.items(), key=lambda item: item[1], reverse=True))
-    top_100 = dict(itertools.islice(word_dict.items(), 100))
+    global unique_url, word_freq, longest_url, long_url_words_count, sub_domain
+    top_100 = dict(word_freq.most_common(100))
     
     logger = get_logger('CRAWLER')
     logger.info(f"Current url: {url}\n")
@@ -65,50 +158,13 @@ def log_update(url):
                 f"Longest page is {longest_url} with {long_url_words_count} words.\n"
                 f"Number of ics.uci.edu subdomain: {len(sub_domain)}. List below: {sub_domain}\n\n")
     
-# This function will count the frequency of each word by given list
-def word_counter(text):
-    global word_dict
-
-    for word in text:
-        if word not in stop_words_set:
-            if word_dict.get(word) is None:
-                word_dict[word] = 1
-            else:
-                word_dict[word] += 1
-                    
-
 # This function will extract the content from the page to a list of string
-def extract_content(resp):
-    global longest_url, long_url_words_count
-
-    # Empty page (with status code 200), no content
-    if resp.raw_response is None:
-        return []
-
-    # tokenize from the web
-    soup = BeautifulSoup(resp.raw_response.content, "html.parser")
-    text = word_tokenize(soup.get_text())
-    
-    # remove anything which is not alphabet
-    for i in range(len(text)):
-
-        text[i] = re.sub(r'[^a-zA-Z]', '',text[i])
-        text[i] = text[i].lower()
-
-        if len(text[i]) == 1:
-            text[i] = ""
-    # remove empty string
-    while "" in text:
-        text.remove("")
-    
-    # Counter for the valid words and update for the longest page in terms of the number of word
-    if len(text) > long_url_words_count:
-        long_url_words_count = len(text)
-        longest_url = resp.raw_response.url
- 
-    return text
+def extract_content(page):
+    # lowercase words of two or more letters
+    return list(tokenize(page.text))
 
 # This function will check the uniquity of given url
+# and return its fingerprint if it was added
 def unique_url_check(url):
     global unique_url
     
@@ -116,8 +172,10 @@ def unique_url_check(url):
     parsed, frag = urldefrag(url)
     
     # add to the set if domain name hasn't been seen
-    if parsed not in unique_url:
-        unique_url.add(parsed)
+    fingerprint = unique_url.key(parsed)
+    if unique_url.add_fingerprint(fingerprint):
+        return fingerprint
+    return None
         
 # This function will check the follwoing traps for the given url
 #   1. Long path url
@@ -125,38 +183,10 @@ def unique_url_check(url):
 #   3. Events pages
 #   4. Calendar pages
 #   5. Genealogy pagess
-#   6. Empty pages
+# The rules live in utils/url_filter.py
 def safty_check(url):
-    parsed = urlparse(url)
+    return url_classifier.trap_reason(url) is None
 
-    # 1. Long path url
-    if len(parsed.path) > 150:
-        return False
-
-    # 2. Repeating direction
-    path_element = parsed.path.split("/")
-    path_element.remove("")
-    if len(path_element) != len(set(path_element)):
-        return False
-
-    # 3. Event pages
-    if re.search(r"/events/|/events|/event/|/event", parsed.path):
-        return False
-        
-    # 4. Calendar pages
-    if re.search(r"/calendars/|/calendars|/calendar/|/calendar", parsed.path):
-        return False
-
-    # 5. Genealogy pages
-    if re.search(r"/Family/|/Family|/Families/|/Families", parsed.path):
-        return False
-        
-    # 6. Empty pages
-    if parsed is None:
-        return False
-
-    return True
-    
 # This function will check the resp.status
 # Only retuen Ture when status code is 200
 # Otherwise, return False and print the error code
@@ -165,7 +195,8 @@ def status_check(resp):
         if(resp.status > 599):
             print(f"Caching error {resp.status}: {resp.error}")
         else:
-            print(responses[resp.status])
+            # http.client does not know every status, e.g. Cloudflare's 520
+            print(responses.get(resp.status, f"Status {resp.status}"))
             
         return False
     else:
@@ -174,55 +205,156 @@ def status_check(resp):
 # --------------------- END OF HELPER FUNCTIONS ---------------------
 
 def scraper(url, resp):
+    start = time.perf_counter()
+    accepted = accept_page(url, resp)
+    metrics.record("scrape.accept", time.perf_counter() - start)
+    if not accepted:
+        trap_detector.record(url, False)
+        return list()
+    analysis = analyze_page(resp.raw_response.url, resp.content)
+    start = time.perf_counter()
+    links = record_page(url, resp.raw_response.url, analysis)
+    metrics.record("scrape.record", time.perf_counter() - start)
+    return links
+
+# The scraper runs in three steps so that the parsing can run in another
+# process (see crawler/pipeline.py):
+#   1. accept_page  checks the response and the url against the crawl state
+#   2. analyze_page parses the page; it only reads its arguments
+#   3. record_page  adds the result to the crawl statistics
+
+# This function will check whether the page should be parsed at all
+def accept_page(url, resp):
+    global visited_url
+
+    # The checks that only need the url and the size of the page come
+    # first, so the pages they reject are never unpickled
+    if not resp.has_response:
+        return False
+    if max_body_size and resp.size > max_body_size:
+        return False
+    if not safty_check(url):
+        return False
+    revisit = url in revisits
+    if url in visited_url and not revisit:
+        return False
+
     # non resp.raw_response is found, return
     if resp.raw_response is None:
-        return list()
+        return False
     # if resp.raw_response doesn't have Content-Type, return
-    if resp.raw_response.headers.get("Content-Type") is None:
-        return list()
+    if resp.headers.get("Content-Type") is None:
+        return False
 
     # only allow type of text/html
-    file_type = resp.raw_response.headers["Content-Type"].split(";")[0]
+    file_type = resp.headers["Content-Type"].split(";")[0]
     if file_type != "text/html":
-        return list()
+        return False
 
-    if not safty_check(url):
-        return list()
+    if revisit:
+        return status_check(resp)
 
-    global visited_url
-    if url in visited_url:
-        return list()
+    with stats_lock:
+        if url in visited_url:
+            return False
 
-    sub_domain_check(url)
-    visited_url.add(url)
+        host = sub_domain_check(url)
+        fingerprint = visited_url.key(url)
+        visited_url.add_fingerprint(fingerprint)
+        if state_store is not None:
+            delta = state_store.page(url)
+            delta.visited = fingerprint
+            delta.host = host
 
     # get the status of url
     if not status_check(resp):
-        return list()
+        return False
+
+    with stats_lock:
+        fingerprint = unique_url_check(url)
+        if state_store is not None:
+            state_store.page(url).unique = fingerprint
+    return True
 
-    unique_url_check(url)
-    text = extract_content(resp)
+# Result of analyze_page, small enough to send between processes. tokens
+# is the token stream joined by spaces when pages are stored, else None
+PageAnalysis = namedtuple(
+    "PageAnalysis",
+    ["word_total", "word_counts", "fingerprint", "links", "tokens"])
+
+# This function will parse the page once and return its statistics and links
+def analyze_page(page_url, content):
+    start = time.perf_counter()
+    page = extract.extract_page(content)
+    parsed = time.perf_counter()
+    text = extract_content(page)
+    word_counts = Counter(word for word in text if word not in stop_words_set)
+    tokenized = time.perf_counter()
+    fingerprint = simhash(text)
+    hashed = time.perf_counter()
+    links = candidate_links(page_url, page)
+    metrics.record("scrape.parse", parsed - start)
+    metrics.record("scrape.tokenize", tokenized - parsed)
+    metrics.record("scrape.simhash", hashed - tokenized)
+    metrics.record("scrape.links", time.perf_counter() - hashed)
+    tokens = " ".join(text) if keep_tokens else None
+    return PageAnalysis(len(text), word_counts, fingerprint, links, tokens)
+
+# This function will add an analyzed page to the statistics and return its links
+def record_page(url, page_url, analysis):
+    global longest_url, long_url_words_count
+    page_words[url] = analysis.word_total
+
+    # A changed page of a refresh crawl only gives its links
+    if url in revisits:
+        return [link for link in analysis.links
+                if link not in visited_url and trap_detector.admit(link)]
+    delta = state_store.page(url) if state_store is not None else None
 
-    # found the duplication, skip the url
-    hash_num = hash(frozenset(text))
-    if hash_num in dup_dec:
+    # Counter for the valid words and update for the longest page in terms of the number of word
+    with stats_lock:
+        if analysis.word_total > long_url_words_count:
+            long_url_words_count = analysis.word_total
+            longest_url = page_url
+            if delta is not None:
+                delta.longest_count = analysis.word_total
+                delta.longest_url = page_url
+
+        duplicate = dup_dec.seen(analysis.fingerprint)
+        if delta is not None and not duplicate:
+            delta.simhash = analysis.fingerprint
+
+    # Near duplicates are stored too, marked, so the report can count them
+    # as pages without counting their words
+    if page_store is not None and analysis.tokens is not None:
+        page_store.add(
+            url, page_url, duplicate, analysis.tokens, analysis.links)
+
+    # found the duplication or near duplication, skip the url
+    if duplicate:
+        trap_detector.record(url, False)
         return list()
-    else:
-        dup_dec.add(hash_num)
-   
+
     # Only do the statistic when there're more than 50 words to adviod page without information
-    if len(text) > 50:
-        word_counter(text)
+    if analysis.word_total > 50:
+        new_words = word_freq.merge(analysis.word_counts)
+        if delta is not None:
+            delta.words = analysis.word_counts
+        trap_detector.record(url, True, new_words)
     # Do not extract any link from page without information, since it tends to be useless link
     else:
+        trap_detector.record(url, False)
         return list()
-    
-    valid_link = extract_next_links(resp.raw_response.url, resp)
-    log_update(url)
+
+    # Skip links whose template stopped yielding, see utils/traps.py
+    valid_link = [link for link in analysis.links
+                  if link not in visited_url and trap_detector.admit(link)]
+    with stats_lock:
+        log_update(url)
 
     return valid_link
 
-def extract_next_links(url, resp):
+def extract_next_links(url, resp, page=None):
     # Implementation required.
     # url: the URL that was used to get the page
     # resp.url: the actual url of the page
@@ -232,79 +364,34 @@ def extract_next_links(url, resp):
     #         resp.raw_response.url: the url, again
     #         resp.raw_response.content: the content of the page!
     # Return a list with the hyperlinks (as strings) scrapped from resp.raw_response.content
-    soup = BeautifulSoup(resp.raw_response.content, "html.parser")
-    links_per_page = set()
-    ori = urlparse(url)
+    if page is None:
+        page = extract.extract_page(resp.content)
+    return [link for link in candidate_links(url, page) if link not in visited_url]
 
-    # get all a tag with link
-    for link in soup.find_all(lambda tag: tag.name=='a' and tag.get("href")):
-        mod_link = link.get("href")
-
-        # ignore the fragement url
-        if mod_link[0] == "#":
-            continue
-
-        mod_parsed = urlparse(mod_link)
-
-        # convert relative url to absoulate url
-        if mod_parsed.scheme == "":
-            if ori.path == "":
-                mod_link = url + mod_link
-            else:
-                mod_link = urljoin(url, mod_link)
-
-        # reconstruct the absoluate url
-        mod_parsed = urlparse(mod_link)
-        mod_link = mod_parsed.scheme + "://" + mod_parsed.netloc + mod_parsed.path
+# This function will return the links of the page that pass is_valid, apart
+# from the visited check which depends on the crawl state
+def candidate_links(url, page):
+    links_per_page = set()
 
-        if is_valid(mod_link) and mod_link not in links_per_page:
+    # get all a tag with link, as absolute urls
+    for mod_link in extract.resolve_links(url, page.hrefs):
+        if url_classifier.classify(mod_link) is None and mod_link not in links_per_page:
             links_per_page.add(mod_link)
-               
+
     return list(links_per_page)
- 
+
 def is_valid(url):
     try:
-        parsed = urlparse(url)
-        
-        # check the scheme
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-        
-        # if no domain name is presented
-        if parsed.netloc is None:
-            return False
-        
-        # defragment the url
-        if parsed.fragment != "":
+        # scheme, domain, fragment and file extension, see utils/url_filter.py
+        if url_classifier.classify(url) is not None:
             return False
-        
-        # chech the domain
-        if not re.match(r".*\.(ics.uci.edu|cs.uci.edu|informatics.uci.edu|stat.uci.edu|today.uci.edu/department/information_computer_sciences)", parsed.netloc):
-            return False
-        
-        # Here is a rough check to filiter out by the end of path
-        # Since we can't list all types, so we will check header in scraper function later
-        # Remove the path with ova & apk which are typically large and no infomation
-        # Advoid file like java, cpp, c, h, and json which are no valuable infomation in it
-        # Don't get the bat, nna,, maf, etc... (no valuable infomation)
-        if re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-            + r"|png|tiff?|mid|mp2|mp3|mp4"
-            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-            + r"|epub|dll|cnf|tgz|sha1"
-            + r"|thmx|mso|arff|rtf|jar|csv"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz|bw|gtf"
-            + r"|ppsx|txt|pdf|php|odp|h|cc|py|ova|apk|m|tst|bat|nna|maf|xml|json|cpp|java)$", parsed.path.lower()):
-            return False
-            
+
         # Avoid revisiting the visited url
         if url in visited_url:
             return False
-        
+
     except TypeError:
-        print ("TypeError for ", parsed)
+        print ("TypeError for ", url)
         raise
-    
-    return True
\ No newline at end of file
+
+    return True
@@ -0,0 +1,48 @@
+import os
+import sys
+import pickle
+from configparser import ConfigParser
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+
+# This function will return the Config of config.ini with the crawl saved
+# in directory, without robots.txt or a politeness delay, and settings
+# overridden by KEY=value keywords
+def make_config(directory, **settings):
+    from utils.config import Config
+    cparser = ConfigParser()
+    cparser.read(os.path.join(REPO, "config.ini"))
+    cparser["LOCAL PROPERTIES"]["SAVE"] = os.path.join(directory, "frontier.db")
+    cparser["CRAWLER"]["ROBOTS"] = "false"
+    cparser["CRAWLER"]["POLITENESS"] = "0"
+    for key, value in settings.items():
+        sections = [
+            section for section in cparser.sections()
+            if key in cparser[section]] or ["LOCAL PROPERTIES"]
+        cparser[sections[0]][key] = str(value)
+    return Config(cparser)
+
+
+# This function will return the Response the cache server sends for an
+# html page
+def html_response(url, html, status=200):
+    import requests
+    from utils.response import Response
+    raw = requests.models.Response()
+    raw._content = html.encode("utf-8")
+    raw.status_code = status
+    raw.url = url
+    raw.headers["Content-Type"] = "text/html; charset=utf-8"
+    raw.encoding = "utf-8"
+    return Response({"url": url, "status": status, "response": pickle.dumps(raw)})
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    ''' Runs the test in tmp_path, so Logs/ and save files land there. '''
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path)
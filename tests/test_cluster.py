@@ -0,0 +1,77 @@
+import time
+import socket
+import threading
+from collections import Counter
+
+import scraper
+from crawler import cluster
+from crawler.cluster import Cluster, ClusterServer, node_stats
+from conftest import make_config
+
+
+def free_address():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()
+
+
+# Node 1 of the cluster, which only takes the urls it is sent
+class Receiver(object):
+    def __init__(self, address):
+        self.urls = []
+        self.server = ClusterServer(address, self)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, message):
+        self.urls.extend(message["urls"])
+        return {"ok": True}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_unacknowledged_urls_are_forwarded_after_a_crash(workdir):
+    addresses = [free_address(), free_address()]
+    config = make_config(
+        workdir, NODEID=0, FORWARDINTERVAL=0.01,
+        NODES=",".join(f"{host}:{port}" for host, port in addresses))
+    hosts = [f"h{n}.ics.uci.edu" for n in range(40)]
+    urls = [f"https://{host}/page" for host in hosts
+            if Cluster(config).ring.owner(host) == 1]
+    assert urls
+
+    # Node 1 is down, then node 0 crashes without closing anything
+    crashed = Cluster(config)
+    crashed.open(False)
+    for url in urls:
+        crashed.forward(url)
+    crashed.flush()
+
+    resumed = Cluster(config)
+    resumed.open(True)
+    peer = resumed.peers[1]
+    assert peer.buffer == urls
+    receiver = Receiver(addresses[1])
+    try:
+        peer.thread.start()
+        deadline = time.monotonic() + 10
+        while peer.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        peer.close()
+    finally:
+        receiver.close()
+    assert receiver.urls == urls
+
+    again = Cluster(config)
+    again.open(True)
+    assert again.peers[1].buffer == []
+
+
+def test_report_sends_only_the_top_words(monkeypatch):
+    monkeypatch.setattr(cluster, "REPORT_WORDS", 10)
+    monkeypatch.setattr(scraper, "word_freq", scraper.WordFrequency(100))
+    scraper.word_freq.merge(Counter(
+        {f"word{chr(97 + n // 26)}{chr(97 + n % 26)}": n for n in range(1, 100)}))
+    words = node_stats()["words"]
+    assert len(words) == 10 and min(words.values()) == 90
@@ -0,0 +1,22 @@
+import os
+from configparser import ConfigParser
+
+from utils.config import Config
+from conftest import REPO
+
+# The settings config.ini has to give, everything else has a default
+REQUIRED = {
+    "IDENTIFICATION": ["USERAGENT"],
+    "CONNECTION": ["HOST", "PORT"],
+    "LOCAL PROPERTIES": ["SAVE", "THREADCOUNT"],
+    "CRAWLER": ["SEEDURL", "POLITENESS"],
+}
+
+
+def test_defaults_match_config_ini():
+    full = ConfigParser()
+    full.read(os.path.join(REPO, "config.ini"))
+    required = ConfigParser()
+    for section, keys in REQUIRED.items():
+        required[section] = {key: full[section][key] for key in keys}
+    assert vars(Config(required)) == vars(Config(full))
@@ -0,0 +1,150 @@
+import pickle
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import cbor
+import pytest
+import requests
+
+from utils import download
+from utils.download import Downloader, DOWNLOAD_ERROR
+from conftest import make_config
+
+URL = "https://www.ics.uci.edu/page"
+
+
+# Stand-in for the cache server. answers maps a url to the statuses to
+# send for it, one per request; the last one repeats.
+class CacheServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), CacheHandler)
+        self.answers = {}
+        self.requests = []
+        self.release = threading.Event()
+
+
+class CacheHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = parse_qs(urlparse(self.path).query)["q"][0]
+        self.server.requests.append((url, self.client_address))
+        answers = self.server.answers.get(url, [200])
+        status = answers.pop(0) if len(answers) > 1 else answers[0]
+        if status is None:
+            # Never answer, so the client times out
+            self.server.release.wait(5)
+            return
+        if status < 500:
+            raw = requests.models.Response()
+            raw._content = b"<p>page</p>"
+            raw.status_code = status
+            raw.url = url
+            body = cbor.dumps({
+                "url": url, "status": status, "response": pickle.dumps(raw)})
+        else:
+            body = cbor.dumps({"url": url, "status": status, "error": "busy"})
+        self.send_response(200 if status < 600 else status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = CacheServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waits = []
+    monkeypatch.setattr(download.time, "sleep", waits.append)
+    return waits
+
+
+def downloader_for(server, workdir, **settings):
+    config = make_config(workdir, **settings)
+    config.cache_server = server.server_address
+    return Downloader(config)
+
+
+def test_pages_reuse_one_connection(server, workdir):
+    downloader = downloader_for(server, workdir)
+    try:
+        for n in range(5):
+            resp = downloader.download(f"{URL}{n}")
+            assert resp.status == 200 and resp.raw_response.content
+            assert resp.latency == downloader.last_latency >= 0
+    finally:
+        downloader.close()
+    assert len(server.requests) == 5
+    assert len({address for _, address in server.requests}) == 1
+
+
+@pytest.mark.parametrize("status", [503, 601, 602])
+def test_transient_errors_are_retried_with_backoff(
+        server, workdir, sleeps, status):
+    server.answers[URL] = [status, status, 200]
+    downloader = downloader_for(server, workdir, RETRIES=2, RETRYBACKOFF=0.5)
+    try:
+        assert downloader.download(URL).status == 200
+    finally:
+        downloader.close()
+    assert len(server.requests) == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_retries_give_up(server, workdir, sleeps):
+    server.answers[URL] = [503]
+    downloader = downloader_for(server, workdir, RETRIES=2)
+    try:
+        assert downloader.download(URL).status == 503
+    finally:
+        downloader.close()
+    assert len(server.requests) == 3 and len(sleeps) == 2
+
+
+@pytest.mark.parametrize("status", [404, 603, 607, 608])
+def test_final_answers_are_not_retried(server, workdir, sleeps, status):
+    server.answers[URL] = [status]
+    downloader = downloader_for(server, workdir)
+    try:
+        assert downloader.download(URL).status == status
+    finally:
+        downloader.close()
+    assert len(server.requests) == 1 and not sleeps
+
+
+def test_timeout_is_a_download_error(server, workdir, sleeps):
+    server.answers[URL] = [None]
+    downloader = downloader_for(server, workdir, READTIMEOUT=0.2, RETRIES=1)
+    try:
+        resp = downloader.download(URL)
+    finally:
+        downloader.close()
+    assert resp.status == DOWNLOAD_ERROR and resp.error
+    assert len(server.requests) == 2 and len(sleeps) == 1
+
+
+def test_refused_connection_is_a_download_error(server, workdir, sleeps):
+    downloader = downloader_for(server, workdir, RETRIES=1)
+    server.shutdown()
+    server.server_close()
+    try:
+        resp = downloader.download(URL)
+    finally:
+        downloader.close()
+    assert resp.status == DOWNLOAD_ERROR and resp.latency is not None
+    assert len(sleeps) == 1
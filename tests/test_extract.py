@@ -0,0 +1,52 @@
+import pytest
+
+from utils import extract
+from utils.tokenizer import tokenize
+
+pytest.importorskip("bs4")
+from benchmarks.parse_parity import legacy_text, legacy_links
+
+URL = "https://www.ics.uci.edu/community/news/index.php"
+
+PAGES = [
+    b"<html><head><title>News</title></head><body><p>Plain page.</p>"
+    b"<a href='/about/'>About</a> <a href='people.html#top'>People</a>"
+    b"<a href='#main'>skip</a><a>no href</a></body></html>",
+    b"<html><head><script>var hidden = 'script words';</script>"
+    b"<style>p { color: red }</style></head><body><template>template words"
+    b"</template><p>shown words</p></body></html>",
+    b"<p>a<![CDATA[cdata words]]>b</p><!-- comment words --><p>after</p>",
+    b"<p>caf&eacute; &amp; tea &#8212; &lt;tag&gt; &nbsp;space</p>",
+    b"<div><p>unclosed <b>bold <i>italic</div><p>next <a href=x.html>x",
+    b"<A HREF='HTTP://WWW.CS.UCI.EDU/Upper'>Upper</A><a href="
+    b"'https://www.stat.uci.edu/a?b=c;d#e'>query</a><a href=''>empty</a>",
+    b"<html><head><meta charset='iso-8859-1'></head><body>"
+    b"<p>na\xefve r\xe9sum\xe9</p></body></html>",
+    "<p>it’s — “quoted” <a href='/ünï'>unicode</a></p>".encode("utf-8"),
+    b"<table><tr><td>cell one</td><td>cell two</td></tr></table>"
+    b"<ul><li>item<li>item two</ul><br/><img src=x.png alt='alt words'>",
+]
+
+BACKENDS = ["html.parser"] + (["lxml"] if extract.etree is not None else [])
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    previous = extract.backend
+    extract.set_backend(request.param)
+    yield request.param
+    extract.set_backend(previous)
+
+
+@pytest.mark.parametrize("content", PAGES)
+def test_same_tokens_and_links_as_beautifulsoup(backend, content):
+    page = extract.extract_page(content)
+    assert list(tokenize(page.text)) == list(tokenize(legacy_text(content)))
+    assert set(extract.resolve_links(URL, page.hrefs)) == legacy_links(
+        URL, content)
+
+
+def test_cdata_text_is_kept(backend):
+    page = extract.extract_page(PAGES[2])
+    assert "cdata words" in page.text
+    assert "comment words" not in page.text
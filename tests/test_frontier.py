@@ -0,0 +1,58 @@
+import os
+import shelve
+
+import pytest
+
+import scraper
+from crawler.frontier import Frontier
+from utils import get_urlhash
+from conftest import make_config
+
+SEEDS = [f"https://h{n}.ics.uci.edu/page" for n in range(4)]
+
+
+@pytest.mark.parametrize("keep", [0, 16, 0.5])
+def test_damaged_seen_file_is_rebuilt(workdir, keep):
+    config = make_config(workdir, SEEDURL=",".join(SEEDS))
+    scraper.configure(config)
+    frontier = Frontier(config, True)
+    frontier.close()
+    seen_file = frontier.seen_file
+    size = os.path.getsize(seen_file)
+    with open(seen_file, "r+b") as set_file:
+        set_file.truncate(int(size * keep) if keep < 1 else keep)
+
+    frontier = Frontier(config, False)
+    try:
+        assert len(frontier.seen) == len(SEEDS)
+        assert all(url in frontier.seen for url in SEEDS)
+        assert not os.path.exists(seen_file)
+    finally:
+        frontier.close()
+
+
+def test_add_urls_takes_a_generator(workdir):
+    config = make_config(workdir, SEEDURL=SEEDS[0])
+    scraper.configure(config)
+    frontier = Frontier(config, True)
+    try:
+        frontier.add_urls(url for url in SEEDS[1:])
+        assert all(url in frontier.seen for url in SEEDS)
+    finally:
+        frontier.close()
+
+
+def test_resumes_a_save_file_from_before_the_backends(workdir):
+    config = make_config(workdir, SEEDURL=SEEDS[0])
+    assert config.storage == "shelve"
+    # The save file of the original frontier: urlhash -> (url, completed)
+    with shelve.open(config.save_file) as save:
+        for url in SEEDS:
+            save[get_urlhash(url)] = (url, url == SEEDS[0])
+    scraper.configure(config)
+    frontier = Frontier(config, False)
+    try:
+        urls = [frontier.get_tbd_url() for _ in SEEDS[1:]]
+        assert sorted(urls) == SEEDS[1:]
+    finally:
+        frontier.close()
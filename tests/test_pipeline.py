@@ -0,0 +1,56 @@
+import random
+from threading import BoundedSemaphore
+
+import scraper
+from crawler.pipeline import PipelineCrawler
+from conftest import make_config, html_response
+
+PAGES = 8
+
+
+def page_url(n):
+    return f"https://h{n}.ics.uci.edu/page{n}"
+
+
+class CountingSlots(BoundedSemaphore):
+    ''' Notes the most pages handed to the pool at once. '''
+    def __init__(self, value):
+        super().__init__(value)
+        self.size = value
+        self.most = 0
+
+    def acquire(self, *args, **kwargs):
+        acquired = super().acquire(*args, **kwargs)
+        self.most = max(self.most, self.size - self._value)
+        return acquired
+
+
+class ServedCrawler(PipelineCrawler):
+    def __init__(self, config, restart):
+        super().__init__(config, restart)
+        self.slots = CountingSlots(self.slots._initial_value)
+
+    def _make_worker(self, worker_id, config, frontier):
+        worker = super()._make_worker(worker_id, config, frontier)
+        worker.downloader.download = self.download
+        return worker
+
+    def download(self, url):
+        n = int(url.rsplit("page", 1)[1])
+        links = "".join(
+            f'<a href="{page_url(m)}">l</a>' for m in range(PAGES) if m != n)
+        words = random.Random(n)
+        text = " ".join(f"word{words.randrange(500)}" for _ in range(80))
+        resp = html_response(url, f"<p>{text}</p>{links}")
+        resp.latency = 0.0
+        return resp
+
+
+def test_one_thread_feeds_every_process(workdir):
+    config = make_config(
+        workdir, SEEDURL=page_url(0), THREADCOUNT=1, PARSEPROCESSES=2)
+    crawler = ServedCrawler(config, True)
+    crawler.start()
+    assert len(scraper.visited_url) == PAGES
+    assert not crawler.frontier.in_progress
+    assert crawler.slots.most > 1
@@ -0,0 +1,22 @@
+import pytest
+
+from crawler.ratecontrol import RateController
+from utils.download import DOWNLOAD_ERROR
+
+HOST = "www.ics.uci.edu"
+
+
+def controller():
+    return RateController(1, 60, 0.2, 0.5, 2)
+
+
+@pytest.mark.parametrize("status", [500, 503, 601, 602, DOWNLOAD_ERROR])
+def test_failures_back_off(status):
+    rate = controller()
+    assert rate.observe(HOST, 0.1, status) == 2
+
+
+@pytest.mark.parametrize("status", [200, 404, 603, 605, 607, 608])
+def test_final_answers_keep_the_rate(status):
+    rate = controller()
+    assert rate.observe(HOST, 0.1, status) == 1
@@ -0,0 +1,31 @@
+import scraper
+from crawler.frontier import Frontier
+from utils.segments import SegmentReader, segment_files
+from conftest import make_config
+
+URL = "https://www.ics.uci.edu/page"
+
+
+def test_records_are_on_disk_before_completions(workdir):
+    config = make_config(workdir, SEEDURL=URL, STATEINTERVAL=0)
+    scraper.configure(config)
+    frontier = Frontier(config, True)
+    try:
+        url = frontier.get_tbd_url()
+        frontier.pages.add(url, url, False, "some page words", [])
+        records = []
+        flush = frontier.save._flush
+
+        def committed():
+            # What a crash right after this commit would leave on disk
+            _, path = segment_files(frontier.pages.directory)[-1]
+            reader = SegmentReader(path)
+            records.extend(record.url for record in reader)
+            reader.close()
+            flush()
+        frontier.save._flush = committed
+        frontier.mark_url_complete(url)
+        frontier.save.commit()
+        assert records == [url]
+    finally:
+        frontier.close()
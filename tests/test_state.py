@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import random
+import time
+import signal
+import subprocess
+
+from conftest import REPO
+
+HOSTS = 4
+PAGES = 240
+WORDS = [f"word{chr(97 + n % 26)}{chr(97 + n // 26)}" for n in range(300)]
+
+
+def page_html(n):
+    # Distinct texts of distinct lengths, so which pages are near
+    # duplicates and which is the longest does not depend on crawl order
+    words = random.Random(n)
+    text = " ".join(words.choice(WORDS) for _ in range(60 + n))
+    links = "".join(
+        f'<a href="https://h{m % HOSTS}.ics.uci.edu/page{m}">l</a>'
+        for m in ((n * 7 + k) % PAGES for k in range(1, 4)))
+    return f"<html><body><p>{text}</p>{links}</body></html>"
+
+
+# This function will crawl the synthetic site into directory, restarting
+# or resuming it, and print the statistics as json
+def crawl(directory, restart):
+    sys.path.insert(0, REPO)
+    from conftest import make_config, html_response
+    from crawler import Crawler
+    from crawler.worker import Worker
+    import scraper
+
+    class SiteWorker(Worker):
+        def __init__(self, worker_id, config, frontier):
+            super().__init__(worker_id, config, frontier)
+            self.downloader.download = self.download
+
+        def download(self, url):
+            time.sleep(0.005)
+            resp = html_response(url, page_html(int(url.rsplit("page", 1)[1])))
+            resp.latency = 0.005
+            return resp
+
+    # SQLite, since a shelve is only as safe from SIGKILL as its dbm
+    # module, and dbm.dumb rewrites its whole index file on every sync
+    config = make_config(
+        directory, SEEDURL="https://h0.ics.uci.edu/page0", THREADCOUNT=2,
+        STORAGE="sqlite", STATEINTERVAL=0.4, COMMITINTERVAL=10,
+        SEGMENTBYTES=0, REVISITINTERVAL=0)
+    Crawler(config, restart, worker_factory=SiteWorker).start()
+    print(json.dumps({
+        "visited": len(scraper.visited_url),
+        "unique": len(scraper.unique_url),
+        "words": dict(scraper.word_freq.counts),
+        "hosts": scraper.sub_domain,
+        "longest": [scraper.longest_url, scraper.long_url_words_count],
+        "simhashes": len(scraper.dup_dec)}, sort_keys=True))
+
+
+def run_crawl(directory, restart):
+    # The crawl logs to stdout too, the statistics are the last line
+    return subprocess.Popen(
+        [sys.executable, __file__, directory, "restart" if restart else "resume"],
+        cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+
+def statistics(crawler):
+    output = crawler.communicate(timeout=120)[0]
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def test_killed_crawl_resumes_with_same_statistics(tmp_path):
+    whole = tmp_path / "whole"
+    killed = tmp_path / "killed"
+    whole.mkdir()
+    killed.mkdir()
+    expected = statistics(run_crawl(str(whole), True))
+    assert expected["visited"] == PAGES
+
+    # Killed half way between two checkpoints, with pages completed since
+    # the first one
+    crawler = run_crawl(str(killed), True)
+    state = killed / "frontier.db.state"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and not (
+            state.exists() and os.listdir(state)):
+        time.sleep(0.01)
+    time.sleep(0.2)
+    assert crawler.poll() is None
+    crawler.send_signal(signal.SIGKILL)
+    crawler.wait()
+
+    resumed = statistics(run_crawl(str(killed), False))
+    assert resumed == expected
+
+
+if __name__ == "__main__":
+    crawl(sys.argv[1], sys.argv[2] == "restart")
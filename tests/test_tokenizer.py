@@ -0,0 +1,47 @@
+import re
+import random
+
+import pytest
+
+from utils.tokenizer import tokenize
+
+nltk_tokenize = pytest.importorskip("nltk.tokenize")
+
+SAMPLES = [
+    "it’s don’t", "hello—world", "a–b", "x―y", "`quote`", "``tick''",
+    "“double”", "‘single’", "can’t", "we’ll", "O’Neil", "’tis", "«guill»",
+    "„low“", "naïve", "the", "don't", "e-mail", "U.S.", "cannot", "wait...",
+    "--", "(sec)", "a,b", "ab,1cd", "yes!", "end.", "'quoted'", "CS121",
+    "lemme", "gonna", "d'ye", "more'n", "…"]
+
+
+# This function will tokenize the text the way the scraper did before
+# utils.tokenizer. preserve_line skips the punkt sentence splitter, which
+# only moves sentence final periods and needs data nltk downloads.
+def reference(text):
+    words = list()
+    for word in nltk_tokenize.word_tokenize(text, preserve_line=True):
+        word = re.sub(r'[^a-zA-Z]', '', word).lower()
+        if len(word) > 1:
+            words.append(word)
+    return words
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("it’s don’t", ["it", "don"]),
+    ("hello—world", ["hello", "world"]),
+    ("“quoted” ‘words’", ["quoted", "words"]),
+    ("``back`ticks''", ["back", "ticks"]),
+    ("naïve 3,36", ["nave"]),
+])
+def test_unicode_punctuation(text, expected):
+    assert list(tokenize(text)) == expected
+    assert reference(text) == expected
+
+
+def test_random_parity():
+    rng = random.Random(0)
+    for _ in range(3000):
+        text = rng.choice([" ", ""]).join(
+            rng.choice(SAMPLES) for _ in range(rng.randint(1, 8)))
+        assert list(tokenize(text)) == reference(text), text
@@ -0,0 +1,121 @@
+import os
+import json
+
+import scraper
+from crawler.frontier import Frontier
+from utils.traps import (
+    TrapDetector, TrapJournal, url_template, THROTTLED, BLOCKED, ALLOWED)
+from conftest import make_config
+
+REVISION = "https://wiki.ics.uci.edu/doku.php?id=start&rev={}"
+TEMPLATE = url_template(REVISION.format(1))
+
+
+def test_no_new_words_throttles():
+    detector = TrapDetector(window=10)
+    for rev in range(10):
+        detector.record(REVISION.format(rev), True, 0)
+    assert detector.decisions() == {TEMPLATE: THROTTLED}
+    assert sum(detector.admit(REVISION.format(rev)) for rev in range(20)) == 2
+
+
+def test_new_words_keep_template_open():
+    detector = TrapDetector(window=10)
+    for rev in range(10):
+        detector.record(REVISION.format(rev), True, 1 if rev == 5 else 0)
+    assert detector.decisions() == {}
+    for rev in range(10, 20):
+        detector.record(REVISION.format(rev), False)
+    assert detector.decisions() == {TEMPLATE: BLOCKED}
+
+
+def test_allowed_template_is_followed():
+    detector = TrapDetector(window=10, allowed=[TEMPLATE])
+    for rev in range(20):
+        detector.record(REVISION.format(rev), False)
+    assert detector.decisions() == {TEMPLATE: ALLOWED}
+    assert detector.admit(REVISION.format(1))
+
+
+def test_resumed_crawl_keeps_decisions(workdir):
+    config = make_config(workdir, TRAPWINDOW=10)
+    scraper.configure(config)
+    frontier = Frontier(config, True)
+    for rev in range(10):
+        scraper.trap_detector.record(REVISION.format(rev), False)
+    frontier.close()
+
+    scraper.configure(config)
+    assert scraper.trap_detector.decisions() == {}
+    frontier = Frontier(config, False)
+    try:
+        assert scraper.trap_detector.decisions() == {TEMPLATE: BLOCKED}
+        assert not scraper.trap_detector.admit(REVISION.format(11))
+    finally:
+        frontier.close()
+
+    config = make_config(workdir, TRAPWINDOW=10, TRAPALLOW=TEMPLATE)
+    scraper.configure(config)
+    frontier = Frontier(config, False)
+    try:
+        assert scraper.trap_detector.decisions() == {TEMPLATE: ALLOWED}
+        assert scraper.trap_detector.templates[TEMPLATE].fetches == 10
+    finally:
+        frontier.close()
+
+
+def test_cold_open_templates_are_dropped():
+    detector = TrapDetector(window=10, max_templates=5)
+    for rev in range(10):
+        detector.record(REVISION.format(rev), False)
+    for page in range(20):
+        detector.record(f"https://www.ics.uci.edu/page{chr(97 + page)}", True)
+    assert len(detector.templates) == 5
+    assert detector.decisions() == {TEMPLATE: BLOCKED}
+    assert "www.ics.uci.edu/paget" in detector.templates
+    assert "www.ics.uci.edu/pagea" not in detector.templates
+
+
+def test_journal_gets_only_changed_templates(workdir):
+    path = os.path.join(workdir, "traps")
+    journal = TrapJournal(path)
+    detector = TrapDetector(window=10, max_templates=3)
+    for rev in range(10):
+        detector.record(REVISION.format(rev), False)
+    detector.record("https://www.ics.uci.edu/a", True)
+    detector.save(journal)
+    detector.record("https://www.ics.uci.edu/a", True)
+    for name in "bcd":
+        detector.record(f"https://www.ics.uci.edu/{name}", True)
+    detector.save(journal)
+    detector.save(journal)
+    journal.close()
+    with open(path) as journal_file:
+        lines = [json.loads(line)[0] for line in journal_file]
+    assert sorted(lines[:2]) == sorted([TEMPLATE, "www.ics.uci.edu/a"])
+    assert sorted(lines[2:]) == sorted(
+        "www.ics.uci.edu/" + name for name in "abcd")
+
+    with open(path, "a") as journal_file:
+        journal_file.write('["www.ics.uci.edu/e", {"sta')
+    resumed = TrapDetector(window=10, max_templates=3)
+    resumed.load(TrapJournal(path))
+    assert set(resumed.templates) == {
+        TEMPLATE, "www.ics.uci.edu/c", "www.ics.uci.edu/d"}
+    assert resumed.decisions() == {TEMPLATE: BLOCKED}
+
+
+def test_journal_is_compacted(workdir, monkeypatch):
+    monkeypatch.setattr(TrapJournal, "COMPACT_MIN_LINES", 10)
+    path = os.path.join(workdir, "traps")
+    journal = TrapJournal(path)
+    detector = TrapDetector(window=10)
+    for rev in range(30):
+        detector.record(REVISION.format(rev), False)
+        detector.save(journal)
+    journal.close()
+    with open(path) as journal_file:
+        assert len(journal_file.readlines()) <= 10
+    resumed = TrapDetector(window=10)
+    resumed.load(TrapJournal(path))
+    assert resumed.templates[TEMPLATE].fetches == 30
@@ -0,0 +1,44 @@
+import pytest
+
+from utils.url_filter import UrlClassifier
+from benchmarks.url_filter_bench import (
+    legacy_is_valid, legacy_safty_check, synthetic_urls)
+
+EDGE_URLS = [
+    "https://www.ics.uci.edu", "https://www.ics.uci.edu/",
+    "http://www.ics.uci.edu:8080/a.html", "https://WWW.ICS.UCI.EDU/a",
+    "https://ics.uci.edu/a", "https://www.ics.uci.edu.evil.com/a",
+    "https://today.uci.edu/department/information_computer_sciences/a",
+    "ftp://www.ics.uci.edu/a", "mailto:someone@ics.uci.edu",
+    "https://www.ics.uci.edu/a#frag", "https://www.ics.uci.edu/a.PDF",
+    "https://www.ics.uci.edu/a.tar.gz", "https://www.ics.uci.edu/a.jpeg",
+    "https://www.ics.uci.edu/a.jpe", "https://www.ics.uci.edu/pdf",
+    "https://www.ics.uci.edu/a.txt/", "https://www.ics.uci.edu/a.php?x=1",
+    "https://www.ics.uci.edu/a/b/a", "https://www.ics.uci.edu/a//b",
+    "https://www.ics.uci.edu/a/b/", "https://www.ics.uci.edu/" + "x" * 150,
+    "https://www.ics.uci.edu/" + "x" * 149, "https://www.ics.uci.edu/eventsx",
+    "https://www.ics.uci.edu/a/event", "https://www.ics.uci.edu/calendar.html",
+    "https://www.ics.uci.edu/Families/a", "https://www.ics.uci.edu/family",
+    "https://www.ics.uci.edu/a;p=1", "https://www.ics.uci.edu/%7Euser/",
+]
+
+
+@pytest.mark.parametrize("url", EDGE_URLS)
+def test_edge_urls_match_the_old_rules(url):
+    classifier = UrlClassifier()
+    valid = legacy_is_valid(url)
+    assert (classifier.classify(url) is None) == valid
+    # The old trap check only ever ran on urls that passed is_valid
+    if valid:
+        assert (classifier.trap_reason(url) is None) == (
+            legacy_safty_check(url))
+
+
+def test_generated_urls_match_the_old_rules():
+    classifier = UrlClassifier(cache_size=64)
+    for url in synthetic_urls(20000):
+        valid = legacy_is_valid(url)
+        assert (classifier.classify(url) is None) == valid, url
+        if valid:
+            assert (classifier.trap_reason(url) is None) == (
+                legacy_safty_check(url)), url
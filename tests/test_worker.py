@@ -0,0 +1,56 @@
+from threading import Event
+
+import scraper
+from crawler.frontier import Frontier
+from crawler.worker import Worker
+from conftest import make_config, html_response
+
+SEEDS = [f"https://h{n}.ics.uci.edu/page" for n in range(4)]
+
+
+class FailingWorker(Worker):
+    ''' Scrapes nothing, and raises on the first url it is given. '''
+    def __init__(self, worker_id, config, frontier, scraped, failed):
+        super().__init__(worker_id, config, frontier)
+        self.downloader.download = self.download
+        self.scraped = scraped
+        self.failed = failed
+
+    def download(self, url):
+        resp = html_response(url, "<p>x</p>")
+        resp.latency = 0.0
+        return resp
+
+    def scrape(self, tbd_url, resp):
+        if not self.failed.is_set():
+            self.failed.set()
+            raise RuntimeError("scraper bug")
+        self.scraped.append(tbd_url)
+        return list()
+
+
+def test_worker_error_releases_url(workdir):
+    config = make_config(workdir, SEEDURL=",".join(SEEDS), THREADCOUNT=2)
+    scraper.configure(config)
+    frontier = Frontier(config, True)
+    scraped = list()
+    failed = Event()
+    workers = [
+        FailingWorker(worker_id, config, frontier, scraped, failed)
+        for worker_id in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(5)
+    try:
+        assert not any(worker.is_alive() for worker in workers)
+        assert failed.is_set()
+        assert len(scraped) == len(SEEDS) - 1
+        assert not frontier.in_progress
+    finally:
+        frontier.close()
+
+
+def test_status_check_unknown_status():
+    resp = html_response("https://www.ics.uci.edu/a", "", status=520)
+    assert scraper.status_check(resp) is False
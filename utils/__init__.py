@@ -1,6 +1,6 @@
 import os
 import logging
-from hashlib import sha256
+from hashlib import sha256, blake2b
 from urllib.parse import urlparse
 
 def get_logger(name, filename=None):
@@ -35,6 +35,15 @@ def get_urlhash(url):
         f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
         f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
 
+# The parts of the url get_urlhash hashes, as a non zero 64 bit int for
+# utils/urlset.py
+def get_urlfingerprint(url):
+    parsed = urlparse(url)
+    return int.from_bytes(blake2b(
+        f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
+        f"{parsed.query}/{parsed.fragment}".encode("utf-8"),
+        digest_size=8).digest(), "little") or 1
+
 def normalize(url):
     if url.endswith("/"):
         return url.rstrip("/")
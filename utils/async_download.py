@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+from urllib.parse import urlencode, urlparse
+
+from utils.download import (
+    to_response, error_response, retry_delay, is_transient)
+from utils.metrics import metrics
+
+
+class HTTPError(Exception):
+    pass
+
+
+class AsyncDownloader(object):
+    ''' Downloads urls through the cache server from an asyncio event loop,
+    with up to max_connections requests in flight. Connections are kept
+    alive and reused between requests. Timeouts, retries and the Response
+    returned are the same as for utils.download.Downloader. '''
+    def __init__(self, config, max_connections, logger=None):
+        self.config = config
+        self.logger = logger
+        self.slots = asyncio.Semaphore(max_connections)
+        # Open connections not in use, as (reader, writer)
+        self.idle = []
+
+    async def download(self, url):
+        start = time.monotonic()
+        for attempt in range(self.config.download_retries + 1):
+            if attempt:
+                await asyncio.sleep(retry_delay(self.config, attempt))
+            resp = await self._fetch(url)
+            if not is_transient(resp.status):
+                break
+            metrics.count("download.retries")
+            if self.logger:
+                self.logger.info(
+                    f"Download of {url} failed with status <{resp.status}> "
+                    f"(attempt {attempt + 1}).")
+        resp.latency = time.monotonic() - start
+        metrics.record("download", resp.latency, urlparse(url).netloc)
+        metrics.count(f"status.{resp.status}")
+        return resp
+
+    async def _fetch(self, url):
+        async with self.slots:
+            try:
+                status_code, content = await asyncio.wait_for(
+                    self._request(url), self.config.read_timeout)
+            except (OSError, EOFError, HTTPError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError, ValueError) as e:
+                return error_response(url, e)
+        return to_response(url, status_code, content, self.logger)
+
+    async def _connect(self):
+        host, port = self.config.cache_server
+        return await asyncio.wait_for(
+            asyncio.open_connection(host, port), self.config.connect_timeout)
+
+    async def _request(self, url):
+        host, port = self.config.cache_server
+        query = urlencode([("q", url), ("u", self.config.user_agent)])
+        request = (
+            f"GET /?{query} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            f"Connection: keep-alive\r\n\r\n").encode("ascii")
+
+        reused = bool(self.idle)
+        reader, writer = self.idle.pop() if reused else await self._connect()
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line and reused:
+                # The server closed the idle connection, try a fresh one.
+                writer.close()
+                reader, writer = await self._connect()
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+            status_code, content, keep_alive = await self._read_response(
+                status_line, reader)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+        return status_code, content
+
+    async def _read_response(self, status_line, reader):
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+            raise HTTPError(f"Bad status line {status_line!r}")
+        status_code = int(parts[1])
+
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = (
+            headers.get("connection", "").lower() != "close"
+            and parts[0] != b"HTTP/1.0")
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Skip the trailer.
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b"".join(chunks)
+        elif "content-length" in headers:
+            content = await reader.readexactly(int(headers["content-length"]))
+        else:
+            # The body runs until the server closes the connection.
+            content = await reader.read()
+            keep_alive = False
+        return status_code, content, keep_alive
+
+    async def close(self):
+        while self.idle:
+            reader, writer = self.idle.pop()
+            writer.close()
@@ -1,6 +1,17 @@
+import os
 import re
 
 
+# This function will return the (host, port) of each node in NODES
+def parse_nodes(nodes):
+    addresses = list()
+    for node in nodes.split(","):
+        if node.strip():
+            host, port = node.strip().rsplit(":", 1)
+            addresses.append((host, int(port)))
+    return addresses
+
+
 class Config(object):
     def __init__(self, config):
         self.user_agent = config["IDENTIFICATION"]["USERAGENT"].strip()
@@ -8,12 +19,79 @@ class Config(object):
         assert self.user_agent != "DEFAULT AGENT", "Set useragent in config.ini"
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
+        self.engine = config["LOCAL PROPERTIES"].get("ENGINE", "threads")
+        self.async_fetches = int(
+            config["LOCAL PROPERTIES"].get("ASYNCFETCHES", "100"))
+        self.parse_processes = int(
+            config["LOCAL PROPERTIES"].get("PARSEPROCESSES", "0")
+            ) or os.cpu_count()
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.storage = config["LOCAL PROPERTIES"].get("STORAGE", "shelve")
+        self.commit_records = int(
+            config["LOCAL PROPERTIES"].get("COMMITRECORDS", "500"))
+        self.commit_interval = float(
+            config["LOCAL PROPERTIES"].get("COMMITINTERVAL", "200"))
+        self.metrics_port = int(
+            config["LOCAL PROPERTIES"].get("METRICSPORT", "0"))
+        self.metrics_interval = float(
+            config["LOCAL PROPERTIES"].get("METRICSINTERVAL", "60"))
+        self.url_bloom_bits = int(
+            config["LOCAL PROPERTIES"].get("URLBLOOMBITS", "0"))
+        self.priority = config["LOCAL PROPERTIES"].get("PRIORITY", "value")
+        self.queue_budget = int(
+            config["LOCAL PROPERTIES"].get("QUEUEBUDGET", "100000"))
+        self.revisit_interval = float(
+            config["LOCAL PROPERTIES"].get("REVISITINTERVAL", "86400"))
+        self.state_interval = float(
+            config["LOCAL PROPERTIES"].get("STATEINTERVAL", "30"))
+        self.segment_bytes = int(
+            config["LOCAL PROPERTIES"].get("SEGMENTBYTES", "67108864"))
+        self.nodes = parse_nodes(config["LOCAL PROPERTIES"].get("NODES", ""))
+        self.node_id = int(config["LOCAL PROPERTIES"].get("NODEID", "0"))
+        self.forward_batch = int(
+            config["LOCAL PROPERTIES"].get("FORWARDBATCH", "500"))
+        self.forward_interval = float(
+            config["LOCAL PROPERTIES"].get("FORWARDINTERVAL", "0.2"))
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.connect_timeout = float(
+            config["CONNECTION"].get("CONNECTTIMEOUT", "5"))
+        self.read_timeout = float(config["CONNECTION"].get("READTIMEOUT", "30"))
+        self.download_retries = int(config["CONNECTION"].get("RETRIES", "2"))
+        self.retry_backoff = float(
+            config["CONNECTION"].get("RETRYBACKOFF", "0.5"))
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        self.parser = config["CRAWLER"].get("PARSER", "auto")
+        self.tokenizer = config["CRAWLER"].get("TOKENIZER", "regex")
+        self.simhash_distance = int(
+            config["CRAWLER"].get("SIMHASHDISTANCE", "3"))
+        self.max_body_size = int(
+            config["CRAWLER"].get("MAXBODYSIZE", "10485760"))
+        self.robots = config["CRAWLER"].getboolean("ROBOTS", True)
+        self.robots_ttl = float(config["CRAWLER"].get("ROBOTSTTL", "86400"))
+        self.trap_window = int(config["CRAWLER"].get("TRAPWINDOW", "50"))
+        self.trap_throttle_yield = float(
+            config["CRAWLER"].get("TRAPTHROTTLEYIELD", "0.2"))
+        self.trap_cutoff_yield = float(
+            config["CRAWLER"].get("TRAPCUTOFFYIELD", "0.02"))
+        self.trap_allowed = [
+            template.strip() for template in
+            config["CRAWLER"].get("TRAPALLOW", "").split(",")
+            if template.strip()]
+        self.trap_max_templates = int(
+            config["CRAWLER"].get("TRAPTEMPLATES", "20000"))
+        self.rate_control = config["CRAWLER"].getboolean("RATECONTROL", True)
+        self.rate_increase = float(
+            config["CRAWLER"].get("RATEINCREASE", "0.2"))
+        self.rate_backoff = float(config["CRAWLER"].get("RATEBACKOFF", "0.5"))
+        self.rate_latency_factor = float(
+            config["CRAWLER"].get("RATELATENCYFACTOR", "2"))
+        self.rate_max_delay = float(
+            config["CRAWLER"].get("RATEMAXDELAY", "60"))
 
-        self.cache_server = None
\ No newline at end of file
+        self.cache_server = None
+        # Set by launch.py --recrawl
+        self.recrawl = False
\ No newline at end of file
@@ -2,20 +2,119 @@ import requests
 import cbor
 import time
 
+from threading import local
+from requests.adapters import HTTPAdapter
+
+from urllib.parse import urlparse
+
 from utils.response import Response
+from utils.metrics import metrics
 
-def download(url, config, logger=None):
-    host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+# Status of a response the cache server never answered (timeout, refused
+# connection, ...). It is not an http status, and lies outside the cache
+# server's own 6xx errors so it cannot be taken for one of its verdicts.
+DOWNLOAD_ERROR = 700
+
+# Cache server errors a retry can fix: 601 (it failed to download the url)
+# and 602 (the server itself failed). Its other errors (a malformed or
+# disallowed url, a page too big, robots.txt denying it) come back the same
+# every time.
+TRANSIENT_CACHE_ERRORS = frozenset([601, 602])
+
+
+# This function will tell whether a download that returned status may
+# succeed when tried again: 5xx, the transient cache errors and downloads
+# the cache server never answered
+def is_transient(status):
+    return (500 <= status < 600 or status in TRANSIENT_CACHE_ERRORS
+            or status == DOWNLOAD_ERROR)
+
+
+# This function will turn the cache server's answer into a Response
+def to_response(url, status_code, content, logger=None):
     try:
-        if resp and resp.content:
-            return Response(cbor.loads(resp.content))
+        if status_code < 400 and content:
+            return Response(cbor.loads(content))
     except (EOFError, ValueError) as e:
         pass
-    logger.error(f"Spacetime Response error {resp} with url {url}.")
+    if logger:
+        logger.error(
+            f"Spacetime Response error <Response [{status_code}]> "
+            f"with url {url}.")
     return Response({
-        "error": f"Spacetime Response error {resp} with url {url}.",
-        "status": resp.status_code,
+        "error": f"Spacetime Response error <Response [{status_code}]> "
+                 f"with url {url}.",
+        "status": status_code,
         "url": url})
+
+
+# This function will give the seconds to wait before retry number attempt
+def retry_delay(config, attempt):
+    return config.retry_backoff * 2 ** (attempt - 1)
+
+
+def error_response(url, error):
+    return Response({
+        "error": f"Download error {error!r} with url {url}.",
+        "status": DOWNLOAD_ERROR,
+        "url": url})
+
+
+class Downloader(object):
+    ''' Downloads urls through the cache server. Requests go over one
+    keep-alive session, so consecutive pages reuse the same connection.
+    A session is not thread safe, so each worker owns its own. Responses
+    with a 5xx status, transient cache errors and failed connections are
+    retried with exponential backoff. '''
+    def __init__(self, config, logger=None):
+        self.config = config
+        self.logger = logger
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=1))
+        self.timeout = (config.connect_timeout, config.read_timeout)
+        # Seconds the last download took, retries included
+        self.last_latency = None
+
+    def download(self, url):
+        start = time.monotonic()
+        for attempt in range(self.config.download_retries + 1):
+            if attempt:
+                time.sleep(retry_delay(self.config, attempt))
+            resp = self._fetch(url)
+            if not is_transient(resp.status):
+                break
+            metrics.count("download.retries")
+            if self.logger:
+                self.logger.info(
+                    f"Download of {url} failed with status <{resp.status}> "
+                    f"(attempt {attempt + 1}).")
+        resp.latency = self.last_latency = time.monotonic() - start
+        metrics.record("download", resp.latency, urlparse(url).netloc)
+        metrics.count(f"status.{resp.status}")
+        return resp
+
+    def _fetch(self, url):
+        host, port = self.config.cache_server
+        try:
+            resp = self.session.get(
+                f"http://{host}:{port}/",
+                params=[("q", f"{url}"), ("u", f"{self.config.user_agent}")],
+                timeout=self.timeout)
+        except requests.RequestException as e:
+            return error_response(url, e)
+        return to_response(url, resp.status_code, resp.content, self.logger)
+
+    def close(self):
+        self.session.close()
+
+
+# One downloader per thread for callers without their own
+_downloaders = local()
+
+def download(url, config, logger=None):
+    downloader = getattr(_downloaders, "downloader", None)
+    if downloader is None or downloader.config is not config:
+        downloader = _downloaders.downloader = Downloader(config, logger)
+    elif logger is not None:
+        downloader.logger = logger
+    return downloader.download(url)
@@ -0,0 +1,151 @@
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+from urllib.parse import urlparse, urljoin
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Visible text and raw hrefs of a page, collected in one pass
+Page = namedtuple("Page", ["text", "hrefs"])
+
+# Text inside these tags is not part of the visible text of a page
+SKIP_TEXT_TAGS = {"script", "style", "template"}
+
+# Encoding declared by the page itself, e.g. <meta charset="utf-8">
+DECLARED_ENCODING = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_.:-]+)""", re.I)
+
+# Parser backend in use, see set_backend()
+backend = "lxml" if etree is not None else "html.parser"
+
+
+# Parser target that collects the visible text and the a hrefs of a page.
+# It follows the lxml target interface, so lxml can drive it directly.
+class PageCollector(object):
+    def __init__(self):
+        self.text = []
+        self.hrefs = []
+        self.skip_depth = 0
+
+    def start(self, tag, attrs):
+        tag = tag.lower()
+        if tag in SKIP_TEXT_TAGS:
+            self.skip_depth += 1
+        elif tag == "a":
+            href = attrs.get("href")
+            if href:
+                self.hrefs.append(href)
+
+    def end(self, tag):
+        if tag.lower() in SKIP_TEXT_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def data(self, data):
+        if not self.skip_depth:
+            self.text.append(data)
+
+    def comment(self, text):
+        # lxml passes CDATA sections on as comments. BeautifulSoup counts
+        # their text as visible, so they are kept too.
+        if text.startswith("[CDATA[") and text.endswith("]]"):
+            self.data(text[len("[CDATA["):-len("]]")])
+
+    def close(self):
+        return Page("".join(self.text), self.hrefs)
+
+
+# Feeds the standard library tokenizer events into a PageCollector
+class StdlibParser(HTMLParser):
+    def __init__(self, target):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, dict(attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.target.start(tag, dict(attrs))
+        self.target.end(tag)
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+    def unknown_decl(self, data):
+        # <![CDATA[...]]> outside script and style
+        if data.startswith("CDATA["):
+            self.target.data(data[len("CDATA["):])
+
+
+# This function will select the parser backend: "lxml", "html.parser"
+# or "auto" for lxml when it is installed
+def set_backend(name):
+    global backend
+    if name == "auto":
+        name = "lxml" if etree is not None else "html.parser"
+    if name == "lxml" and etree is None:
+        raise ValueError("Parser backend lxml is not installed.")
+    if name not in ("lxml", "html.parser"):
+        raise ValueError(f"Unknown parser backend {name!r}.")
+    backend = name
+
+
+# This function will decode the page the way BeautifulSoup does: the
+# encoding the page declares, then utf-8, then windows-1252
+def decode(content):
+    if isinstance(content, str):
+        return content
+    declared = DECLARED_ENCODING.search(content[:2048])
+    encodings = [declared.group(1).decode("ascii")] if declared else []
+    for encoding in encodings + ["utf-8"]:
+        try:
+            return str(content, encoding)
+        except (LookupError, UnicodeDecodeError):
+            pass
+    return str(content, "windows-1252", errors="replace")
+
+
+# This function will parse the page once and return its visible text
+# together with the hrefs of every a tag
+def extract_page(content):
+    html = decode(content)
+    collector = PageCollector()
+    if backend == "lxml":
+        parser = etree.HTMLParser(target=collector)
+        parser.feed(html)
+        return parser.close()
+    parser = StdlibParser(collector)
+    parser.feed(html)
+    parser.close()
+    return collector.close()
+
+
+# This function will turn the hrefs of a page into absolute urls without
+# fragments, query or params
+def resolve_links(url, hrefs):
+    ori = urlparse(url)
+    links = []
+    for mod_link in hrefs:
+        # ignore the fragement url
+        if mod_link[0] == "#":
+            continue
+
+        mod_parsed = urlparse(mod_link)
+
+        # convert relative url to absoulate url
+        if mod_parsed.scheme == "":
+            if ori.path == "":
+                mod_link = url + mod_link
+            else:
+                mod_link = urljoin(url, mod_link)
+
+        # reconstruct the absoluate url
+        mod_parsed = urlparse(mod_link)
+        links.append(
+            mod_parsed.scheme + "://" + mod_parsed.netloc + mod_parsed.path)
+    return links
@@ -0,0 +1,268 @@
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+from threading import Thread, Lock, local
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from utils import get_logger
+
+# Durations go into buckets of powers of two microseconds, the last one
+# takes everything from about 35 minutes up.
+BUCKETS = 32
+
+
+class Stat(object):
+    ''' Count, total, max and a log2 histogram of the durations of one
+    stage. '''
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket if bucket < BUCKETS else BUCKETS - 1] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for i, count in enumerate(other.buckets):
+            self.buckets[i] += count
+
+    def percentile(self, fraction):
+        # Bucket i holds durations of 2**(i - 1) up to 2**i microseconds,
+        # the percentile is interpolated within its bucket.
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                low = (1 << i >> 1) / 1e6
+                high = (1 << i) / 1e6
+                estimate = low + (high - low) * (rank - seen) / count
+                return min(estimate, self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_s": round(self.total, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3)
+            if self.count else 0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Metrics(object):
+    ''' Timers and counters for the stages of the crawl, per stage and per
+    host.
+
+    Every thread adds to accumulators of its own, so recording takes no
+    lock. snapshot() adds up the accumulators of all threads; it may see
+    a thread's latest durations half added, which only matters for that
+    one sample.
+
+    profile(seconds) runs cProfile in every thread that records anything
+    in that time, since a profiler only sees the thread it runs in, and
+    merges the results. '''
+    def __init__(self):
+        self.local = local()
+        # (stats, counters) of every thread that recorded anything
+        self.threads = list()
+        self.lock = Lock()
+        self.started = time.time()
+        # End of the profiling run in progress, 0 when there is none
+        self.profile_until = 0
+        self.profiles = list()
+
+    def _accumulators(self):
+        local = self.local
+        try:
+            return local.stats, local.counters
+        except AttributeError:
+            local.stats = dict()
+            local.counters = dict()
+            local.profiler = None
+            with self.lock:
+                self.threads.append((local.stats, local.counters))
+            return local.stats, local.counters
+
+    def record(self, stage, seconds, host=None):
+        ''' Adds one duration of stage, for host too if it is given. '''
+        stats, counters = self._accumulators()
+        stat = stats.get((stage, None))
+        if stat is None:
+            stat = stats[(stage, None)] = Stat()
+        stat.add(seconds)
+        if host is not None:
+            stat = stats.get((stage, host))
+            if stat is None:
+                stat = stats[(stage, host)] = Stat()
+            stat.add(seconds)
+        if self.profile_until or self.local.profiler is not None:
+            self._profile_thread()
+
+    def count(self, name, amount=1):
+        stats, counters = self._accumulators()
+        counters[name] = counters.get(name, 0) + amount
+
+    def snapshot(self):
+        ''' Returns the totals of all threads as a dict that can be
+        written as json. '''
+        stages = dict()
+        counters = dict()
+        with self.lock:
+            threads = list(self.threads)
+        for thread_stats, thread_counters in threads:
+            for key, stat in list(thread_stats.items()):
+                total = stages.get(key)
+                if total is None:
+                    total = stages[key] = Stat()
+                total.merge(stat)
+            for name, amount in list(thread_counters.items()):
+                counters[name] = counters.get(name, 0) + amount
+        snapshot = {
+            "time": time.time(),
+            "uptime_s": round(time.time() - self.started, 3),
+            "stages": dict(),
+            "hosts": dict(),
+            "counters": counters,
+        }
+        for (stage, host), stat in sorted(
+                stages.items(), key=lambda item: (item[0][0], item[0][1] or "")
+                ):
+            if host is None:
+                snapshot["stages"][stage] = stat.summary()
+            else:
+                snapshot["hosts"].setdefault(host, dict())[stage] = (
+                    stat.summary())
+        return snapshot
+
+    def write_snapshot(self, path):
+        # Replaced at once, so readers never see half a file
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as snapshot_file:
+            json.dump(self.snapshot(), snapshot_file, indent=1)
+        os.replace(temp_path, path)
+
+    def _profile_thread(self):
+        # Starts or stops the profiler of this thread
+        local = self.local
+        now = time.monotonic()
+        if local.profiler is None:
+            if now < self.profile_until:
+                local.profiler = cProfile.Profile()
+                local.profiler.enable()
+        elif not self.profile_until or now >= self.profile_until:
+            local.profiler.disable()
+            with self.lock:
+                self.profiles.append(local.profiler)
+            local.profiler = None
+
+    def profile(self, seconds, path):
+        ''' Profiles the recording threads for seconds seconds, dumps the
+        merged stats to path and returns the top functions as text. '''
+        with self.lock:
+            if self.profile_until:
+                return "A profile is already being taken.\n"
+            self.profiles = list()
+            self.profile_until = time.monotonic() + seconds
+        # A little longer, for threads to see the end and hand in their
+        # profile on their next record()
+        time.sleep(seconds + 1)
+        with self.lock:
+            self.profile_until = 0
+            profiles, self.profiles = self.profiles, list()
+        if not profiles:
+            return "No thread recorded anything while profiling.\n"
+        report = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=report)
+        for profiler in profiles[1:]:
+            stats.add(profiler)
+        stats.dump_stats(path)
+        report.write(f"{len(profiles)} threads profiled, saved to {path}\n")
+        stats.sort_stats("cumulative").print_stats(40)
+        return report.getvalue()
+
+
+# The metrics of this process
+metrics = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    ''' GET /metrics returns the snapshot as json. GET /profile?seconds=N
+    profiles the crawl for N seconds and returns the top functions. '''
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == "/metrics":
+            body = json.dumps(metrics.snapshot(), indent=1).encode("utf-8")
+            content_type = "application/json"
+        elif parsed.path == "/profile":
+            seconds = float(parse_qs(parsed.query).get("seconds", ["10"])[0])
+            path = os.path.join(
+                "Logs", time.strftime("profile-%Y%m%d-%H%M%S.prof"))
+            body = metrics.profile(seconds, path).encode("utf-8")
+            content_type = "text/plain"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Where the snapshots are written
+SNAPSHOT_FILE = os.path.join("Logs", "metrics.json")
+
+
+# This function will return the snapshot file, one per node in a cluster
+# (see crawler/cluster.py) so nodes sharing a directory keep theirs apart
+def snapshot_file(config):
+    if config.nodes:
+        return os.path.join("Logs", f"metrics.node{config.node_id}.json")
+    return SNAPSHOT_FILE
+
+
+def start_reporting(config):
+    ''' Serves the metrics on METRICSPORT and writes them to
+    Logs/metrics.json every METRICSINTERVAL seconds, as configured. '''
+    logger = get_logger("METRICS")
+    if config.metrics_port:
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", config.metrics_port), MetricsHandler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(
+            f"Serving metrics on http://127.0.0.1:{config.metrics_port}"
+            f"/metrics.")
+    if config.metrics_interval:
+        def write_snapshots():
+            while True:
+                time.sleep(config.metrics_interval)
+                metrics.write_snapshot(snapshot_file(config))
+        Thread(target=write_snapshots, daemon=True).start()
+
+
+def stop_reporting(config):
+    ''' Writes the last snapshot once the crawl is over. '''
+    if config.metrics_interval:
+        metrics.write_snapshot(snapshot_file(config))
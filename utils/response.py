@@ -1,14 +1,70 @@
+import time
 import pickle
+from hashlib import blake2b
+
+from utils.metrics import metrics
 
 class Response(object):
+    ''' The cache server's answer for one url. The url, status, error and
+    size of the page are read right away. The page itself (a pickled
+    requests.Response) is only unpickled when raw_response, headers or
+    content is first used, so pages rejected before that never are. '''
     def __init__(self, resp_dict):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"])
-                if "response" in resp_dict else
-                None)
-        except TypeError:
-            self.raw_response = None
+        # Seconds the download took, set by the downloader
+        self.latency = None
+        self._blob = resp_dict.get("response")
+        self._decoded = False
+        self._raw_response = None
+        self._digest = None
+        # False if the cache server sent no page
+        self.has_response = self._blob is not None
+        # Bytes of the pickled page, a bound on the size of its body
+        self.size = len(self._blob) if self._blob is not None else 0
+
+    @property
+    def raw_response(self):
+        if not self._decoded:
+            start = time.perf_counter()
+            try:
+                self._raw_response = (
+                    pickle.loads(self._blob)
+                    if self._blob is not None else
+                    None)
+            except TypeError:
+                self._raw_response = None
+            # The page is now held by raw_response
+            self._blob = None
+            self._decoded = True
+            metrics.record("unpickle", time.perf_counter() - start)
+        return self._raw_response
+
+    @property
+    def decoded(self):
+        ''' True once the page has been unpickled. '''
+        return self._decoded
+
+    @property
+    def headers(self):
+        raw_response = self.raw_response
+        return raw_response.headers if raw_response is not None else {}
+
+    @property
+    def content(self):
+        ''' The body as a memoryview, so slicing it does not copy. '''
+        raw_response = self.raw_response
+        if raw_response is None or raw_response.content is None:
+            return memoryview(b"")
+        return memoryview(raw_response.content)
+
+    @property
+    def digest(self):
+        ''' A signed 64 bit blake2b of the body, to tell whether a page
+        changed since it was last fetched. '''
+        if self._digest is None:
+            self._digest = int.from_bytes(
+                blake2b(self.content, digest_size=8).digest(), "little",
+                signed=True)
+        return self._digest
@@ -0,0 +1,172 @@
+import os
+import mmap
+import time
+import zlib
+import shutil
+from array import array
+from collections import namedtuple
+from threading import Lock
+
+from utils.urlset import fingerprint
+from utils.metrics import metrics
+
+# Each segment is a data file, MAGIC followed by one zlib compressed record
+# per page, and an index file of (offset, length, url fingerprint) per
+# record as unsigned 64 bit ints. A record is the url, the url of the page
+# ("" if the same), "1" for a near duplicate or "0", the tokens joined by
+# spaces and the outlinks joined by spaces, on lines of their own.
+MAGIC = b"PAGESEG1"
+DATA_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+INDEX_FIELDS = 3
+
+# One page as it was scraped
+PageRecord = namedtuple(
+    "PageRecord", ["url", "page_url", "duplicate", "tokens", "links"])
+
+
+def encode_record(url, page_url, duplicate, tokens, links):
+    ''' tokens is the token stream joined by spaces. '''
+    return zlib.compress("\n".join((
+        url, page_url if page_url != url else "", "1" if duplicate else "0",
+        tokens, " ".join(links))).encode("utf-8"))
+
+
+def decode_record(data):
+    url, page_url, duplicate, tokens, links = zlib.decompress(
+        data).decode("utf-8").split("\n")
+    return PageRecord(
+        url, page_url or url, duplicate == "1",
+        tokens.split(" ") if tokens else [],
+        links.split(" ") if links else [])
+
+
+# This function will return the (number, data file path) of the segments
+# in directory, oldest first
+def segment_files(directory):
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    for name in os.listdir(directory):
+        if name.endswith(DATA_SUFFIX):
+            segments.append((
+                int(name[:-len(DATA_SUFFIX)]), os.path.join(directory, name)))
+    return sorted(segments)
+
+
+class SegmentWriter(object):
+    ''' Appends the pages the scraper analyzed to segment files in a
+    directory, each compressed on its own so any one can be read back
+    without the rest. A segment is closed once it holds max_bytes and the
+    next one is started; a resumed crawl starts a new one as well, so
+    files are only ever appended to by one writer.
+
+    Writes are buffered, and flushed and fsynced before every frontier
+    commit, so a page is never saved as complete without its record. A
+    crash can only lose the records of pages that were not saved as
+    complete yet, and those are crawled again on resume. '''
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = segment_files(directory)
+        self.number = segments[-1][0] if segments else 0
+        self.data_file = self.index_file = None
+        self._roll()
+
+    @staticmethod
+    def remove(directory):
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+
+    def _roll(self):
+        if self.data_file is not None:
+            self.data_file.close()
+            self.index_file.close()
+        self.number += 1
+        base = os.path.join(self.directory, f"{self.number:08d}")
+        self.data_file = open(base + DATA_SUFFIX, "wb")
+        self.index_file = open(base + INDEX_SUFFIX, "wb")
+        self.data_file.write(MAGIC)
+        self.size = len(MAGIC)
+
+    def add(self, url, page_url, duplicate, tokens, links):
+        start = time.perf_counter()
+        record = encode_record(url, page_url, duplicate, tokens, links)
+        with self.lock:
+            if self.size + len(record) > self.max_bytes and (
+                    self.size > len(MAGIC)):
+                self._roll()
+            self.data_file.write(record)
+            self.index_file.write(
+                array("Q", (self.size, len(record), fingerprint(url))))
+            self.size += len(record)
+        metrics.record("segments.write", time.perf_counter() - start)
+
+    def flush(self):
+        start = time.perf_counter()
+        with self.lock:
+            for segment_file in (self.data_file, self.index_file):
+                segment_file.flush()
+                os.fsync(segment_file.fileno())
+        metrics.record("segments.flush", time.perf_counter() - start)
+
+    def close(self):
+        with self.lock:
+            self.data_file.close()
+            self.index_file.close()
+
+
+class SegmentReader(object):
+    ''' Reads a segment through a memory map: reader[i] decompresses the
+    i-th record only. Index entries of records cut off by a crash are left
+    out. '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as data_file:
+            self._map = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a page segment.")
+        self.index = read_index(path)
+
+    def __len__(self):
+        return len(self.index) // INDEX_FIELDS
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        offset = self.index[position * INDEX_FIELDS]
+        length = self.index[position * INDEX_FIELDS + 1]
+        return decode_record(self._map[offset:offset + length])
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def url_fingerprints(self):
+        return self.index[INDEX_FIELDS - 1::INDEX_FIELDS]
+
+    def close(self):
+        self._map.close()
+
+
+# This function will read the index of the segment at path, without the
+# entries past the end of its data file
+def read_index(path):
+    index = array("Q")
+    index_path = path[:-len(DATA_SUFFIX)] + INDEX_SUFFIX
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as index_file:
+            data = index_file.read()
+        entry_size = INDEX_FIELDS * index.itemsize
+        index.frombytes(data[:len(data) - len(data) % entry_size])
+    data_size = os.path.getsize(path)
+    count = len(index) // INDEX_FIELDS
+    while count and (
+            index[(count - 1) * INDEX_FIELDS]
+            + index[(count - 1) * INDEX_FIELDS + 1] > data_size):
+        count -= 1
+    del index[count * INDEX_FIELDS:]
+    return index
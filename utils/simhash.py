@@ -0,0 +1,97 @@
+from array import array
+from hashlib import blake2b
+
+
+# This function will hash one feature to 64 bits. blake2b is not salted
+# per process like hash(), so fingerprints are stable across restarts.
+def feature_hash(feature):
+    return int.from_bytes(
+        blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# This function will compute the 64 bit SimHash of a page from the set of
+# its words. Bit i is set when most words have bit i set in their hash.
+def simhash(words):
+    features = set(words)
+    if not features:
+        return 0
+    bits = [format(feature_hash(feature), "064b") for feature in features]
+    half = len(features) / 2
+    fingerprint = 0
+    # zip(*bits) walks the fingerprints one bit column at a time
+    for column in zip(*bits):
+        fingerprint = (fingerprint << 1) | (column.count("1") > half)
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex(object):
+    ''' Fingerprints of the pages seen so far, for near-duplicate lookups.
+
+    Two fingerprints within max_distance bits of each other agree on at
+    least one of max_distance + 1 bands (pigeonhole), so a lookup only
+    compares against the fingerprints sharing a band with it. The
+    fingerprints live in one array; each band maps its value to the
+    positions of the fingerprints with that value. '''
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.fingerprints = array("Q")
+        bands = max_distance + 1
+        width = 64 // bands
+        # (shift, mask) of each band, the last one takes the leftover bits
+        self.bands = []
+        for i in range(bands):
+            bits = 64 - i * width if i == bands - 1 else width
+            self.bands.append((i * width, (1 << bits) - 1))
+        self.tables = [dict() for _ in self.bands]
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def find(self, fingerprint):
+        ''' Returns an indexed fingerprint within max_distance bits, or
+        None. '''
+        for (shift, mask), table in zip(self.bands, self.tables):
+            positions = table.get((fingerprint >> shift) & mask)
+            if positions is None:
+                continue
+            for position in positions:
+                other = self.fingerprints[position]
+                if hamming_distance(fingerprint, other) <= self.max_distance:
+                    return other
+        return None
+
+    def add(self, fingerprint):
+        position = len(self.fingerprints)
+        self.fingerprints.append(fingerprint)
+        for (shift, mask), table in zip(self.bands, self.tables):
+            band = (fingerprint >> shift) & mask
+            positions = table.get(band)
+            if positions is None:
+                table[band] = [position]
+            else:
+                positions.append(position)
+
+    def extend(self, fingerprints):
+        ''' Indexes many fingerprints, one band at a time. '''
+        start = len(self.fingerprints)
+        self.fingerprints.extend(fingerprints)
+        for (shift, mask), table in zip(self.bands, self.tables):
+            for position, fingerprint in enumerate(fingerprints, start):
+                band = (fingerprint >> shift) & mask
+                positions = table.get(band)
+                if positions is None:
+                    table[band] = [position]
+                else:
+                    positions.append(position)
+
+    def seen(self, fingerprint):
+        ''' Returns True if a near duplicate is indexed, otherwise indexes
+        the fingerprint and returns False. '''
+        if self.find(fingerprint) is not None:
+            return True
+        self.add(fingerprint)
+        return False
@@ -0,0 +1,317 @@
+import os
+import time
+import zlib
+import shutil
+import struct
+from array import array
+from queue import Queue
+from threading import Thread, Lock
+
+from utils import get_logger
+from utils.metrics import metrics
+
+# Segment layout: magic, segment number, crc32 of the body, then the number
+# of visited, unique and simhash fingerprints, of words and of hosts, and
+# the word count of the longest page. The body is zlib compressed: the
+# three fingerprint arrays, the word counts, the host counts, then the
+# words, the hosts and the longest url joined by newlines.
+MAGIC = b"CRSTATE1"
+HEADER = struct.Struct("<8sIIQQQQQQ")
+
+# The base holds everything up to the segment number in its header
+BASE_FILE = "base.state"
+
+# Segments are merged into the base once there are this many of them
+COMPACT_SEGMENTS = 32
+
+
+class PageDelta(object):
+    ''' What one page added to the crawl statistics. '''
+    __slots__ = (
+        "visited", "unique", "host", "words", "simhash", "longest_count",
+        "longest_url")
+
+    def __init__(self):
+        self.visited = None
+        self.unique = None
+        self.host = None
+        self.words = None
+        self.simhash = None
+        self.longest_count = 0
+        self.longest_url = None
+
+
+class StateSegment(object):
+    ''' The statistics of a group of pages: fingerprints of the visited
+    urls, the unique urls and the pages' SimHashes, word and subdomain
+    counts, and the longest page. A segment of every page so far is the
+    whole state. '''
+    def __init__(self):
+        self.visited = array("Q")
+        self.unique = array("Q")
+        self.simhash = array("Q")
+        self.words = dict()
+        self.hosts = dict()
+        self.longest_count = 0
+        self.longest_url = None
+
+    def __len__(self):
+        return len(self.visited)
+
+    def add_page(self, delta):
+        if delta.visited is not None:
+            self.visited.append(delta.visited)
+        if delta.unique is not None:
+            self.unique.append(delta.unique)
+        if delta.simhash is not None:
+            self.simhash.append(delta.simhash)
+        if delta.host is not None:
+            self.hosts[delta.host] = self.hosts.get(delta.host, 0) + 1
+        if delta.words:
+            words = self.words
+            for word, count in delta.words.items():
+                words[word] = words.get(word, 0) + count
+        if delta.longest_count > self.longest_count:
+            self.longest_count = delta.longest_count
+            self.longest_url = delta.longest_url
+
+    def merge(self, other):
+        self.visited.extend(other.visited)
+        self.unique.extend(other.unique)
+        self.simhash.extend(other.simhash)
+        for counts, other_counts in (
+                (self.words, other.words), (self.hosts, other.hosts)):
+            for key, count in other_counts.items():
+                counts[key] = counts.get(key, 0) + count
+        if other.longest_count > self.longest_count:
+            self.longest_count = other.longest_count
+            self.longest_url = other.longest_url
+
+    def to_bytes(self, number):
+        words = list(self.words)
+        hosts = list(self.hosts)
+        names = words + hosts + [self.longest_url or ""]
+        body = zlib.compress(b"".join((
+            self.visited.tobytes(),
+            self.unique.tobytes(),
+            self.simhash.tobytes(),
+            array("Q", [self.words[word] for word in words]).tobytes(),
+            array("Q", [self.hosts[host] for host in hosts]).tobytes(),
+            "\n".join(names).encode("utf-8"))), 1)
+        return HEADER.pack(
+            MAGIC, number, zlib.crc32(body), len(self.visited),
+            len(self.unique), len(self.simhash), len(words), len(hosts),
+            self.longest_count) + body
+
+    @classmethod
+    def from_bytes(cls, data):
+        ''' Returns the segment number and the segment. Raises ValueError
+        if data is not a whole segment. '''
+        if len(data) < HEADER.size:
+            raise ValueError("truncated segment")
+        (magic, number, crc, visited, unique, simhash, words, hosts,
+         longest_count) = HEADER.unpack_from(data)
+        body = memoryview(data)[HEADER.size:]
+        if magic != MAGIC or zlib.crc32(body) != crc:
+            raise ValueError("not a state segment, or a damaged one")
+        body = zlib.decompress(body)
+        segment = cls()
+        offset = 0
+        arrays = list()
+        for count in (visited, unique, simhash, words, hosts):
+            values = array("Q")
+            values.frombytes(body[offset:offset + count * 8])
+            offset += count * 8
+            arrays.append(values)
+        segment.visited, segment.unique, segment.simhash = arrays[:3]
+        names = body[offset:].decode("utf-8").split("\n")
+        segment.words = dict(zip(names[:words], arrays[3]))
+        segment.hosts = dict(zip(names[words:words + hosts], arrays[4]))
+        segment.longest_count = longest_count
+        segment.longest_url = names[-1] or None
+        return number, segment
+
+
+class StateStore(object):
+    ''' Keeps the crawl statistics of the scraper in a directory next to
+    the save file, so a resumed crawl picks them up where it stopped.
+
+    The scraper notes what each page adds in a PageDelta. Once the
+    frontier marks the page complete, the delta is ready, and at the
+    first frontier commit at least interval seconds after the last
+    checkpoint the ready deltas are written as one segment. The frontier
+    holds back the completion of a page until its delta is on disk, and
+    its links were committed before that, so after a crash a page either
+    has both its completion and its statistics saved or neither, and is
+    downloaded and counted again.
+
+    Segments are written by a thread of their own and merged into the
+    base file once there are COMPACT_SEGMENTS of them. Each file is
+    replaced at once, so a crash never leaves half of one behind. '''
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.logger = get_logger("STATE")
+        self.lock = Lock()
+        # Deltas of the pages that are not complete yet, by url
+        self.pending = dict()
+        # (delta, urlhash, url) of the completed pages, until written
+        self.ready = list()
+        # (urlhash, url) of the pages whose deltas are written
+        self.saved = list()
+        self.closed = False
+        self.last_checkpoint = time.monotonic()
+        os.makedirs(path, exist_ok=True)
+        self.next_number = self._last_number() + 1
+        self.writes = Queue()
+        self.writer = Thread(target=self._write_segments, daemon=True)
+        self.writer.start()
+
+    @staticmethod
+    def remove(path):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    def page(self, url):
+        ''' Returns the delta of url, to be filled in while it is
+        scraped. '''
+        with self.lock:
+            delta = self.pending.get(url)
+            if delta is None:
+                delta = self.pending[url] = PageDelta()
+            return delta
+
+    def complete(self, urlhash, url):
+        ''' Called when the frontier marks url complete. Returns whether
+        url has a delta, in which case the frontier saves its completion
+        once checkpoint returns it. '''
+        with self.lock:
+            delta = self.pending.pop(url, None)
+            if delta is None:
+                return False
+            self.ready.append((delta, urlhash, url))
+            return True
+
+    def checkpoint(self, force=False):
+        ''' Called after each frontier commit. Hands the ready deltas to
+        the writer once interval seconds have passed, and returns the
+        (urlhash, url) of the pages whose deltas have been written since
+        the last call. '''
+        with self.lock:
+            saved, self.saved = self.saved, list()
+        if self.closed or not force and (
+                time.monotonic() - self.last_checkpoint < self.interval):
+            return saved
+        with self.lock:
+            ready, self.ready = self.ready, list()
+        self.last_checkpoint = time.monotonic()
+        if ready:
+            self.writes.put(ready)
+        return saved
+
+    def load(self):
+        ''' Returns a StateSegment of everything saved so far. '''
+        start = time.perf_counter()
+        state, upto = self._read_base()
+        segments = 0
+        for number, name in self._segment_files():
+            if number <= upto:
+                continue
+            try:
+                _, segment = self._read(name)
+            except ValueError as err:
+                self.logger.warning(f"Skipping segment {name}: {err}.")
+                continue
+            state.merge(segment)
+            segments += 1
+        self.logger.info(
+            f"Loaded {len(state)} pages and {len(state.words)} words from "
+            f"{self.path}, {segments} segments after the base, in "
+            f"{time.perf_counter() - start:.2f}s.")
+        return state
+
+    def close(self):
+        ''' Writes the remaining ready deltas, waits for the writer and
+        returns the pages checkpoint has not returned yet. '''
+        saved = self.checkpoint(force=True)
+        self.closed = True
+        self.writes.put(None)
+        self.writer.join()
+        return saved + self.saved
+
+    def _write_segments(self):
+        while True:
+            ready = self.writes.get()
+            if ready is None:
+                return
+            start = time.perf_counter()
+            segment = StateSegment()
+            for delta, _, _ in ready:
+                segment.add_page(delta)
+            number = self.next_number
+            self.next_number += 1
+            size = self._write(
+                os.path.join(self.path, f"{number:08d}.segment"),
+                segment.to_bytes(number))
+            metrics.record("state.checkpoint", time.perf_counter() - start)
+            metrics.count("state.bytes", size)
+            with self.lock:
+                self.saved.extend(
+                    (urlhash, url) for _, urlhash, url in ready)
+            if len(self._segment_files()) >= COMPACT_SEGMENTS:
+                self._compact()
+
+    def _compact(self):
+        # Merges the base and all segments into a new base, then deletes
+        # the segments it took in.
+        start = time.perf_counter()
+        state, upto = self._read_base()
+        for number, name in self._segment_files():
+            if number > upto:
+                state.merge(self._read(name)[1])
+                upto = number
+        size = self._write(
+            os.path.join(self.path, BASE_FILE), state.to_bytes(upto))
+        for number, name in self._segment_files():
+            if number <= upto:
+                os.remove(os.path.join(self.path, name))
+        self.logger.info(
+            f"Compacted the state of {len(state)} pages into {size} bytes "
+            f"in {time.perf_counter() - start:.2f}s.")
+
+    def _read_base(self):
+        if not os.path.exists(os.path.join(self.path, BASE_FILE)):
+            return StateSegment(), 0
+        upto, state = self._read(BASE_FILE)
+        return state, upto
+
+    def _read(self, name):
+        with open(os.path.join(self.path, name), "rb") as segment_file:
+            return StateSegment.from_bytes(segment_file.read())
+
+    def _write(self, path, data):
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as segment_file:
+            segment_file.write(data)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+        os.replace(temp_path, path)
+        return len(data)
+
+    def _segment_files(self):
+        # (number, file name) of the segments, oldest first
+        segments = list()
+        for name in os.listdir(self.path):
+            if name.endswith(".segment"):
+                segments.append((int(name[:-len(".segment")]), name))
+        return sorted(segments)
+
+    def _last_number(self):
+        numbers = [number for number, _ in self._segment_files()]
+        base_path = os.path.join(self.path, BASE_FILE)
+        if os.path.exists(base_path):
+            with open(base_path, "rb") as base_file:
+                header = base_file.read(HEADER.size)
+            if len(header) == HEADER.size:
+                numbers.append(HEADER.unpack(header)[1])
+        return max(numbers, default=0)
@@ -0,0 +1,68 @@
+import re
+
+# Characters word_tokenize always splits tokens on, besides whitespace:
+# ascii punctuation, backticks, the unicode quotes and the figure, en and
+# em dashes, so "it’s" and "hello—world" come apart.
+SPLIT_CHARS = r";@#$%&*?!()\[\]{}<>\"`«»“”‘’„\u2012-\u2015"
+
+# Places where NLTK's word_tokenize splits a word without whitespace:
+# contractions ("don't" -> "do n't"), run-together words ("cannot" ->
+# "can not"), "--", "...", "''" and an opening "'". Group 1 and 2 are the
+# halves to keep.
+SPLITS = re.compile(
+    r"(?i)(?<=[^'\s])(n't|'s|'m|'d|'ll|'re|'ve)"
+    r"(?=[\s,:" + SPLIT_CHARS + r"]|--|\.\.|''|$)"
+    r"|\b(can)(not)\b|\b(gim)(me)\b|\b(gon)(na)\b|\b(got)(ta)\b"
+    r"|\b(lem)(me)\b|\b(wan)(na)(?=\s|$)"
+    r"|\b(d)('ye)\b|\b(more)('n)\b"
+    r"|--|\.\.\.|''|(?<!\w)'(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)")
+
+# Anything that is neither an ascii letter nor a character word_tokenize
+# splits tokens on. Deleting these joins the letters of a token, as
+# stripping every token with re.sub(r'[^a-zA-Z]', '', ...) did. A comma or
+# colon splits unless a digit follows ("3,36").
+NON_WORD = re.compile(
+    r"(?:[^a-zA-Z\s,:" + SPLIT_CHARS + r"]|[,:](?=\d))+")
+
+# Words of two or more letters
+WORD = re.compile(r"[a-z]{2,}")
+
+
+def _split(match):
+    halves = [half for half in match.groups() if half]
+    return " " + " ".join(halves) + " "
+
+
+# This function will yield the lowercase alphabetic words of length two or
+# more in the text. It makes a few linear passes with precompiled regexes.
+def tokenize(text):
+    text = SPLITS.sub(_split, text)
+    text = NON_WORD.sub("", text).lower()
+    for match in WORD.finditer(text):
+        yield match.group()
+
+
+# The original scraper tokenizer: NLTK word_tokenize, then strip every
+# token down to its letters and drop the ones shorter than two letters.
+def nltk_tokenize(text):
+    from nltk.tokenize import word_tokenize
+
+    for word in word_tokenize(text):
+        word = re.sub(r'[^a-zA-Z]', '', word).lower()
+        if len(word) > 1:
+            yield word
+
+
+TOKENIZERS = {
+    "regex": tokenize,
+    "nltk": nltk_tokenize,
+}
+
+
+def get_tokenizer(name):
+    try:
+        return TOKENIZERS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown tokenizer {name!r}, "
+            f"expected one of {sorted(TOKENIZERS)}.")
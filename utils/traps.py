@@ -0,0 +1,365 @@
+import os
+import re
+import time
+import json
+from collections import deque, OrderedDict
+from queue import Queue
+from threading import Thread, Lock
+from urllib.parse import urlparse, parse_qsl
+
+from utils import get_logger
+from utils.metrics import metrics
+
+# States of a url template
+OPEN = "open"
+THROTTLED = "throttled"
+BLOCKED = "blocked"
+# Opened by hand with allow(), never throttled again
+ALLOWED = "allowed"
+
+# Path segments that look like ids: long hex strings, uuids, session
+# tokens and other long runs mixing letters and digits
+ID_SEGMENT = re.compile(
+    r"^(?=.*\d)([0-9a-fA-F-]{8,}|[A-Za-z0-9_-]{20,})$")
+DIGITS = re.compile(r"\d+")
+
+
+# This function will turn a url into its template: the host, the path with
+# numbers and ids collapsed, and the sorted names of the query parameters
+# without their values. E.g. https://wiki.ics.uci.edu/doku.php?id=a&rev=12
+# becomes wiki.ics.uci.edu/doku.php?id&rev
+def url_template(url):
+    parsed = urlparse(url)
+    segments = []
+    for segment in parsed.path.split("/"):
+        # ;jsessionid=... and the like only keep the semicolon
+        segment, semicolon, params = segment.partition(";")
+        if ID_SEGMENT.match(segment):
+            segment = "*"
+        segments.append(DIGITS.sub("#", segment) + semicolon)
+    template = parsed.netloc.lower() + "/".join(segments)
+    if parsed.params:
+        template += ";"
+    if parsed.query:
+        names = sorted(set(
+            name for name, value in parse_qsl(
+                parsed.query, keep_blank_values=True)))
+        template += "?" + "&".join(names)
+    return template
+
+
+class TemplateStats(object):
+    ''' Fetches of one url template, and whether each of the last window
+    of them yielded anything and how many new words it added. '''
+    __slots__ = (
+        "fetches", "new_words", "recent", "recent_words", "links", "state")
+
+    def __init__(self, window):
+        self.fetches = 0
+        self.new_words = 0
+        self.recent = deque(maxlen=window)
+        self.recent_words = deque(maxlen=window)
+        self.links = 0
+        self.state = OPEN
+
+    def yield_rate(self):
+        return sum(self.recent) / len(self.recent)
+
+    def to_dict(self):
+        return {
+            "state": self.state, "fetches": self.fetches,
+            "new_words": self.new_words, "recent": list(self.recent),
+            "recent_words": list(self.recent_words), "links": self.links}
+
+    @classmethod
+    def from_dict(cls, window, saved):
+        stats = cls(window)
+        stats.state = saved["state"]
+        stats.fetches = saved["fetches"]
+        stats.new_words = saved["new_words"]
+        stats.recent.extend(saved["recent"])
+        stats.recent_words.extend(saved["recent_words"])
+        stats.links = saved["links"]
+        return stats
+
+
+class TrapDetector(object):
+    ''' Finds crawler traps from what they yield instead of from their
+    shape. Urls are grouped per host into templates (see url_template),
+    and every fetched page counts as a yield for its template when it is
+    not a near duplicate and has enough words for the scraper to count
+    them.
+
+    Once a template has window fetches, it is throttled when fewer than
+    throttle_yield of its last window fetches yielded, or when none of
+    them added a word the crawl had not seen: only one in THROTTLE_SAMPLE
+    of its links is followed, so it can still show it has recovered. It
+    is blocked, and none of its links are followed, when fewer than
+    cutoff_yield yielded. Each change is logged to TRAPS.log and can be
+    undone with allow(); the templates in allowed are never throttled.
+
+    At most max_templates templates are kept. Past that, the open template
+    fetched least recently is dropped; most urls without numbers in their
+    path are a template of their own and are never fetched again. The
+    templates that are not open are always kept.
+
+    save() hands the templates changed since the last save to a
+    TrapJournal, and load() reads them back, so a resumed crawl keeps its
+    decisions. '''
+    THROTTLE_SAMPLE = 10
+
+    def __init__(
+            self, window=50, throttle_yield=0.2, cutoff_yield=0.02,
+            allowed=(), max_templates=20000):
+        self.window = window
+        self.throttle_yield = throttle_yield
+        self.cutoff_yield = cutoff_yield
+        self.max_templates = max(1, max_templates)
+        # Least recently fetched first
+        self.templates = OrderedDict()
+        self.lock = Lock()
+        self.logger = get_logger("TRAPS")
+        # Templates changed or dropped since the last save()
+        self.dirty = set()
+        self.allowed = set(allowed)
+        for template in self.allowed:
+            self.allow(template)
+
+    def admit(self, url):
+        ''' Returns False if a link should not be followed because of its
+        template. '''
+        if not self.window:
+            return True
+        template = url_template(url)
+        with self.lock:
+            stats = self.templates.get(template)
+            if stats is None or stats.state in (OPEN, ALLOWED):
+                return True
+            if stats.state == BLOCKED:
+                return False
+            stats.links += 1
+            return stats.links % self.THROTTLE_SAMPLE == 1
+
+    def record(self, url, useful, new_words=0):
+        ''' Counts a fetched url, whether it yielded anything and how many
+        new words it added. '''
+        if not self.window:
+            return
+        template = url_template(url)
+        with self.lock:
+            stats = self.templates.get(template)
+            if stats is None:
+                stats = self._add(template)
+            else:
+                self.templates.move_to_end(template)
+            self.dirty.add(template)
+            stats.fetches += 1
+            stats.new_words += new_words
+            stats.recent.append(useful)
+            stats.recent_words.append(new_words)
+            if stats.state == ALLOWED or len(stats.recent) < self.window:
+                return
+            rate = stats.yield_rate()
+            words = sum(stats.recent_words)
+            if rate < self.cutoff_yield:
+                state = BLOCKED
+            elif rate < self.throttle_yield or not words:
+                state = THROTTLED
+            else:
+                state = OPEN
+            if state != stats.state:
+                self._change(template, stats, state, (
+                    f"{rate:.0%} of the last {len(stats.recent)} fetches "
+                    f"yielded and added {words} new words, "
+                    f"{stats.fetches} fetches and {stats.new_words} new "
+                    f"words in total"))
+
+    def allow(self, template):
+        ''' Reverts a decision: the template is followed again and never
+        throttled from now on. '''
+        with self.lock:
+            stats = self.templates.get(template)
+            if stats is None:
+                stats = self._add(template)
+            self._change(template, stats, ALLOWED, "allowed by hand")
+
+    def decisions(self):
+        ''' Returns the templates that are not open, mapped to their state. '''
+        with self.lock:
+            return {
+                template: stats.state
+                for template, stats in self.templates.items()
+                if stats.state != OPEN}
+
+    def save(self, journal):
+        ''' Hands the templates changed since the last save to journal, or
+        all of them when the journal is due to be compacted. Only copies
+        them, the journal writes them from its own thread. '''
+        with self.lock:
+            if journal.compaction_due(len(self.templates)):
+                changes = {
+                    template: stats.to_dict()
+                    for template, stats in self.templates.items()}
+                replace = True
+            else:
+                changes = dict()
+                for template in self.dirty:
+                    stats = self.templates.get(template)
+                    changes[template] = (
+                        stats.to_dict() if stats is not None else None)
+                replace = False
+            self.dirty.clear()
+        if changes or replace:
+            journal.write(changes, replace)
+
+    def load(self, journal):
+        ''' Reads the templates saved in journal. The allowed templates
+        stay allowed. '''
+        saved = journal.read()
+        with self.lock:
+            for template, stats in saved.items():
+                stats = TemplateStats.from_dict(self.window, stats)
+                if template in self.allowed:
+                    stats.state = ALLOWED
+                self.templates.pop(template, None)
+                self.templates[template] = stats
+                self._evict()
+        decisions = self.decisions()
+        self.logger.info(
+            f"Loaded {len(saved)} templates from {journal.path}, "
+            f"{len(decisions)} not open: {decisions}.")
+
+    def _add(self, template):
+        stats = self.templates[template] = TemplateStats(self.window)
+        self._evict()
+        return stats
+
+    def _evict(self):
+        # Drops the least recently fetched open templates while there are
+        # more than max_templates. The others met on the way are moved to
+        # the end, so they are not looked at again for a while.
+        for _ in range(len(self.templates)):
+            if len(self.templates) <= self.max_templates:
+                return
+            template, stats = next(iter(self.templates.items()))
+            if stats.state == OPEN:
+                del self.templates[template]
+                self.dirty.add(template)
+                metrics.count("traps.evicted")
+            else:
+                self.templates.move_to_end(template)
+
+    def _change(self, template, stats, state, reason):
+        self.logger.info(
+            f"Template {template} {stats.state} -> {state}: {reason}.")
+        stats.state = state
+        stats.links = 0
+        self.dirty.add(template)
+
+
+class TrapJournal(object):
+    ''' Keeps the templates of a TrapDetector in a file of json lines,
+    [template, stats] for a template that changed and [template, null] for
+    one that was dropped; the last line of a template wins.
+
+    Lines are appended and fsynced by a thread of its own, so the frontier
+    does not wait for the disk while it holds its lock. Once the file has
+    COMPACT_FACTOR lines per template, it is replaced at once with a line
+    for each current template. '''
+    COMPACT_FACTOR = 4
+    COMPACT_MIN_LINES = 10000
+
+    def __init__(self, path):
+        self.path = path
+        self.logger = get_logger("TRAPS")
+        # Lines in the file, counting the ones still queued
+        self.lines = 0
+        self.writes = Queue()
+        self.writer = None
+
+    @staticmethod
+    def remove(path):
+        for name in (path, path + ".tmp"):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def read(self):
+        ''' Returns the saved templates, as TemplateStats.to_dict()s. '''
+        templates = dict()
+        self.lines = 0
+        if not os.path.exists(self.path):
+            return templates
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    template, stats = json.loads(line)
+                except ValueError:
+                    # The last line, cut short by a crash
+                    self.logger.warning(
+                        f"Skipping a damaged line in {self.path}.")
+                    break
+                self.lines += 1
+                if stats is None:
+                    templates.pop(template, None)
+                else:
+                    templates[template] = stats
+        return templates
+
+    def compaction_due(self, templates):
+        return self.lines >= max(
+            self.COMPACT_MIN_LINES, self.COMPACT_FACTOR * templates)
+
+    def write(self, changes, replace=False):
+        ''' Queues changes, a dict of template to its stats or None. With
+        replace, they are all the templates and replace the file. '''
+        if self.writer is None:
+            self.writer = Thread(target=self._write_lines, daemon=True)
+            self.writer.start()
+        self.lines = len(changes) if replace else self.lines + len(changes)
+        self.writes.put((changes, replace))
+
+    def close(self):
+        ''' Waits for the queued changes to be written. '''
+        if self.writer is not None:
+            self.writes.put(None)
+            self.writer.join()
+            self.writer = None
+
+    def _write_lines(self):
+        journal_file = open(self.path, "a")
+        try:
+            while True:
+                # Everything queued so far is written with one fsync
+                batch = [self.writes.get()]
+                while not self.writes.empty():
+                    batch.append(self.writes.get())
+                start = time.perf_counter()
+                for write in batch:
+                    if write is None:
+                        continue
+                    changes, replace = write
+                    if replace:
+                        journal_file.close()
+                        self._replace(changes)
+                        journal_file = open(self.path, "a")
+                    else:
+                        journal_file.writelines(
+                            json.dumps([template, stats]) + "\n"
+                            for template, stats in changes.items())
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+                metrics.record("traps.save", time.perf_counter() - start)
+                if None in batch:
+                    return
+        finally:
+            journal_file.close()
+
+    def _replace(self, templates):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as journal_file:
+            journal_file.writelines(
+                json.dumps([template, stats]) + "\n"
+                for template, stats in templates.items())
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temp_path, self.path)
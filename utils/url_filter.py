@@ -0,0 +1,120 @@
+import re
+from functools import lru_cache
+from urllib.parse import urlparse
+
+# Reasons a url is rejected, as returned by UrlClassifier
+SCHEME = "scheme"
+NO_HOST = "no-host"
+FRAGMENT = "fragment"
+DOMAIN = "domain"
+EXTENSION = "extension"
+LONG_PATH = "long-path"
+REPEATED_SEGMENT = "repeated-segment"
+EVENT = "event"
+CALENDAR = "calendar"
+GENEALOGY = "genealogy"
+
+ALLOWED_SCHEMES = frozenset(["http", "https"])
+
+# Domains that may be crawled
+ALLOWED_DOMAIN = re.compile(
+    r".*\.(ics.uci.edu|cs.uci.edu|informatics.uci.edu|stat.uci.edu"
+    r"|today.uci.edu/department/information_computer_sciences)")
+
+# Here is a rough check to filiter out by the end of path
+# Since we can't list all types, so we will check header in scraper function later
+# Remove the path with ova & apk which are typically large and no infomation
+# Advoid file like java, cpp, c, h, and json which are no valuable infomation in it
+# Don't get the bat, nna,, maf, etc... (no valuable infomation)
+BLOCKED_EXTENSIONS = frozenset([
+    "css", "js", "bmp", "gif", "jpeg", "jpg", "ico",
+    "png", "tiff", "tif", "mid", "mp2", "mp3", "mp4",
+    "wav", "avi", "mov", "mpeg", "ram", "m4v", "mkv", "ogg", "ogv", "pdf",
+    "ps", "eps", "tex", "ppt", "pptx", "doc", "docx", "xls", "xlsx", "names",
+    "data", "dat", "exe", "bz2", "tar", "msi", "bin", "7z", "psd", "dmg", "iso",
+    "epub", "dll", "cnf", "tgz", "sha1",
+    "thmx", "mso", "arff", "rtf", "jar", "csv",
+    "rm", "smil", "wmv", "swf", "wma", "zip", "rar", "gz", "bw", "gtf",
+    "ppsx", "txt", "php", "odp", "h", "cc", "py", "ova", "apk", "m", "tst",
+    "bat", "nna", "maf", "xml", "json", "cpp", "java"])
+
+# Paths longer than this are most likely traps
+MAX_PATH_LENGTH = 150
+
+# Number of verdicts each cache remembers
+CACHE_SIZE = 1 << 16
+
+
+class UrlClassifier(object):
+    ''' Decides which urls may be crawled. All rules are compiled once and
+    the verdicts for each (host, path) are kept in a bounded LRU cache.
+    The same links show up on page after page, so whole urls are cached
+    in front of that as well, which also saves parsing them again.
+    Every check returns None for an accepted url or the reason code of
+    the first rule that rejects it. '''
+    def __init__(self, cache_size=CACHE_SIZE):
+        self._check_location = lru_cache(maxsize=cache_size)(
+            self._check_location)
+        self._check_traps = lru_cache(maxsize=cache_size)(self._check_traps)
+        self.classify = lru_cache(maxsize=cache_size)(self.classify)
+        self.trap_reason = lru_cache(maxsize=cache_size)(self.trap_reason)
+
+    def classify(self, url):
+        ''' The rules of scraper.is_valid, except for the visited check. '''
+        parsed = urlparse(url)
+        # check the scheme
+        if parsed.scheme not in ALLOWED_SCHEMES:
+            return SCHEME
+        # if no domain name is presented
+        if not parsed.netloc:
+            return NO_HOST
+        # defragment the url
+        if parsed.fragment != "":
+            return FRAGMENT
+        return self._check_location(parsed.netloc, parsed.path)
+
+    def trap_reason(self, url):
+        ''' The rules of scraper.safty_check. '''
+        parsed = urlparse(url)
+        return self._check_traps(parsed.netloc, parsed.path)
+
+    def cache_info(self):
+        return self.classify.cache_info(), self._check_location.cache_info()
+
+    @staticmethod
+    def _check_location(host, path):
+        # chech the domain
+        if not ALLOWED_DOMAIN.match(host):
+            return DOMAIN
+        # the extension is whatever follows the last dot of the path
+        head, dot, extension = path.rpartition(".")
+        if dot and extension.lower() in BLOCKED_EXTENSIONS:
+            return EXTENSION
+        return None
+
+    @staticmethod
+    def _check_traps(host, path):
+        # 1. Long path url
+        if len(path) > MAX_PATH_LENGTH:
+            return LONG_PATH
+
+        # 2. Repeating direction
+        path_element = path.split("/")
+        if "" in path_element:
+            path_element.remove("")
+        if len(path_element) != len(set(path_element)):
+            return REPEATED_SEGMENT
+
+        # 3. Event pages
+        if "/event" in path:
+            return EVENT
+
+        # 4. Calendar pages
+        if "/calendar" in path:
+            return CALENDAR
+
+        # 5. Genealogy pages
+        if "/Family" in path or "/Families" in path:
+            return GENEALOGY
+
+        return None
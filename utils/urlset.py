@@ -0,0 +1,223 @@
+import os
+import mmap
+import math
+import struct
+from array import array
+from hashlib import blake2b
+
+# File layout: magic, number of fingerprints, number of slots, bloom
+# filter bytes and bloom hashes, then the slots and the bloom filter.
+MAGIC = b"URLSET1\0"
+HEADER = struct.Struct("<8sQQQQ")
+
+# The table doubles before more than 2/3 of its slots are used
+MIN_SLOTS = 1 << 10
+
+
+# This function will hash a url to a non zero 64 bit fingerprint. 0 marks
+# an empty slot in the table.
+def fingerprint(url):
+    return int.from_bytes(
+        blake2b(url.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+class FingerprintSet(object):
+    ''' A set of urls that only keeps a 64 bit fingerprint of each url, in
+    one array of slots with linear probing. That is 12 to 24 bytes a url,
+    where a set of url strings takes well over 100.
+
+    Two urls with the same fingerprint are the same url to the set, so a
+    new url is taken for a seen one with probability len(self) / 2**64.
+    Over a whole crawl of n urls the expected number of urls lost that
+    way is about n**2 / 2**65: 0.000003 for 10 million urls, 0.03 for a
+    billion.
+
+    With bloom_bits > 0 a Bloom filter of that many bits a url sits in
+    front of the table. Most lookups in a crawl are for links that were
+    never seen, and the filter answers those without touching the table,
+    which pays off once a large mapped table is not all in memory. Its
+    false positives (about 1% at 10 bits) only cost a probe.
+
+    save() writes the set to a file and load() maps it back in copy on
+    write, so a large set is usable again at once and pages are only read
+    as they are touched. '''
+    def __init__(self, key=fingerprint, bloom_bits=0):
+        self.key = key
+        self.bloom_bits = bloom_bits
+        self.count = 0
+        # Mapped file and the view of it, after load()
+        self._mmap = self._view = None
+        self.slots, self.bloom = self._new_table(MIN_SLOTS)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, url):
+        return self.contains_fingerprint(self.key(url))
+
+    def add(self, url):
+        ''' Adds a url. Returns True if it was not in the set before. '''
+        return self.add_fingerprint(self.key(url))
+
+    def contains_fingerprint(self, value):
+        if self.bloom is not None and not self._bloom_check(value):
+            return False
+        slots = self.slots
+        mask = len(slots) - 1
+        position = value & mask
+        while True:
+            slot = slots[position]
+            if slot == value:
+                return True
+            if slot == 0:
+                return False
+            position = (position + 1) & mask
+
+    def add_fingerprint(self, value):
+        if not self._insert(self.slots, self.bloom, value):
+            return False
+        self.count += 1
+        if self.count * 3 > len(self.slots) * 2:
+            self._resize(len(self.slots) * 2)
+        return True
+
+    def update_fingerprints(self, values):
+        ''' Adds many fingerprints at once, growing the table only once. '''
+        size = len(self.slots)
+        while (self.count + len(values)) * 3 > size * 2:
+            size *= 2
+        if size != len(self.slots):
+            self._resize(size)
+        insert, slots, bloom = self._insert, self.slots, self.bloom
+        added = 0
+        for value in values:
+            if insert(slots, bloom, value):
+                added += 1
+        self.count += added
+
+    def memory_usage(self):
+        ''' Bytes taken by the slots and the Bloom filter. '''
+        bloom = len(self.bloom) if self.bloom is not None else 0
+        return len(self.slots) * 8 + bloom
+
+    def _insert(self, slots, bloom, value):
+        mask = len(slots) - 1
+        position = value & mask
+        while True:
+            slot = slots[position]
+            if slot == value:
+                return False
+            if slot == 0:
+                break
+            position = (position + 1) & mask
+        slots[position] = value
+        if bloom is not None:
+            self._bloom_add(bloom, value)
+        return True
+
+    def _new_table(self, size):
+        slots = array("Q", bytes(size * 8))
+        bloom = None
+        self.bloom_hashes = 0
+        if self.bloom_bits > 0:
+            # Sized for the most fingerprints the table holds before it
+            # grows, with the number of hashes that minimizes false
+            # positives at that fill.
+            bloom = bytearray(max(8, size * 2 // 3 * self.bloom_bits // 8))
+            self.bloom_hashes = max(1, round(self.bloom_bits * math.log(2)))
+        return slots, bloom
+
+    def _resize(self, size):
+        # The new table is filled before it replaces the old one, so
+        # lookups from other threads never see it half built.
+        old_slots, old_bloom = self.slots, self.bloom
+        slots, bloom = self._new_table(size)
+        for value in old_slots:
+            if value:
+                self._insert(slots, bloom, value)
+        self.slots, self.bloom = slots, bloom
+        self._unmap(old_slots, old_bloom)
+
+    # Bloom filter positions come from the two halves of the fingerprint
+    # (double hashing), so no more hashing is needed.
+    def _bloom_check(self, value):
+        bloom = self.bloom
+        bits = len(bloom) * 8
+        position = value & 0xFFFFFFFF
+        step = (value >> 32) | 1
+        for _ in range(self.bloom_hashes):
+            position %= bits
+            if not bloom[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+        return True
+
+    def _bloom_add(self, bloom, value):
+        bits = len(bloom) * 8
+        position = value & 0xFFFFFFFF
+        step = (value >> 32) | 1
+        for _ in range(self.bloom_hashes):
+            position %= bits
+            bloom[position >> 3] |= 1 << (position & 7)
+            position += step
+
+    def save(self, path):
+        ''' Writes the set to path, replacing the file at once so a crash
+        never leaves half a set behind. '''
+        bloom = self.bloom if self.bloom is not None else b""
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as set_file:
+            set_file.write(HEADER.pack(
+                MAGIC, self.count, len(self.slots), len(bloom),
+                self.bloom_hashes))
+            set_file.write(self.slots.tobytes())
+            set_file.write(bloom)
+            set_file.flush()
+            os.fsync(set_file.fileno())
+        os.replace(temp_path, path)
+
+    def load(self, path):
+        ''' Maps a set written by save() into memory, copy on write: adding
+        to it never changes the file. Raises ValueError if path is not a
+        whole set file. '''
+        with open(path, "rb") as set_file:
+            if os.fstat(set_file.fileno()).st_size < HEADER.size:
+                raise ValueError(f"{path} is not a url set file.")
+            set_map = mmap.mmap(
+                set_file.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, count, size, bloom_size, bloom_hashes = HEADER.unpack_from(
+            set_map)
+        expected_size = HEADER.size + size * 8 + bloom_size
+        if magic != MAGIC or len(set_map) != expected_size:
+            set_map.close()
+            raise ValueError(f"{path} is not a url set file.")
+        self._unmap(self.slots, self.bloom)
+        self._mmap = set_map
+        self._view = view = memoryview(set_map)
+        self.slots = view[HEADER.size:HEADER.size + size * 8].cast("Q")
+        self.count = count
+        if bloom_size and self.bloom_bits > 0:
+            self.bloom = view[HEADER.size + size * 8:]
+            self.bloom_hashes = bloom_hashes
+        else:
+            # The file was saved with another Bloom filter setting, so
+            # the filter is dropped or built again from the slots.
+            self.bloom = None
+            if self.bloom_bits > 0:
+                self._resize(size)
+
+    def _unmap(self, slots, bloom):
+        # Called once the table no longer points into the mapped file. The
+        # file can only be closed when no view of it is left.
+        if self._mmap is None:
+            return
+        for view in (slots, bloom, self._view):
+            if isinstance(view, memoryview):
+                view.release()
+        self._mmap.close()
+        self._mmap = self._view = None
+
+    def close(self):
+        ''' Copies a mapped set into memory and unmaps the file. '''
+        if self._mmap is not None:
+            self._resize(len(self.slots))
@@ -0,0 +1,63 @@
+from collections import Counter
+from heapq import nlargest
+from operator import itemgetter
+from threading import RLock
+
+
+class WordFrequency(object):
+    ''' Word counts with an incrementally maintained top k.
+
+    Counts only ever grow, so a word can only enter the top k by passing
+    the smallest count in it. Each merge touches just the words it adds
+    plus the current top k, and top k queries never look at the rest of
+    the vocabulary. Partial counts, e.g. of one page or of one worker,
+    are combined with merge(). '''
+    def __init__(self, k=100):
+        self.k = k
+        self.counts = Counter()
+        # word -> count for the current top k words
+        self.top = dict()
+        # smallest count in the top k once it is full
+        self.floor = 0
+        self.lock = RLock()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, word):
+        return self.counts[word]
+
+    def update(self, words):
+        ''' Counts an iterable of words. '''
+        return self.merge(Counter(words))
+
+    def merge(self, partial):
+        ''' Adds partial counts, a mapping of word -> count or another
+        WordFrequency. Returns how many of the words were new. '''
+        if isinstance(partial, WordFrequency):
+            with partial.lock:
+                partial = dict(partial.counts)
+        new_words = 0
+        with self.lock:
+            counts = self.counts
+            top = self.top
+            for word, count in partial.items():
+                total = counts[word] + count
+                if total == count:
+                    new_words += 1
+                counts[word] = total
+                if word in top or total > self.floor or len(top) < self.k:
+                    top[word] = total
+            if len(top) > self.k:
+                self.top = top = dict(
+                    nlargest(self.k, top.items(), key=itemgetter(1)))
+            if len(top) >= self.k:
+                self.floor = min(top.values())
+        return new_words
+
+    def most_common(self, n=None):
+        ''' Returns up to n (at most k) (word, count) pairs, most frequent
+        first. '''
+        with self.lock:
+            top = sorted(self.top.items(), key=itemgetter(1), reverse=True)
+        return top[:n] if n is not None else top